@@ -0,0 +1,109 @@
+"""
+Benchmark parse time and peak memory of the streaming blocklist parser against
+the previous approach of loading the full list and running a regex per line.
+Generates a large synthetic list in each of the supported formats.
+
+    python benchmarks/bench_blocklist_parser.py --lines 1000000
+"""
+import argparse
+import os
+import random
+import re
+import string
+import tempfile
+import time
+import tracemalloc
+from consentcrawl.blocklists import parse_lines
+
+
+def random_domain():
+    labels = random.randint(1, 3)
+    return (
+        ".".join(
+            "".join(random.choices(string.ascii_lowercase, k=random.randint(3, 12)))
+            for _ in range(labels)
+        )
+        + ".com"
+    )
+
+
+FORMATS = {
+    "hostfile": lambda: f"0.0.0.0 {random_domain()}",
+    "blocklist": lambda: random.choice(
+        [
+            f"||{random_domain()}^",
+            f"||{random_domain()}^$third-party",
+            f"@@||{random_domain()}^",
+        ]
+    ),
+    "domains": random_domain,
+}
+
+
+def legacy_parse(path, list_type):
+    with open(path) as f:
+        text = f.read()
+
+    domains = []
+    if list_type == "hostfile":
+        for line in text.splitlines():
+            if not line.startswith("#"):
+                match = re.search(r"^\S+\s+(\S+)$", line)
+                if match:
+                    domains.append(match.group(1))
+    elif list_type == "blocklist":
+        for line in text.split("\n"):
+            if line.startswith("||"):
+                match = re.search(r"^\|\|([^\/]+)\^$", line)
+                if match:
+                    domains.append(match.group(1))
+    else:
+        domains = text.split("\n")
+
+    return set(domains)
+
+
+def streaming_parse(path, list_type):
+    with open(path) as f:
+        return parse_lines(f, list_type)
+
+
+def measure(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+
+    # measure memory in a separate run as tracing slows down the parsing
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", default=500000, type=int)
+    args = parser.parse_args()
+
+    random.seed(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        for list_type, generate in FORMATS.items():
+            path = os.path.join(tmp, f"{list_type}.txt")
+            with open(path, "w") as f:
+                f.write("! synthetic list\n")
+                f.writelines(generate() + "\n" for _ in range(args.lines))
+
+            for name, function in [
+                ("legacy", legacy_parse),
+                ("streaming", streaming_parse),
+            ]:
+                elapsed, peak, count = measure(function, path, list_type)
+                print(
+                    f"{list_type:<10} {name:<10} {elapsed:6.2f}s  "
+                    f"peak {peak:7.1f} MB  {count} domains"
+                )
+
+
+if __name__ == "__main__":
+    main()
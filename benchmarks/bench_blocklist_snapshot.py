@@ -0,0 +1,114 @@
+"""
+Compare startup time and memory use of loading the blocklists into a dict
+(DomainIndex) with opening the memory-mapped snapshot (BlocklistSnapshot).
+Each mode runs in a fresh process so the RSS numbers don't influence each
+other. Uses a synthetic blocklist database unless --db_file is given.
+
+    python benchmarks/bench_blocklist_snapshot.py --size 150000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from consentcrawl.blocklists import Blocklists
+
+
+def rss_mb():
+    # resident set size in MB, Linux only
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def create_synthetic_db(db_file, size):
+    """
+    Database with `size` random domains spread over 7 lists. The lists are
+    marked as fetched just now, so Blocklists doesn't download anything.
+    """
+    list_ids = ["a", "b", "c", "d", "e", "f", "g"]
+    now = int(time.time())
+    conn = sqlite3.connect(db_file)
+    for table_name in [Blocklists.TABLE_NAME, Blocklists.EXCEPTIONS_TABLE_NAME]:
+        conn.execute(f"CREATE TABLE {table_name} (list_id TEXT, domain TEXT)")
+    conn.execute(
+        f"""
+        CREATE TABLE {Blocklists.SOURCES_TABLE_NAME} (
+            id TEXT PRIMARY KEY,
+            url TEXT,
+            etag TEXT,
+            last_modified TEXT,
+            domains INTEGER,
+            last_fetch_time INTEGER,
+            last_update_time INTEGER
+        )"""
+    )
+    conn.executemany(
+        f"INSERT INTO {Blocklists.TABLE_NAME} VALUES (?, ?)",
+        (
+            (list_id, domain)
+            for domain in (
+                "".join(random.choices(string.ascii_lowercase, k=10)) + ".com"
+                for _ in range(size)
+            )
+            for list_id in random.sample(list_ids, 2)
+        ),
+    )
+    conn.executemany(
+        f"INSERT INTO {Blocklists.SOURCES_TABLE_NAME} VALUES (?, ?, NULL, NULL, NULL, ?, ?)",
+        ((list_id, f"https://example.com/{list_id}", now, now) for list_id in list_ids),
+    )
+    conn.commit()
+    conn.close()
+
+
+def child(db_file, snapshot):
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    domains = Blocklists(db_file=db_file, snapshot=snapshot).get_domains()
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(100000):
+        "stats.g.doubleclick.net" in domains
+    lookup_time = time.perf_counter() - start
+
+    print(
+        f"{'snapshot' if snapshot else 'dict':<10} load {load_time * 1000:8.1f} ms  "
+        f"RSS +{rss_mb() - rss_before:6.1f} MB  "
+        f"lookup {lookup_time / 100000 * 1e6:5.2f} µs/host"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db_file", default=None, help="Existing blocklist database")
+    parser.add_argument("--size", default=150000, type=int)
+    parser.add_argument("--child", default=None, choices=["dict", "snapshot"])
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.db_file, args.child == "snapshot")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = args.db_file
+        if db_file is None:
+            db_file = os.path.join(tmp, "blocklists.db")
+            create_synthetic_db(db_file, args.size)
+
+        # build the snapshot once so the snapshot run measures opening it
+        Blocklists(db_file=db_file, snapshot=True)
+
+        for mode in ["dict", "snapshot"]:
+            subprocess.run(
+                [sys.executable, __file__, "--db_file", db_file, "--child", mode],
+                check=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Compare the latency of consent manager detection with a single in-page
+script against checking every consent manager with Playwright locators.
+Requires a browser and network access; the consent managers are detected but
+not clicked.
+
+    python benchmarks/bench_consent_manager_detection.py dumky.net,leboncoin.fr
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from playwright.async_api import async_playwright
+from consentcrawl import crawl, consent_managers as cmps
+
+
+async def main(urls, browser_config):
+    consent_managers = cmps.get_registry().get_consent_managers()
+    timings = {"script": [], "locator": []}
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(**browser_config)
+        for url in urls:
+            page = await browser.new_page()
+            try:
+                await page.goto(
+                    url if url.startswith("http") else f"http://{url}",
+                    wait_until="load",
+                    timeout=60000,
+                )
+                await page.wait_for_timeout(3000)
+
+                found = {}
+                for detection in timings:
+                    start = time.perf_counter()
+                    cmp, _, selector = await crawl.find_consent_manager(
+                        page, consent_managers, detection=detection
+                    )
+                    timings[detection].append((time.perf_counter() - start) * 1000)
+                    found[detection] = cmp.id if cmp else None
+
+                print(
+                    f"{url:<30} script {timings['script'][-1]:7.1f} ms  "
+                    f"locator {timings['locator'][-1]:7.1f} ms  {found}"
+                )
+            except Exception as e:
+                print(f"{url:<30} error: {e}")
+            finally:
+                await page.close()
+
+        await browser.close()
+
+    for detection, values in timings.items():
+        if values:
+            print(
+                f"{detection:<8} median {statistics.median(values):7.1f} ms  "
+                f"max {max(values):7.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("urls", help="Comma separated list of URLs")
+    parser.add_argument("--channel", default="msedge")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.urls.split(","), {"headless": True, "channel": args.channel}))
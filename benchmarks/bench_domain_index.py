@@ -0,0 +1,77 @@
+"""
+Micro-benchmark for matching hosts against the blocklists.
+
+Compares the suffix-aware DomainIndex with the exact hostname lookup that was
+used before. Uses the blocklists from an existing database when --db_file is
+given, otherwise a synthetic list of the same order of magnitude.
+
+    python benchmarks/bench_domain_index.py --hosts 2000000
+"""
+import argparse
+import random
+import string
+import time
+from consentcrawl.blocklists import Blocklists, DomainIndex
+
+
+def random_label(length=8):
+    return "".join(random.choices(string.ascii_lowercase, k=length))
+
+
+def synthetic_blocklist(size):
+    return {
+        f"{random_label()}.{random.choice(['com', 'net', 'io', 'fr'])}": ["synthetic"]
+        for _ in range(size)
+    }
+
+
+def generate_hosts(domains, count, listed_share=0.3):
+    """
+    Generate hosts of which a share are (subdomains of) listed domains.
+    """
+    hosts = []
+    for _ in range(count):
+        if random.random() < listed_share:
+            domain = random.choice(domains)
+            prefix = ".".join(random_label(4) for _ in range(random.randint(0, 3)))
+            hosts.append(f"{prefix}.{domain}" if prefix else domain)
+        else:
+            hosts.append(f"www.{random_label()}.{random_label(3)}.com")
+    return hosts
+
+
+def run(name, lookup, hosts):
+    start = time.perf_counter()
+    matches = sum(1 for h in hosts if lookup(h))
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:<28} {elapsed:6.2f}s  {len(hosts) / elapsed / 1e6:5.2f}M hosts/s  "
+        f"{matches} matches"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db_file", default=None, help="Existing blocklist database")
+    parser.add_argument("--size", default=150000, type=int)
+    parser.add_argument("--hosts", default=1000000, type=int)
+    args = parser.parse_args()
+
+    random.seed(42)
+    if args.db_file:
+        index = Blocklists(db_file=args.db_file).get_domains()
+    else:
+        index = DomainIndex(synthetic_blocklist(args.size))
+
+    domains = list(index)
+    hosts = generate_hosts(domains, args.hosts)
+    exact = set(domains)
+    print(f"{len(index)} listed domains, {len(hosts)} hosts")
+
+    run("exact (set)", exact.__contains__, hosts)
+    run("DomainIndex.__contains__", index.__contains__, hosts)
+    run("DomainIndex.match", index.match, hosts)
+
+
+if __name__ == "__main__":
+    main()
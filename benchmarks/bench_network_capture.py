@@ -0,0 +1,117 @@
+"""
+Compare the request capture backends (page, context and CDP) on the same page
+loads: the number of events, the time spent handling them in Python and the
+third party domains each backend sees. All backends listen to the same page at
+the same time so they see the same traffic. Requires a browser and network
+access.
+
+    python benchmarks/bench_network_capture.py dumky.net,leboncoin.fr
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from playwright.async_api import async_playwright
+from consentcrawl import network
+
+BACKENDS = ["page", "context", "cdp"]
+
+
+class TimedCapture(network.RequestCapture):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.handling_time = 0.0
+
+    def add(self, url):
+        start = time.perf_counter()
+        super().add(url)
+        self.handling_time += time.perf_counter() - start
+
+    def on_request(self, request):
+        # include the cost of reading the URL from the Playwright request
+        start = time.perf_counter()
+        url = request.url
+        self.handling_time += time.perf_counter() - start
+        self.add(url)
+
+
+async def main(urls, browser_config, wait):
+    overhead = {backend: [] for backend in BACKENDS}
+    coverage = {backend: [] for backend in BACKENDS}
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(**browser_config)
+        for url in urls:
+            url = url if url.startswith("http") else f"http://{url}"
+            domain_name = url.split("//")[1].split("/")[0]
+            browser_context = await browser.new_context()
+            page = await browser_context.new_page()
+            captures = {
+                backend: TimedCapture(
+                    network.RequestClassifier(domain_name), backend=backend
+                )
+                for backend in BACKENDS
+            }
+            try:
+                for capture in captures.values():
+                    await capture.start(browser_context, page)
+
+                await page.goto(url, wait_until="load", timeout=60000)
+                await page.wait_for_timeout(wait)
+                for capture in captures.values():
+                    await capture.stop()
+
+                domains = {
+                    backend: set(capture.classifier.get_third_party_domains())
+                    for backend, capture in captures.items()
+                }
+                all_domains = set().union(*domains.values())
+                line = [f"{url:<30}"]
+                for backend, capture in captures.items():
+                    per_event = capture.handling_time / max(capture.events, 1) * 1e6
+                    overhead[backend].append(per_event)
+                    coverage[backend].append(
+                        len(domains[backend]) / max(len(all_domains), 1)
+                    )
+                    line.append(
+                        f"{backend} {capture.events:5d} events "
+                        f"{per_event:5.1f} us/event {len(domains[backend]):3d} domains"
+                    )
+                print("  ".join(line))
+
+                for backend, backend_domains in domains.items():
+                    missing = all_domains - backend_domains
+                    if missing:
+                        print(f"  {backend} missed: {', '.join(sorted(missing))}")
+
+            except Exception as e:
+                print(f"{url:<30} error: {e}")
+            finally:
+                await browser_context.close()
+
+        await browser.close()
+
+    for backend in BACKENDS:
+        if overhead[backend]:
+            print(
+                f"{backend:<8} median {statistics.median(overhead[backend]):5.1f} us/event  "
+                f"mean coverage {statistics.mean(coverage[backend]):.2f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("urls", help="Comma separated list of URLs")
+    parser.add_argument(
+        "--wait", default=5000, type=int, help="ms to wait after the page loaded"
+    )
+    parser.add_argument("--channel", default="msedge")
+    args = parser.parse_args()
+
+    asyncio.run(
+        main(
+            args.urls.split(","),
+            {"headless": True, "channel": args.channel},
+            args.wait,
+        )
+    )
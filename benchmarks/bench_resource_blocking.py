@@ -0,0 +1,107 @@
+"""
+Compare crawling with blocked resources (images, media and fonts) against
+loading everything: crawl time and whether the same third party domains,
+tracking domains, cookies and consent managers are found. Requires a browser
+and network access.
+
+    python benchmarks/bench_resource_blocking.py dumky.net,leboncoin.fr
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from playwright.async_api import async_playwright
+from consentcrawl import crawl, blocklists
+
+COMPARED_FIELDS = [
+    "third_party_domains_no_consent",
+    "third_party_domains_all",
+    "tracking_domains_no_consent",
+    "tracking_domains_all",
+    "cookies_no_consent",
+    "cookies_all",
+]
+
+
+def values(result, field):
+    if field.startswith("cookies"):
+        return {(c["name"], c["domain"]) for c in result[field] or []}
+    return set(result[field] or [])
+
+
+def similarity(a, b):
+    if len(a | b) == 0:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+async def main(urls, browser_config, block_resources):
+    tracking_domains = blocklists.Blocklists().get_domains()
+    modes = {"full": None, "blocked": block_resources}
+    timings = {mode: [] for mode in modes}
+    scores = {field: [] for field in COMPARED_FIELDS + ["consent_manager"]}
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(**browser_config)
+        for url in urls:
+            results = {}
+            for mode, blocked in modes.items():
+                start = time.perf_counter()
+                results[mode] = await crawl.crawl_url(
+                    url,
+                    browser,
+                    tracking_domains_list=tracking_domains,
+                    screenshot=False,
+                    block_resources=blocked,
+                )
+                timings[mode].append(time.perf_counter() - start)
+
+            if any(r["status"] != "success" for r in results.values()):
+                print(f"{url:<30} error: {[r['status_msg'] for r in results.values()]}")
+                continue
+
+            line = [f"{url:<30}"] + [
+                f"{mode} {timings[mode][-1]:5.1f} s" for mode in modes
+            ]
+            for field in COMPARED_FIELDS:
+                score = similarity(
+                    values(results["full"], field), values(results["blocked"], field)
+                )
+                scores[field].append(score)
+                line.append(f"{field} {score:.2f}")
+
+            same_cmp = results["full"]["consent_manager"].get("id") == results[
+                "blocked"
+            ]["consent_manager"].get("id")
+            scores["consent_manager"].append(1.0 if same_cmp else 0.0)
+            line.append(f"consent_manager {'same' if same_cmp else 'different'}")
+            print("  ".join(line))
+
+        await browser.close()
+
+    for mode, values_ in timings.items():
+        if values_:
+            print(f"{mode:<8} median {statistics.median(values_):5.1f} s")
+
+    # Jaccard similarity of the blocked results to the full results
+    for field, values_ in scores.items():
+        if values_:
+            print(f"{field:<32} mean similarity {statistics.mean(values_):.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("urls", help="Comma separated list of URLs")
+    parser.add_argument(
+        "--block_resources", default=",".join(crawl.DEFAULT_BLOCKED_RESOURCES)
+    )
+    parser.add_argument("--channel", default="msedge")
+    args = parser.parse_args()
+
+    asyncio.run(
+        main(
+            args.urls.split(","),
+            {"headless": True, "channel": args.channel},
+            args.block_resources.split(","),
+        )
+    )
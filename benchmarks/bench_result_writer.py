@@ -0,0 +1,113 @@
+"""
+Compare ways of storing crawl results while an event loop is busy: rows per
+second and how long the event loop is stalled (the lateness of a task that
+wakes up every millisecond).
+
+- per_row: a connection per batch and a commit per row, on the event loop
+  (how results used to be stored)
+- store_crawl_results: crawl.store_crawl_results, a connection per batch in
+  the default executor
+- writer: a long-lived storage.ResultWriter
+
+    python benchmarks/bench_result_writer.py --rows 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+from consentcrawl import crawl, storage
+
+
+def make_result(i):
+    result = {k: None for k in crawl.get_extract_schema()}
+    result.update(
+        {
+            "id": str(i),
+            "url": f"https://site{i}.example.com",
+            "domain_name": f"site{i}.example.com",
+            "cookies_all": [
+                {"name": f"cookie{j}", "domain": ".example.com", "expires_days": 365}
+                for j in range(20)
+            ],
+            "third_party_domains_all": [f"tracker{j}.example.net" for j in range(40)],
+            "meta_tags": {"description": "x" * 200},
+            "status": "success",
+        }
+    )
+    return result
+
+
+async def store_per_row(data, results_db_file):
+    conn = sqlite3.connect(results_db_file)
+    storage.create_results_table(conn)
+    for d in data:
+        d = {
+            k: json.dumps(v) if type(v) in [dict, list, tuple] else v
+            for k, v in d.items()
+        }
+        conn.execute(
+            f"INSERT INTO crawl_results ({','.join(d.keys())}) VALUES ({','.join(['?' for k in d.keys()])})",
+            tuple(d.values()),
+        )
+        conn.commit()
+    conn.close()
+
+
+async def measure_stalls(stop, stalls):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        stalls.append((time.perf_counter() - start - 0.001) * 1000)
+
+
+async def run(method, rows, batch_size, db_file):
+    stop = asyncio.Event()
+    stalls = []
+    ticker = asyncio.create_task(measure_stalls(stop, stalls))
+
+    writer = storage.ResultWriter(db_file) if method == "writer" else None
+    start = time.perf_counter()
+    for offset in range(0, rows, batch_size):
+        batch = [make_result(i) for i in range(offset, min(offset + batch_size, rows))]
+        if method == "per_row":
+            await store_per_row(batch, db_file)
+        elif method == "store_crawl_results":
+            await crawl.store_crawl_results(batch, results_db_file=db_file)
+        else:
+            await writer.write(batch)
+        # give other tasks (the browsers) a chance to run between batches
+        await asyncio.sleep(0)
+
+    if writer is not None:
+        await writer.aclose()
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker
+
+    count = sqlite3.connect(db_file).execute("SELECT COUNT(*) FROM crawl_results")
+    assert count.fetchone()[0] == rows
+
+    print(
+        f"{method:<20} {rows / elapsed:8.0f} rows/s  loop stall "
+        f"p50 {statistics.median(stalls):6.2f} ms  max {max(stalls):7.2f} ms"
+    )
+
+
+async def main(rows, batch_size):
+    for method in ["per_row", "store_crawl_results", "writer"]:
+        with tempfile.TemporaryDirectory() as tmp:
+            await run(method, rows, batch_size, os.path.join(tmp, "results.db"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", default=5000, type=int)
+    parser.add_argument("--batch_size", default=10, type=int)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.rows, args.batch_size))
@@ -0,0 +1,499 @@
+"""
+End-to-end benchmark of crawl_batch against a farm of synthetic sites served
+locally, so it runs offline and gives comparable numbers on every change.
+
+Every site is a hostname under .test, served by a single local HTTP server;
+Chromium maps all .test hostnames to it with --host-resolver-rules. Sites
+show the markup of a consent manager from consent_managers.yml (or none),
+load scripts from fake tracker hosts before and after consent, set cookies
+and are slow (delayed response), hanging (a subresource that stalls the load
+event) or dead (a hostname that doesn't resolve) in configurable shares.
+
+Reports URLs/min, p50/p95 latency per URL, peak RSS of the crawler and its
+browser processes and whether the status, consent manager, tracking domains
+and cookies found match what every site does.
+
+    python benchmarks/site_farm.py --sites 200 --batch_size 15
+    python benchmarks/site_farm.py --sites 200 --reuse_contexts --json
+
+Use --serve to only run the farm, e.g. to crawl it with the CLI, and
+--service to crawl it through server.CrawlService instead of crawl_batch.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import resource
+import statistics
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from consentcrawl import consent_managers, crawl, network, server, storage
+
+TRACKERS = [f"tracker{i}.test" for i in range(20)]
+CDN_HOST = "cdn.test"
+SELECTOR_PART = re.compile(
+    r"^(?P<tag>[a-z][a-z0-9-]*)?(?P<rest>(?:#[\w-]+|\.[\w-]+|\[[^\]]+\])*)$"
+)
+ATTRIBUTE = re.compile(r"\[([\w-]+)(?:([*^$~|]?=)['\"]?([^'\"\]]*)['\"]?)?\]")
+TRANSPARENT_GIF = crawl.TRANSPARENT_GIF
+
+
+def selector_to_html(selector, inner):
+    """
+    HTML that matches a simple CSS selector (tags, ids, classes and
+    attributes, combined with descendant combinators), with `inner` in the
+    innermost element. Returns None for selectors that aren't that simple.
+    """
+    html = inner
+    parts = selector.split()
+    for i, part in enumerate(reversed(parts)):
+        match = SELECTOR_PART.match(part)
+        if match is None or not (match.group("tag") or match.group("rest")):
+            return None
+        innermost = i == 0
+        tag = match.group("tag") or ("button" if innermost else "div")
+        rest = match.group("rest")
+
+        attributes = {}
+        classes = re.findall(r"\.([\w-]+)", re.sub(r"\[[^\]]*\]", "", rest))
+        ids = re.findall(r"#([\w-]+)", re.sub(r"\[[^\]]*\]", "", rest))
+        if ids:
+            attributes["id"] = ids[0]
+        for name, operator, value in ATTRIBUTE.findall(rest):
+            if name == "class":
+                classes.append(value)
+            else:
+                attributes[name] = value
+        if classes:
+            attributes["class"] = " ".join(classes)
+
+        attrs = "".join(f' {k}="{v}"' for k, v in attributes.items())
+        if innermost:
+            attrs += ' onclick="acceptAll()"'
+        html = f"<{tag}{attrs}>{html}</{tag}>"
+    return html
+
+
+def get_consent_manager_markup():
+    """
+    Markup of the accept button of every consent manager whose (first)
+    selector can be turned into HTML, except generic ones and those in iframes.
+    """
+    markup = {}
+    for cmp in consent_managers.get_registry().get_consent_managers():
+        if cmp.generic or len(cmp.actions) != 1:
+            continue
+        action = cmp.actions[0]
+        if action.type == "css-selector":
+            selector = action.value
+        elif action.type == "css-selector-list":
+            selector = action.value[0]
+        else:
+            continue
+        html = selector_to_html(selector.split(",")[0].strip(), "Accept all")
+        if html is not None:
+            markup[cmp.id] = html
+    return markup
+
+
+def generate_sites(count, seed=1, no_cmp=0.3, slow=0.1, hanging=0.05, dead=0.05):
+    """Deterministic set of synthetic sites with the results expected for each."""
+    rng = random.Random(seed)
+    markup = get_consent_manager_markup()
+    cmp_ids = sorted(markup)
+    sites = []
+    for i in range(count):
+        kind = rng.choices(
+            ["normal", "slow", "hanging", "dead"],
+            weights=[1 - slow - hanging - dead, slow, hanging, dead],
+        )[0]
+        cmp_id = None if rng.random() < no_cmp else rng.choice(cmp_ids)
+        before = rng.sample(TRACKERS, rng.randint(0, 3))
+        after = (
+            rng.sample([t for t in TRACKERS if t not in before], rng.randint(1, 3))
+            if cmp_id
+            else []
+        )
+        host = f"site{i}.{'invalid' if kind == 'dead' else 'test'}"
+        sites.append(
+            {
+                "host": host,
+                "kind": kind,
+                "consent_manager": cmp_id,
+                "markup": markup.get(cmp_id),
+                "trackers_before": before,
+                "trackers_after": after,
+                "expected": {
+                    "status": "error" if kind == "dead" else "success",
+                    "consent_manager": cmp_id,
+                    "tracking_domains_no_consent": set(before),
+                    "tracking_domains_all": set(before) | set(after),
+                    "cookies_no_consent": {"session"}
+                    | {f"_{t.split('.')[0]}" for t in before},
+                    "cookies_all": {"session"}
+                    | {f"_{t.split('.')[0]}" for t in before + after}
+                    | ({"consent"} if cmp_id else set()),
+                },
+            }
+        )
+    return sites
+
+
+class Farm:
+    """HTTP server for all synthetic sites, trackers and the CDN."""
+
+    def __init__(self, sites, slow_delay=2.0, hang_time=10.0):
+        self.sites = {site["host"]: site for site in sites}
+        self.slow_delay = slow_delay
+        self.hang_time = hang_time
+        farm = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                farm.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_browser_args(self):
+        return [f"--host-resolver-rules=MAP *.test 127.0.0.1:{self.port}"]
+
+    def handle(self, request):
+        host = (request.headers.get("Host") or "").split(":")[0].lower()
+        url = urlparse(request.path)
+
+        if host in self.sites and url.path == "/":
+            site = self.sites[host]
+            if site["kind"] == "slow":
+                time.sleep(self.slow_delay)
+            consent = "consent=1" in (request.headers.get("Cookie") or "")
+            body = self.get_page(site, consent)
+            headers = {
+                "Content-Type": "text/html; charset=utf-8",
+                "Set-Cookie": "session=1; Path=/; Max-Age=3600",
+            }
+        elif host in TRACKERS and url.path == "/t.js":
+            name = f"_{host.split('.')[0]}"
+            body = f'document.cookie = "{name}=1; path=/; max-age=86400";'
+            headers = {"Content-Type": "application/javascript"}
+        elif host == CDN_HOST and url.path == "/lib.js":
+            body = "window.lib = true;"
+            headers = {"Content-Type": "application/javascript"}
+        elif host == CDN_HOST and url.path == "/hang.gif":
+            time.sleep(float(parse_qs(url.query).get("t", [self.hang_time])[0]))
+            body = TRANSPARENT_GIF
+            headers = {"Content-Type": "image/gif"}
+        else:
+            body = "Not found"
+            headers = {"Content-Type": "text/plain"}
+            request.send_response(404)
+            self.send_body(request, body, headers)
+            return
+
+        request.send_response(200)
+        self.send_body(request, body, headers)
+
+    def send_body(self, request, body, headers):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        try:
+            request.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def get_page(self, site, consent):
+        trackers = site["trackers_before"] + (site["trackers_after"] if consent else [])
+        scripts = "\n".join(
+            f'<script src="http://{t}/t.js"></script>' for t in trackers
+        )
+        hang = (
+            f'<img src="http://{CDN_HOST}/hang.gif?t={self.hang_time}">'
+            if site["kind"] == "hanging"
+            else ""
+        )
+        banner = ""
+        if site["markup"] and not consent:
+            banner = (
+                '<div style="position:fixed;bottom:0;left:0;right:0;background:#fff">'
+                f"{site['markup']}</div>"
+            )
+        return f"""<!doctype html>
+<html>
+<head>
+<title>{site['host']}</title>
+<meta name="description" content="Synthetic site {site['host']}">
+<script src="http://{CDN_HOST}/lib.js"></script>
+{scripts}
+<script>
+function acceptAll() {{
+    document.cookie = "consent=1; path=/; max-age=86400";
+    location.reload();
+}}
+</script>
+</head>
+<body>
+<h1>{site['host']}</h1>
+{hang}
+{banner}
+</body>
+</html>"""
+
+
+def get_tree_rss(pid):
+    """RSS (bytes) of a process and all its descendants, from /proc."""
+    children = {}
+    rss = {}
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        rss[int(entry)] = int(fields[21]) * page_size
+
+    total = 0
+    stack = [pid]
+    while stack:
+        p = stack.pop()
+        total += rss.get(p, 0)
+        stack.extend(children.get(p, []))
+    return total
+
+
+class RSSSampler:
+    """Peak RSS of this process and the browser processes it starts."""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.peak = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.peak = max(self.peak, get_tree_rss(os.getpid()))
+            except OSError:
+                return
+
+    def start(self):
+        if os.path.isdir("/proc"):
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        # fall back to the peak of this process (e.g. without /proc)
+        own_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return max(self.peak, own_peak)
+
+
+def check_result(result, site):
+    """Fields of a result that don't match what the site does."""
+    expected = site["expected"]
+    actual = {
+        "status": result.get("status"),
+        "consent_manager": (result.get("consent_manager") or {}).get("id"),
+        "tracking_domains_no_consent": set(
+            result.get("tracking_domains_no_consent") or []
+        ),
+        "tracking_domains_all": set(result.get("tracking_domains_all") or []),
+        "cookies_no_consent": {
+            c["name"] for c in result.get("cookies_no_consent") or []
+        },
+        "cookies_all": {c["name"] for c in result.get("cookies_all") or []},
+    }
+    if expected["status"] == "error":
+        return [] if actual["status"] == "error" else ["status"]
+    return [field for field in expected if actual[field] != expected[field]]
+
+
+async def crawl_with_service(urls, results_function, max_in_flight, **options):
+    """Crawl the URLs as a batch job of a server.CrawlService and poll it."""
+    service = server.CrawlService(
+        max_in_flight=max_in_flight, max_queue=len(urls), **options
+    )
+    await service.start()
+    try:
+        job_id = service.submit_batch(urls)
+        while (job := service.get_job(job_id))["status"] != "done":
+            await asyncio.sleep(0.5)
+        await results_function(job["results"])
+    finally:
+        await service.close()
+
+
+async def run(args):
+    sites = generate_sites(
+        args.sites,
+        seed=args.seed,
+        no_cmp=args.no_cmp,
+        slow=args.slow,
+        hanging=args.hanging,
+        dead=args.dead,
+    )
+    farm = Farm(sites, slow_delay=args.slow_delay, hang_time=args.hang_time).start()
+
+    browser_config = {"headless": True, "args": farm.get_browser_args()}
+    if args.channel:
+        browser_config["channel"] = args.channel
+    if args.executable_path:
+        browser_config["executable_path"] = args.executable_path
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = storage.ResultWriter(os.path.join(tmp, "results.db"))
+
+        async def collect(rows):
+            results.extend(rows)
+            await writer.write(rows)
+
+        sampler = RSSSampler().start()
+        start = time.perf_counter()
+        urls = [f"http://{site['host']}/" for site in sites]
+        options = dict(
+            tracking_domains_list=set(TRACKERS),
+            browser_config=browser_config,
+            wait_strategy=args.wait_strategy,
+            block_resources=args.block_resources,
+            capture_backend=args.capture,
+            reuse_contexts=args.reuse_contexts,
+        )
+        if args.service:
+            await crawl_with_service(urls, collect, args.batch_size, **options)
+        else:
+            await crawl.crawl_batch(
+                urls, collect, batch_size=args.batch_size, **options
+            )
+        elapsed = time.perf_counter() - start
+        peak_rss = sampler.stop()
+        await writer.aclose()
+
+    farm.stop()
+
+    sites_by_host = {site["host"]: site for site in sites}
+    errors = {}
+    for result in results:
+        site = sites_by_host[urlparse(result["url"]).hostname]
+        mismatches = check_result(result, site)
+        if mismatches:
+            errors[site["host"]] = mismatches
+
+    latencies = sorted(
+        result["timings"]["total"] for result in results if result.get("timings")
+    )
+    report = {
+        "sites": len(sites),
+        "results": len(results),
+        "seconds": round(elapsed, 1),
+        "urls_per_minute": round(len(results) / elapsed * 60, 1),
+        "latency_p50_ms": statistics.median(latencies) if latencies else None,
+        "latency_p95_ms": latencies[int(0.95 * (len(latencies) - 1))]
+        if latencies
+        else None,
+        "peak_rss_mb": round(peak_rss / 1024 / 1024),
+        "correct": round(1 - len(errors) / max(len(sites), 1), 3),
+        "mismatches": {
+            field: sum(field in fields for fields in errors.values())
+            for field in sites[0]["expected"]
+        }
+        if sites
+        else {},
+    }
+
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for key, value in report.items():
+            print(f"{key:<16} {value}")
+        for host, fields in list(errors.items())[: args.show_errors]:
+            print(f"  {host} ({sites_by_host[host]['kind']}): {', '.join(fields)}")
+
+
+def serve(args):
+    sites = generate_sites(args.sites, seed=args.seed)
+    farm = Farm(sites, slow_delay=args.slow_delay, hang_time=args.hang_time)
+    print(f"Serving {len(sites)} sites, start the browser with:")
+    print(f'  --host-resolver-rules="MAP *.test 127.0.0.1:{farm.port}"')
+    farm.server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sites", default=100, type=int)
+    parser.add_argument("--seed", default=1, type=int)
+    parser.add_argument("--batch_size", default=10, type=int)
+    parser.add_argument(
+        "--no_cmp",
+        default=0.3,
+        type=float,
+        help="Share of sites without a consent manager",
+    )
+    parser.add_argument("--slow", default=0.1, type=float, help="Share of slow sites")
+    parser.add_argument(
+        "--slow_delay", default=2.0, type=float, help="Response time of slow sites (s)"
+    )
+    parser.add_argument(
+        "--hanging",
+        default=0.05,
+        type=float,
+        help="Share of sites with a hanging subresource",
+    )
+    parser.add_argument(
+        "--hang_time", default=10.0, type=float, help="How long subresources hang (s)"
+    )
+    parser.add_argument(
+        "--dead", default=0.05, type=float, help="Share of sites that don't resolve"
+    )
+    parser.add_argument("--wait_strategy", default="event", choices=["event", "fixed"])
+    parser.add_argument("--block_resources", default=None, type=lambda v: v.split(","))
+    parser.add_argument("--capture", default="page", choices=network.CAPTURE_BACKENDS)
+    parser.add_argument("--reuse_contexts", default=0, const=20, nargs="?", type=int)
+    parser.add_argument(
+        "--channel",
+        default=None,
+        help="Browser channel, e.g. msedge. Default: Playwright's Chromium",
+    )
+    parser.add_argument("--executable_path", default=None)
+    parser.add_argument("--show_errors", default=10, type=int)
+    parser.add_argument("--json", default=False, action="store_true")
+    parser.add_argument("--serve", default=False, action="store_true")
+    parser.add_argument(
+        "--service",
+        default=False,
+        action="store_true",
+        help="Crawl through server.CrawlService (as a batch job) instead of crawl_batch",
+    )
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+    else:
+        asyncio.run(run(args))
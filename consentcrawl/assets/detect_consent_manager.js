@@ -0,0 +1,148 @@
+// Find the first consent manager with a visible accept button in a single
+// evaluation. Takes a list of compiled consent manager rules:
+//   [{actions: [{type: "iframe" | "css-selector", value: [selectors]}]}]
+// and returns the index, the iframe selectors leading to the button and the
+// selector of the button of the first matching rule. Rules that can't be
+// evaluated in the page (cross-origin iframes, selectors that aren't valid CSS
+// like Playwright's :has-text()) are returned as fallbacks to check otherwise.
+// Like Playwright's CSS engine, selectors also match in open shadow roots, and
+// descendant combinators cross into them (e.g. "cmm-cookie-banner .button").
+(rules) => {
+  // split a selector at its descendant combinators (whitespace outside
+  // brackets, parentheses and quotes): "a .b > c" => ["a", ".b > c"]
+  const splitDescendants = (selector) => {
+    const parts = [];
+    let current = "";
+    let depth = 0;
+    let quote = null;
+    for (const c of selector.trim()) {
+      if (quote !== null) {
+        if (c === quote) {
+          quote = null;
+        }
+      } else if (c === '"' || c === "'") {
+        quote = c;
+      } else if (c === "[" || c === "(") {
+        depth++;
+      } else if (c === "]" || c === ")") {
+        depth--;
+      } else if (depth === 0 && /\s/.test(c)) {
+        parts.push(current);
+        current = "";
+        continue;
+      }
+      current += c;
+    }
+    parts.push(current);
+
+    // child and sibling combinators stay within a part
+    const joined = [];
+    for (const part of parts.filter((p) => p !== "")) {
+      const last = joined.length - 1;
+      if (last >= 0 && (/[>+~]$/.test(joined[last]) || /^[>+~]/.test(part))) {
+        joined[last] += " " + part;
+      } else {
+        joined.push(part);
+      }
+    }
+    return joined;
+  };
+
+  // elements with an open shadow root, once per root and evaluation
+  const shadowHosts = new Map();
+  const getShadowHosts = (root) => {
+    if (!shadowHosts.has(root)) {
+      shadowHosts.set(
+        root,
+        Array.from(root.querySelectorAll("*")).filter((e) => e.shadowRoot)
+      );
+    }
+    return shadowHosts.get(root);
+  };
+
+  const queryDeep = (root, parts) => {
+    const element = root.querySelector(parts.join(" "));
+    if (element !== null) {
+      return element;
+    }
+    for (const host of getShadowHosts(root)) {
+      // the selector matches within the shadow root, or its first parts
+      // match the host (or its ancestors) and the rest within the shadow root
+      for (let i = 0; i < parts.length; i++) {
+        if (i > 0 && !host.matches(parts.slice(0, i).join(" "))) {
+          continue;
+        }
+        const found = queryDeep(host.shadowRoot, parts.slice(i));
+        if (found !== null) {
+          return found;
+        }
+      }
+    }
+    return null;
+  };
+
+  const query = (root, selector) => {
+    try {
+      return queryDeep(root, splitDescendants(selector));
+    } catch (e) {
+      return undefined;
+    }
+  };
+
+  // same definition of visible as Playwright: a non-empty bounding box and no
+  // visibility:hidden
+  const isVisible = (element) => {
+    const style = element.ownerDocument.defaultView.getComputedStyle(element);
+    if (style.visibility === "hidden") {
+      return false;
+    }
+    const rect = element.getBoundingClientRect();
+    return rect.width > 0 && rect.height > 0;
+  };
+
+  const fallbacks = [];
+
+  for (let index = 0; index < rules.length; index++) {
+    let root = document;
+    const frames = [];
+
+    rule: for (const action of rules[index].actions) {
+      if (action.type === "iframe") {
+        const iframe = query(root, action.value[0]);
+        if (iframe === undefined) {
+          fallbacks.push(index);
+          break;
+        }
+        if (iframe === null) {
+          continue;
+        }
+
+        let frameDocument = null;
+        try {
+          frameDocument = iframe.contentDocument;
+        } catch (e) {}
+
+        if (!frameDocument) {
+          fallbacks.push(index);
+          break;
+        }
+        root = frameDocument;
+        frames.push(action.value[0]);
+        continue;
+      }
+
+      for (const selector of action.value) {
+        const element = query(root, selector);
+        if (element === undefined) {
+          fallbacks.push(index);
+          break rule;
+        }
+        if (element !== null && isVisible(element)) {
+          return { match: { index, frames, selector }, fallbacks };
+        }
+      }
+    }
+  }
+
+  return { match: null, fallbacks };
+}
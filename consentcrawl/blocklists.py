@@ -3,22 +3,450 @@ import logging
 import os
 import re
 import yaml
+import mmap
+import json
+import struct
+import sys
+import hashlib
+import tempfile
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
 from time import time
 from pathlib import Path
 import sqlite3
 
 MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+DOMAIN = r"[a-z0-9_](?:[a-z0-9_-]*[a-z0-9_])?(?:\.[a-z0-9_-]+)+"
+# a single pattern for all supported syntaxes, so most lines are parsed (or
+# rejected) by one regex match
+LINE_PATTERN = re.compile(
+    rf"""\s*(?:
+        (?P<exception>@@)?\|\|(?P<rule>{DOMAIN})\.?\^?\|?(?:\$(?P<options>.*))?  # adblock
+        |(?:[0-9.]+|[0-9a-f:]*:[0-9a-f:.%a-z]*)\s+(?P<host>{DOMAIN})\.?(?:\s.*)?  # hostfile
+        |(?:\*\.)?(?P<domain>{DOMAIN})\.?(?:\s+\#.*)?  # domains
+    )\s*""",
+    re.IGNORECASE | re.VERBOSE,
+)
+IGNORED_HOSTS = {
+    "localhost",
+    "localhost.localdomain",
+    "local",
+    "broadcasthost",
+    "ip6-localhost",
+    "ip6-loopback",
+    "0.0.0.0",
+}
+# adblock rule options that limit a rule to something other than blocking (or
+# allowing) all requests to a domain
+IGNORED_ADBLOCK_OPTIONS = (
+    "domain=",
+    "denyallow=",
+    "badfilter",
+    "removeparam",
+    "removeheader",
+    "redirect",
+    "csp",
+    "replace",
+    "cookie",
+    "app=",
+    "header=",
+    "permissions=",
+    "stealth",
+    "elemhide",
+    "generichide",
+    "specifichide",
+    "content",
+    "jsinject",
+    "extension",
+)
+# resource type options limit a rule to some of the requests to a domain (or
+# popups), when negated ('~image') the rule still covers the other types
+RESOURCE_TYPE_OPTIONS = {
+    "script",
+    "image",
+    "stylesheet",
+    "css",
+    "object",
+    "object-subrequest",
+    "xmlhttprequest",
+    "xhr",
+    "subdocument",
+    "frame",
+    "ping",
+    "beacon",
+    "websocket",
+    "webrtc",
+    "font",
+    "media",
+    "other",
+    "popup",
+    "popunder",
+}
+
+
+def parse_line(line):
+    """
+    Parse a single line of a blocklist. Supports hostfiles ('0.0.0.0 domain'),
+    plain domain lists and adblock rules ('||domain^', '||domain^$third-party',
+    exceptions like '@@||domain^'). Returns a (domain, is_exception) tuple or
+    None when the line doesn't block or allow a full domain, e.g. rules that
+    only apply to some resource types ('$script,image') or popups.
+    """
+    match = LINE_PATTERN.fullmatch(line)
+    if match is None:
+        return None
+
+    exception, rule, options, host, domain = match.groups()
+    if rule is not None:
+        if options and any(
+            option.lstrip("~").startswith(IGNORED_ADBLOCK_OPTIONS)
+            or option in RESOURCE_TYPE_OPTIONS
+            for option in options.lower().split(",")
+        ):
+            return None
+        domain = rule
+
+    elif host is not None:
+        domain = host
+
+    domain = domain.lower()
+    if domain in IGNORED_HOSTS:
+        return None
+
+    return domain, exception is not None
+
+
+def parse_lines(lines, list_id, index=None):
+    """
+    Parse an iterable of blocklist lines (e.g. a streaming HTTP response) into a
+    DomainIndex, or add them to an existing index.
+    """
+    ids = (list_id,)
+    domains = {}
+    exceptions = {}
+    for line in lines:
+        parsed = parse_line(line)
+        if parsed is None:
+            continue
+
+        domain, exception = parsed
+        if exception:
+            exceptions[domain] = ids
+        else:
+            domains[domain] = ids
+
+    if index is None:
+        return DomainIndex.from_dicts(domains, exceptions)
+
+    for domain in domains:
+        index.add(domain, ids)
+    for domain in exceptions:
+        index.add_exception(domain, ids)
+
+    return index
+
+
+class DomainIndex:
+    """
+    Index of listed domains that also matches subdomains: a host is listed when
+    the host itself or any of its parent domains is listed, e.g.
+    'stats.g.doubleclick.net' matches 'doubleclick.net'. A lookup costs one
+    hash lookup per label of the host, regardless of the size of the index.
+
+    Exception rules (e.g. '@@||domain^' in adblock lists) unlist a domain and
+    its subdomains for the list the exception appears on.
+    """
+
+    def __init__(self, data=None, exceptions=None):
+        self._data = {}
+        self._exceptions = {}
+        if data:
+            for domain, ids in data.items():
+                self.add(domain, ids)
+        if exceptions:
+            for domain, ids in exceptions.items():
+                self.add_exception(domain, ids)
+
+    @classmethod
+    def from_dicts(cls, data, exceptions):
+        """
+        Create an index from normalised {domain: (list ids, ...)} dicts
+        without copying them.
+        """
+        index = cls()
+        index._data = data
+        index._exceptions = exceptions
+        return index
+
+    @staticmethod
+    def _add(table, domain, ids):
+        if isinstance(ids, str):
+            ids = ids.split(",")
+
+        domain = domain.strip().lower().rstrip(".")
+        if domain == "":
+            return
+
+        existing = table.get(domain, ())
+        table[domain] = existing + tuple(i for i in ids if i not in existing)
+
+    def add(self, domain, ids):
+        """
+        Add a domain with the id(s) of the list(s) it appears on.
+        """
+        self._add(self._data, domain, ids)
+
+    def add_exception(self, domain, ids):
+        """
+        Add an exception for a domain with the id(s) of the list(s) it appears on.
+        """
+        self._add(self._exceptions, domain, ids)
+
+    @classmethod
+    def _lookup(cls, table, host):
+        ids = set(table.get(host, ()))
+
+        dot = host.find(".")
+        while dot != -1:
+            ids.update(table.get(host[dot + 1 :], ()))
+            dot = host.find(".", dot + 1)
+
+        return ids
+
+    def match(self, host):
+        """
+        Return the ids of all lists on which the host or any of its parent
+        domains appear. Returns an empty set when the host is not listed.
+        """
+        host = self.normalise_host(host)
+        ids = self._lookup(self._data, host)
+        if ids and self._exceptions:
+            ids -= self._lookup(self._exceptions, host)
+        return ids
+
+    def __contains__(self, host):
+        if self._exceptions:
+            return len(self.match(host)) > 0
+
+        data = self._data
+        host = self.normalise_host(host)
+        if host in data:
+            return True
+
+        dot = host.find(".")
+        while dot != -1:
+            if host[dot + 1 :] in data:
+                return True
+            dot = host.find(".", dot + 1)
+
+        return False
+
+    @staticmethod
+    def normalise_host(host):
+        host = host.lower()
+        if ":" in host:
+            host = host.split(":", 1)[0]
+        if host.endswith("."):
+            host = host[:-1]
+        return host
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def items(self):
+        return self._data.items()
+
+    def exceptions(self):
+        return self._exceptions.items()
+
+
+class BlocklistSnapshot:
+    """
+    Read-only, memory-mapped snapshot of the blocklists with the same lookup
+    interface as DomainIndex. Domains are stored as sorted 64-bit hashes with a
+    bitmask of the lists they appear on (and one of the lists they are an
+    exception on), so lookups don't need a Python object per domain and
+    processes opening the same file share it via the page cache.
+
+    File layout: header (magic, version of the blocklist data, number of
+    domains, length of the JSON encoded list ids), list ids padded to 8 bytes,
+    hashes, bitmasks, exception bitmasks.
+    """
+
+    MAGIC = b"CCBLSNP3"
+    HEADER = struct.Struct("=8sQQQ")
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.version, count, ids_length = self.HEADER.unpack_from(self._mmap)
+        if magic != self.MAGIC:
+            raise Exception(f"Not a (compatible) blocklist snapshot: {path}")
+
+        offset = self.HEADER.size
+        self.list_ids = json.loads(self._mmap[offset : offset + ids_length])
+        offset += self.padded(ids_length)
+
+        view = memoryview(self._mmap)
+        self._hashes = view[offset : offset + count * 8].cast("Q")
+        self._masks = view[offset + count * 8 : offset + count * 16].cast("Q")
+        self._exception_masks = view[offset + count * 16 : offset + count * 24].cast(
+            "Q"
+        )
+
+    @staticmethod
+    def padded(length):
+        return (length + 7) // 8 * 8
+
+    @staticmethod
+    def hash_domain(domain):
+        return int.from_bytes(
+            hashlib.blake2b(domain.encode(), digest_size=8).digest(), sys.byteorder
+        )
+
+    @classmethod
+    def build(cls, path, rows, version=0):
+        """
+        Write a snapshot from an iterable of (domain, list ids, exception list
+        ids) rows, where the list ids are lists, comma separated strings or None.
+        `version` (a 64-bit integer) identifies the data the snapshot is built
+        from, see Blocklists.get_data_version.
+        """
+        list_ids = []
+        entries = {}
+
+        def to_mask(ids):
+            if not ids:
+                return 0
+            if isinstance(ids, str):
+                ids = ids.split(",")
+
+            mask = 0
+            for i in ids:
+                if i not in list_ids:
+                    list_ids.append(i)
+                mask |= 1 << list_ids.index(i)
+            return mask
+
+        for domain, ids, exception_ids in rows:
+            domain = DomainIndex.normalise_host(domain.strip())
+            if domain == "":
+                continue
+
+            key = cls.hash_domain(domain)
+            mask, exception_mask = entries.get(key, (0, 0))
+            entries[key] = (
+                mask | to_mask(ids),
+                exception_mask | to_mask(exception_ids),
+            )
+
+        if len(list_ids) > 64:
+            raise Exception("Blocklist snapshots support at most 64 lists")
+
+        keys = sorted(entries)
+        ids_json = json.dumps(list_ids).encode()
+
+        Path.mkdir(Path(path).parent, exist_ok=True)
+        # a temporary file of our own, other processes may build the same
+        # snapshot at the same time
+        fd, tmp_path = tempfile.mkstemp(
+            dir=Path(path).parent, prefix=f"{Path(path).name}.", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(
+                    cls.HEADER.pack(cls.MAGIC, int(version), len(keys), len(ids_json))
+                )
+                f.write(ids_json.ljust(cls.padded(len(ids_json)), b" "))
+                array("Q", keys).tofile(f)
+                array("Q", [entries[k][0] for k in keys]).tofile(f)
+                array("Q", [entries[k][1] for k in keys]).tofile(f)
+
+            # replace atomically so processes that have the old file open keep
+            # working
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def find(self, domain):
+        """
+        Return the bitmasks of the lists the exact domain appears on and of the
+        lists it is an exception on ((0, 0) if none).
+        """
+        key = self.hash_domain(domain)
+        i = bisect_left(self._hashes, key)
+        if i < len(self._hashes) and self._hashes[i] == key:
+            return self._masks[i], self._exception_masks[i]
+        return 0, 0
+
+    def match_mask(self, host):
+        """
+        Return the bitmask of the lists on which the host or any of its parent
+        domains appear, minus the lists with an exception for them.
+        """
+        host = DomainIndex.normalise_host(host)
+        mask, exception_mask = self.find(host)
+
+        dot = host.find(".")
+        while dot != -1:
+            parent_mask, parent_exception_mask = self.find(host[dot + 1 :])
+            mask |= parent_mask
+            exception_mask |= parent_exception_mask
+            dot = host.find(".", dot + 1)
+
+        return mask & ~exception_mask
+
+    def match(self, host):
+        """
+        Return the ids of all lists on which the host or any of its parent
+        domains appear. Returns an empty set when the host is not listed.
+        """
+        mask = self.match_mask(host)
+        return {i for bit, i in enumerate(self.list_ids) if mask & (1 << bit)}
+
+    def __contains__(self, host):
+        return self.match_mask(host) != 0
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __reduce__(self):
+        # pickle by path, so worker processes map the same file
+        return (self.__class__, (self.path,))
+
 
 class Blocklists:
     BLOCKLISTS_FILE = f"{MODULE_DIR}/assets/blocklists.yml"
     DB_FILE = f"{MODULE_DIR}/data/blocklists.db"
-    TABLE_NAME = "blocklists"
+    TABLE_NAME = "blocklist_domains"
+    EXCEPTIONS_TABLE_NAME = "blocklist_exceptions"
+    SOURCES_TABLE_NAME = "blocklist_sources"
 
     def __init__(
-        self, db_file=None, source_file=None, max_age_days=7, force_bootstrap=False
+        self,
+        db_file=None,
+        source_file=None,
+        max_age_days=7,
+        force_bootstrap=False,
+        snapshot=False,
+        read_only=False,
     ):
+        """
+        Load the blocklists from `db_file`, fetching them first when they are
+        missing or older than `max_age_days`. With `read_only` (e.g. for
+        workers that share a database) they are never fetched, an Exception is
+        raised when there are none.
+        """
         self.has_blocklists = False
+        self.snapshot = snapshot
         self.max_age_days = max_age_days
         self.force_bootstrap = force_bootstrap
         self._data = {}
@@ -26,21 +454,109 @@ class Blocklists:
             self.DB_FILE = db_file
         if source_file:
             self.BLOCKLISTS_FILE = source_file
+        self.SNAPSHOT_FILE = str(Path(self.DB_FILE).with_suffix(".blocklists"))
 
         self.connection = self.get_connection()
 
-        # create table if not exists
+        if read_only:
+            self.last_fetch_timestamp = self.get_last_fetch_timestamp()
+            if self.last_fetch_timestamp == 0:
+                raise Exception(f"No blocklists in {self.DB_FILE}.")
+            self.has_blocklists = True
+            if self.blocklists_older_than(self.max_age_days):
+                logging.warning(
+                    f"Blocklists are older than {self.max_age_days} days, they are refreshed by the process that fetches them"
+                )
+        else:
+            self.create_tables()
+            self.refresh()
+
+        if self.snapshot:
+            self.get_blocklist_data_from_snapshot()
+        else:
+            self.get_blocklist_data_from_db()
+
+    def create_tables(self):
+        # domains are stored per list so a list can be replaced without
+        # touching the others
         c = self.connection.cursor()
         c.execute(
             f"""
             CREATE TABLE IF NOT EXISTS {self.TABLE_NAME} (
+                list_id TEXT,
+                domain TEXT
+            )"""
+        )
+        c.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {self.EXCEPTIONS_TABLE_NAME} (
+                list_id TEXT,
+                domain TEXT
+            )"""
+        )
+        for table_name in [self.TABLE_NAME, self.EXCEPTIONS_TABLE_NAME]:
+            c.execute(
+                f"CREATE INDEX IF NOT EXISTS {table_name}_list_id ON {table_name} (list_id)"
+            )
+        c.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {self.SOURCES_TABLE_NAME} (
+                id TEXT PRIMARY KEY,
                 url TEXT,
-                ids TEXT,
-                last_fetch_time TEXT
+                etag TEXT,
+                last_modified TEXT,
+                domains INTEGER,
+                last_fetch_time INTEGER,
+                last_update_time INTEGER
             )"""
         )
         self.connection.commit()
+        self.migrate_legacy_table()
 
+    def migrate_legacy_table(self, table_name="blocklists"):
+        """
+        Move the data of the table with all blocklists combined that was used
+        by previous versions into the per list tables, so it's kept until the
+        lists are fetched again successfully.
+        """
+        c = self.connection.cursor()
+        c.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (table_name,),
+        )
+        if c.fetchone()[0] == 0:
+            return
+
+        domains = []
+        sources = {}
+        c.execute(f"SELECT url, ids, last_fetch_time FROM {table_name}")
+        for domain, ids, last_fetch_time in c.fetchall():
+            for list_id in (ids or "").split(","):
+                if list_id == "":
+                    continue
+                domains.append((list_id, domain))
+                count, fetch_time = sources.get(list_id, (0, 0))
+                sources[list_id] = (
+                    count + 1,
+                    max(fetch_time, int(last_fetch_time or 0)),
+                )
+
+        logging.info(f"Migrating {len(domains)} blocklist entries from {table_name}")
+        c.execute(f"SELECT COUNT(*) FROM {self.SOURCES_TABLE_NAME}")
+        if c.fetchone()[0] == 0:
+            c.executemany(f"INSERT INTO {self.TABLE_NAME} VALUES (?, ?)", domains)
+            c.executemany(
+                f"INSERT INTO {self.SOURCES_TABLE_NAME} VALUES (?, NULL, NULL, NULL, ?, ?, ?)",
+                [
+                    (list_id, count, fetch_time, fetch_time)
+                    for list_id, (count, fetch_time) in sources.items()
+                ],
+            )
+        c.execute(f"DROP TABLE {table_name}")
+        self.connection.commit()
+
+    def refresh(self):
+        """Fetch the blocklists when there are none or they are stale."""
         # Get last fetch timestamp and check staleness
         self.last_fetch_timestamp = self.get_last_fetch_timestamp()
         logging.debug(f"Last fetch timestamp: {self.last_fetch_timestamp}")
@@ -54,27 +570,30 @@ class Blocklists:
             )
             self.bootstrap()
 
-        if not self.has_blocklists or self.force_bootstrap:
+        elif not self.has_blocklists or self.force_bootstrap:
             logging.debug("Fetching new blocklist data...")
             self.bootstrap()
 
-        self.get_blocklist_data_from_db()
-
     def bootstrap(self):
         """
-        Bootstrap blocklists data from a YAML file.
+        Bootstrap blocklists data from a YAML file. Only lists that changed
+        since the last fetch are downloaded and stored again.
         """
         self.get_blocklists_file()
         self.get_blocklists_data()
-        self.generate_master_list()
         self.last_fetch_timestamp = int(time())
         self.store_blocklists_data()
         self.has_blocklists = True
 
     def get_domains(self):
+        """
+        Return a DomainIndex of all blocklisted domains. Use `host in index` to
+        check whether a host (or one of its parent domains) is listed, or
+        `index.match(host)` to get the ids of the lists it appears on.
+        """
         if not self.has_blocklists:
             raise Exception("No blocklists data available.")
-        return self._data.keys()
+        return self._data
 
     def get_connection(self):
         """
@@ -105,108 +624,220 @@ class Blocklists:
         with open(self.BLOCKLISTS_FILE, "r") as f:
             self.blocklists = yaml.safe_load(f)
 
-    def get_blocklists_data(self):
-        for blocklist in self.blocklists:
-            logging.info(
-                f"Retrieving blocklist: '{blocklist['name']}' from: {blocklist['url']}"
-            )
-
-            if blocklist["type"] == "hostfile":
-                data = requests.get(blocklist["url"]).text
-                blocklist["data"] = self.parse_hostfile(data)
-
-            elif blocklist["type"] == "blocklist":
-                data = requests.get(blocklist["url"]).text.split("\n")
-                blocklist["data"] = self.parse_blocklist(data)
-
-            elif blocklist["type"] == "domains":
-                blocklist["data"] = requests.get(blocklist["url"]).text.split("\n")
-
-            else:
-                raise Exception(f"Unknown blocklist type {blocklist['type']}")
-
-    def parse_hostfile(self, data):
+    def get_sources(self):
         """
-        Retrieve a unique list of domain names from a hostfile with the format similar to:
-            '127.0.0.1   domain-name.com'
+        Retrieve the caching headers of previously fetched blocklists.
         """
-        domains = []
-        for line in data.splitlines():
-            if not line.startswith("#"):
-                match = re.search(r"^\S+\s+(\S+)$", line)
-                if match:
-                    domains.append(match.group(1))
-
-        return set(domains)
+        c = self.connection.cursor()
+        c.execute(f"SELECT id, url, etag, last_modified FROM {self.SOURCES_TABLE_NAME}")
+        return {
+            row[0]: {"url": row[1], "etag": row[2], "last_modified": row[3]}
+            for row in c.fetchall()
+        }
 
-    def parse_blocklist(self, data):
+    def get_blocklists_data(self):
         """
-        Retrieve a unique list of domain names from a blocklist with the format similar to:
-            '||domain-name.com^'
+        Download all blocklists concurrently over a shared session. Requests are
+        conditional (ETag/If-Modified-Since) so unchanged lists only cost a 304
+        response, unless a bootstrap is forced.
         """
-        domains = []
-        for line in data:
-            if line.startswith("||"):
-                match = re.search(r"^\|\|([^\/]+)\^$", line)
-                if match:
-                    domains.append(match.group(1))
+        sources = {} if self.force_bootstrap else self.get_sources()
 
-        return set(domains)
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=max(1, len(self.blocklists)),
+            pool_maxsize=max(1, len(self.blocklists)),
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        with ThreadPoolExecutor(max_workers=max(1, len(self.blocklists))) as executor:
+            for blocklist in self.blocklists:
+                blocklist["future"] = executor.submit(
+                    self.get_blocklist_data,
+                    session,
+                    blocklist,
+                    sources.get(blocklist["id"], {}),
+                )
 
-    def generate_master_list(self):
+        for blocklist in self.blocklists:
+            try:
+                blocklist.update(blocklist.pop("future").result())
+            except Exception as e:
+                # keep the previously stored version of the list
+                logging.warning(
+                    f"Unable to retrieve blocklist '{blocklist['name']}': {e}"
+                )
+                blocklist["data"] = None
+                blocklist["error"] = str(e)
+
+        session.close()
+
+    def get_blocklist_data(self, session, blocklist, source):
         """
-        Generate a master list of domains from all blocklists.
+        Download and parse a single blocklist. Returns the parsed data and
+        caching headers, with data set to None when the list is unchanged.
         """
+        if blocklist["type"] not in ["hostfile", "blocklist", "domains"]:
+            raise Exception(f"Unknown blocklist type {blocklist['type']}")
+
+        headers = {}
+        if source.get("url") == blocklist["url"]:
+            if source.get("etag"):
+                headers["If-None-Match"] = source["etag"]
+            if source.get("last_modified"):
+                headers["If-Modified-Since"] = source["last_modified"]
+
+        logging.info(
+            f"Retrieving blocklist: '{blocklist['name']}' from: {blocklist['url']}"
+        )
+        with session.get(
+            blocklist["url"], headers=headers, timeout=60, stream=True
+        ) as response:
+            if response.status_code == 304:
+                logging.info(f"Blocklist '{blocklist['name']}' is unchanged")
+                return {
+                    "data": None,
+                    "etag": source.get("etag"),
+                    "last_modified": source.get("last_modified"),
+                }
+
+            response.raise_for_status()
+            if response.encoding is None:
+                response.encoding = "utf-8"
+
+            # parse the response while it's coming in, without holding the
+            # full list in memory
+            data = parse_lines(
+                response.iter_lines(chunk_size=64 * 1024, decode_unicode=True),
+                blocklist["id"],
+            )
 
-        for l in self.blocklists:
-            for item in l["data"]:
-                if item in self._data:
-                    self._data[item].append(l["id"])
-                else:
-                    self._data[item] = [l["id"]]
+        return {
+            "data": data,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
 
-    def store_blocklists_data(self, table_name="blocklists"):
+    def store_blocklists_data(self):
         """
-        Store blocklist data in a SQLite database.
+        Store blocklist data in a SQLite database. Only lists that were
+        downloaded are replaced, unchanged lists just get a new fetch time and
+        lists that are no longer configured are removed.
         """
         c = self.connection.cursor()
-        c.execute(f"DROP TABLE IF EXISTS {table_name}")
+
+        for blocklist in self.blocklists:
+            if blocklist.get("error"):
+                continue
+
+            if blocklist.get("data") is None:
+                c.execute(
+                    f"UPDATE {self.SOURCES_TABLE_NAME} SET last_fetch_time = ? WHERE id = ? AND url = ?",
+                    (self.last_fetch_timestamp, blocklist["id"], blocklist["url"]),
+                )
+                continue
+
+            data = blocklist["data"]
+            logging.debug(f"Storing {len(data)} domains for '{blocklist['id']}'")
+            for table_name, items in [
+                (self.TABLE_NAME, data.items()),
+                (self.EXCEPTIONS_TABLE_NAME, data.exceptions()),
+            ]:
+                c.execute(
+                    f"DELETE FROM {table_name} WHERE list_id = ?", (blocklist["id"],)
+                )
+                c.executemany(
+                    f"INSERT INTO {table_name} VALUES (?, ?)",
+                    ((blocklist["id"], domain) for domain, _ in items),
+                )
+            c.execute(
+                f"INSERT OR REPLACE INTO {self.SOURCES_TABLE_NAME} VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    blocklist["id"],
+                    blocklist["url"],
+                    blocklist.get("etag"),
+                    blocklist.get("last_modified"),
+                    len(data),
+                    self.last_fetch_timestamp,
+                    self.last_fetch_timestamp,
+                ),
+            )
+
+        ids = [blocklist["id"] for blocklist in self.blocklists]
+        placeholders = ",".join(["?" for _ in ids])
+        for table_name in [self.TABLE_NAME, self.EXCEPTIONS_TABLE_NAME]:
+            c.execute(
+                f"DELETE FROM {table_name} WHERE list_id NOT IN ({placeholders})", ids
+            )
         c.execute(
-            f"""
-            CREATE TABLE {table_name} (
-                url TEXT,
-                ids TEXT,
-                last_fetch_time TEXT
-            )"""
+            f"DELETE FROM {self.SOURCES_TABLE_NAME} WHERE id NOT IN ({placeholders})",
+            ids,
         )
         self.connection.commit()
 
-        c.executemany(
-            f"INSERT OR REPLACE INTO {table_name} VALUES (?, ?, ?)",
-            (
-                [
-                    (k, ",".join(self._data[k]), self.last_fetch_timestamp)
-                    for k in self._data.keys()
-                ]
-            ),
+    def get_blocklist_data_from_db(self):
+        """
+        Retrieve blocklist data from a SQLite database.
+        """
+        c = self.connection.cursor()
+        c.execute(
+            f"SELECT domain, GROUP_CONCAT(list_id) FROM {self.TABLE_NAME} GROUP BY domain"
         )
-        self.connection.commit()
+        data = dict(c.fetchall())
+        c.execute(
+            f"SELECT domain, GROUP_CONCAT(list_id) FROM {self.EXCEPTIONS_TABLE_NAME} GROUP BY domain"
+        )
+        self._data = DomainIndex(data, dict(c.fetchall()))
 
-    def get_blocklist_data_from_db(self, table_name="blocklists"):
+    def get_blocklist_data_from_snapshot(self):
         """
-        Retrieve blocklist data from a SQLite database.
+        Open the memory-mapped snapshot of the blocklist data, (re)building it
+        from the SQLite database when it is missing or out of date.
         """
+        version = self.get_data_version()
+        try:
+            data = BlocklistSnapshot(self.SNAPSHOT_FILE)
+            if data.version == version:
+                self._data = data
+                return
+        except Exception as e:
+            logging.debug(f"Unable to open blocklist snapshot: {e}")
+
+        logging.debug(f"Building blocklist snapshot: {self.SNAPSHOT_FILE}")
         c = self.connection.cursor()
-        c.execute(f"SELECT * FROM {table_name}")
-        self._data = dict([(row[0], row[1]) for row in c.fetchall()])
+        c.execute(
+            f"""
+            SELECT domain, GROUP_CONCAT(list_id), NULL FROM {self.TABLE_NAME} GROUP BY domain
+            UNION ALL
+            SELECT domain, NULL, GROUP_CONCAT(list_id) FROM {self.EXCEPTIONS_TABLE_NAME} GROUP BY domain
+            """
+        )
+        BlocklistSnapshot.build(self.SNAPSHOT_FILE, c, version)
+        self._data = BlocklistSnapshot(self.SNAPSHOT_FILE)
 
-    def get_last_fetch_timestamp(self, table_name="blocklists"):
+    def get_last_fetch_timestamp(self):
         """
         Retrieve the last fetch timestamp from a SQLite database.
         """
         c = self.connection.cursor()
         try:
-            c.execute(f"SELECT MAX(last_fetch_time) FROM {table_name}")
+            c.execute(f"SELECT MIN(last_fetch_time) FROM {self.SOURCES_TABLE_NAME}")
             return int(c.fetchone()[0])
         except:
             return 0
+
+    def get_data_version(self):
+        """
+        Version of the stored blocklist data: a hash of the ids and update
+        times of all stored lists, so it changes when a list is updated, added
+        or removed.
+        """
+        c = self.connection.cursor()
+        c.execute(
+            f"SELECT id, last_update_time FROM {self.SOURCES_TABLE_NAME} ORDER BY id"
+        )
+        return int.from_bytes(
+            hashlib.blake2b(json.dumps(c.fetchall()).encode(), digest_size=8).digest(),
+            "little",
+        )
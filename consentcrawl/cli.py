@@ -1,10 +1,27 @@
 import asyncio
+import contextlib
 import os
 import json
 import logging
 import argparse
 import sys
-from consentcrawl import crawl, utils, blocklists
+from consentcrawl import (
+    crawl,
+    utils,
+    blocklists,
+    export,
+    sharding,
+    consent_managers,
+    network,
+    storage,
+    query,
+    journal,
+    metrics,
+    preflight,
+    screenshots,
+    server,
+    workqueue,
+)
 
 
 async def process_urls(
@@ -14,27 +31,114 @@ async def process_urls(
     headless=True,
     screenshot=True,
     results_db_file="crawl_results.db",
+    flush_size=None,
+    shards=1,
+    registry=None,
+    wait_strategy="event",
+    block_resources=None,
+    keep_request_urls=False,
+    capture_backend="page",
+    reuse_contexts=0,
+    normalise=False,
+    resume=False,
+    max_age=None,
+    preflight_concurrency=0,
+    preflight_check_content=True,
+    retries=2,
+    adaptive_timeouts=False,
+    exporters=None,
 ):
     """
-    Start the Playwright browser, run the URLs to test in batches asynchronously
-    and write the data to a file.
+    Start the Playwright browser, run the URLs to test concurrently and write
+    the data to a file. With more than one shard the URLs are spread across
+    multiple processes, each running its own browser. With
+    `preflight_concurrency` dead, parked and duplicate sites are filtered out
+    before they reach the browser (see preflight.Preflight). Every result is
+    also passed to the `exporters` (see export.py) as soon as it's available.
     """
 
-    return await crawl.crawl_batch(
-        urls=urls,
+    # results are written by a separate thread so crawling doesn't wait for
+    # the database
+    # the journal keeps track of which URLs are done, so a crashed run can be
+    # resumed and recently crawled sites can be skipped
+    crawl_journal = journal.CrawlJournal(
+        results_db_file, resume=resume, max_age=max_age
+    )
+    # read the input and query the journal in a thread, off the event loop
+    urls = utils.iterate_in_thread(crawl_journal.filter(urls))
+    writer = storage.ResultWriter(
+        results_db_file, normalise=normalise, on_flush=crawl_journal.on_flush
+    )
+    exporters = exporters or []
+
+    def on_result(result):
+        for exporter in exporters:
+            exporter.write_result(result)
+
+    async def write_skipped(rows):
+        for row in rows:
+            on_result(row)
+        await writer.write(rows)
+
+    checker = None
+    if preflight_concurrency:
+        checker = preflight.Preflight(
+            concurrency=preflight_concurrency, check_content=preflight_check_content
+        )
+        urls = checker.filter(urls, write_skipped)
+    options = dict(
         batch_size=batch_size,
-        results_function=crawl.store_crawl_results,
+        results_function=writer.write,
         tracking_domains_list=tracking_domains_list,
         browser_config={"headless": headless, "channel": "msedge"},
-        results_db_file=results_db_file,
         screenshot=screenshot,
+        flush_size=flush_size,
+        registry=registry,
+        wait_strategy=wait_strategy,
+        block_resources=block_resources,
+        keep_request_urls=keep_request_urls,
+        capture_backend=capture_backend,
+        reuse_contexts=reuse_contexts,
+        retries=retries,
+        adaptive_timeouts=adaptive_timeouts,
+        on_result=on_result if exporters else None,
     )
 
+    try:
+        if shards > 1:
+            results = await sharding.crawl_sharded(urls=urls, shards=shards, **options)
+        else:
+            results = await crawl.crawl_batch(urls=urls, **options)
+
+    finally:
+        if checker is not None:
+            checker.close()
+        for exporter in exporters:
+            await asyncio.get_running_loop().run_in_executor(None, exporter.close)
+        # raises when results couldn't be stored, the run isn't finished then
+        await writer.aclose()
+
+    crawl_journal.finish()
+    crawl_journal.close()
+    return results
+
 
 def cli():
-    parser = argparse.ArgumentParser()
+    if len(sys.argv) > 1 and sys.argv[1] == "query":
+        return query.cli(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        return server.cli(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        return workqueue.cli(sys.argv[2:])
+
+    parser = argparse.ArgumentParser(
+        epilog="Use 'consentcrawl query --help' to query the results and 'consentcrawl serve --help' to run the crawl service API. Use 'consentcrawl worker --help' to crawl from a work queue shared by multiple workers."
+    )
 
-    parser.add_argument("url", help="URL or file with URLs to test")
+    parser.add_argument(
+        "url",
+        help="URL, comma separated URLs or file with URLs to test (.txt, .gz or - for stdin)",
+    )
     parser.add_argument(
         "--debug", default=False, action="store_true", help="Enable debug logging"
     )
@@ -52,6 +156,29 @@ def cli():
         action="store_true",
         help="Take screenshots of each page before and after consent is given (if consent manager is detected)",
     )
+    parser.add_argument(
+        "--screenshot_format",
+        default="png",
+        choices=screenshots.FORMATS,
+        help="Format of screenshots, webp needs Pillow. Default: png",
+    )
+    parser.add_argument(
+        "--screenshot_quality",
+        default=80,
+        type=int,
+        help="Quality (0-100) of jpeg and webp screenshots. Default: 80",
+    )
+    parser.add_argument(
+        "--screenshot_dir",
+        default="screenshots",
+        help="Directory to store screenshots in. Default: screenshots",
+    )
+    parser.add_argument(
+        "--screenshot_max_distance",
+        default=None,
+        type=int,
+        help="Also skip the screenshot after consent when it's nearly the same as the one before: at most this many bits (of 1024) of their difference hashes differ. Needs Pillow. Default: only skip identical screenshots",
+    )
     parser.add_argument(
         "--bootstrap",
         default=False,
@@ -63,7 +190,129 @@ def cli():
         "-b",
         default=15,
         type=int,
-        help="Number of URLs (and browser windows) to run in each batch. Default: 15, increase or decrease depending on your system capacity.",
+        help="Number of URLs (and browser windows) to run in parallel. Default: 15, increase or decrease depending on your system capacity.",
+    )
+    parser.add_argument(
+        "--flush_size",
+        "-f",
+        default=None,
+        type=int,
+        help="Number of results to collect before writing them to the database. Default: same as batch size.",
+    )
+    parser.add_argument(
+        "--shards",
+        "-s",
+        default=1,
+        type=int,
+        help="Number of worker processes, each with its own browser running --batch_size URLs in parallel. Default: 1",
+    )
+    parser.add_argument(
+        "--wait_strategy",
+        "-w",
+        default="event",
+        choices=["event", "fixed"],
+        help="How to wait for a page to be ready: 'event' continues as soon as a consent manager appears or the network is quiet (max 5 seconds), 'fixed' always waits 7 seconds. Default: event",
+    )
+    parser.add_argument(
+        "--block_resources",
+        "-br",
+        default=None,
+        const=",".join(crawl.DEFAULT_BLOCKED_RESOURCES),
+        nargs="?",
+        help=f"Don't download these (comma separated) resource types, requests are still recorded. Default when used without a value: {','.join(crawl.DEFAULT_BLOCKED_RESOURCES)}",
+    )
+    parser.add_argument(
+        "--keep_request_urls",
+        default=False,
+        action="store_true",
+        help="Store the full URLs of all requests of each page (uses a lot more memory and storage)",
+    )
+    parser.add_argument(
+        "--capture",
+        default="page",
+        choices=network.CAPTURE_BACKENDS,
+        help="How to capture requests: 'page' (requests of the page and its frames), 'context' (also popups and service workers), 'cdp' (Chromium's Network domain, the least overhead, but can miss the first requests of cross-origin iframes). Default: page",
+    )
+    parser.add_argument(
+        "--reuse_contexts",
+        default=0,
+        const=20,
+        nargs="?",
+        type=int,
+        help="Keep a pool of warm browser contexts and reset and reuse each context up to this many times. Default when used without a value: 20",
+    )
+    parser.add_argument(
+        "--preflight",
+        default=0,
+        const=100,
+        nargs="?",
+        type=int,
+        help="Check DNS and HTTP reachability of URLs before crawling them, with this many checks in parallel. Dead, parked and duplicate sites are recorded without opening a browser. Default when used without a value: 100",
+    )
+    parser.add_argument(
+        "--preflight_head",
+        default=False,
+        action="store_true",
+        help="Use HEAD requests for the preflight checks where possible. Faster, but parked domains are only detected when they redirect to a parking service",
+    )
+    parser.add_argument(
+        "--retries",
+        default=2,
+        type=int,
+        help="Retry URLs that fail with a transient error (timeouts, connection resets) up to this many times, with backoff, after all other URLs are crawled. Default: 2",
+    )
+    parser.add_argument(
+        "--adaptive_timeouts",
+        default=False,
+        action="store_true",
+        help="Derive the page load and consent timeouts from the latency observed in the run (3x p95, between 10 and 90 seconds for page loads) instead of using the maximum",
+    )
+    parser.add_argument(
+        "--metrics_port",
+        default=None,
+        type=int,
+        help="Serve Prometheus metrics (crawls, errors, consent managers, phase durations) on this port at /metrics",
+    )
+    parser.add_argument(
+        "--metrics_interval",
+        default=None,
+        type=utils.parse_duration,
+        help="Log the metrics as JSON at this interval, e.g. 60 or 5m",
+    )
+    parser.add_argument(
+        "--profile",
+        default=None,
+        help="Profile the crawl with cProfile and write the stats to this file (e.g. for snakeviz). With --shards only the main process is profiled.",
+    )
+    parser.add_argument(
+        "--resume",
+        default=False,
+        action="store_true",
+        help="Resume the last crawl run: skip URLs that already have results in that run",
+    )
+    parser.add_argument(
+        "--max_age",
+        "--max-age",
+        default=None,
+        type=utils.parse_duration,
+        help="Skip sites with a successful result younger than this, e.g. 12h or 7d",
+    )
+    parser.add_argument(
+        "--ndjson",
+        default=False,
+        action="store_true",
+        help="Stream every result to stdout as a line of JSON as soon as it's crawled, e.g. to pipe into jq",
+    )
+    parser.add_argument(
+        "--parquet",
+        default=None,
+        help="Also write the results to Parquet files (typed columns) in this directory, needs pyarrow",
+    )
+    parser.add_argument(
+        "--parquet_file_size",
+        default=256,
+        type=int,
+        help="Start a new Parquet file when a file exceeds this size in MB. Default: 256",
     )
     parser.add_argument(
         "--show_output",
@@ -78,9 +327,21 @@ def cli():
         default="crawl_results.db",
         help="Path to crawl results and blocklist database",
     )
+    parser.add_argument(
+        "--normalise",
+        default=False,
+        action="store_true",
+        help="Also store domains, cookies and consent managers in indexed tables for 'consentcrawl query'",
+    )
     parser.add_argument(
         "--blocklists", "-bf", default=None, help="Path to custom blocklists file"
     )
+    parser.add_argument(
+        "--consent_managers",
+        "-cm",
+        default=None,
+        help="Path to a YAML file with additional consent managers (reloaded when changed)",
+    )
 
     args = parser.parse_args()
 
@@ -101,46 +362,108 @@ def cli():
             logging.error(f"Blocklists file must be a YAML file: {args.blocklists}")
             sys.exit(1)
 
-    if not os.path.isdir("screenshots") and args.screenshot == True:
-        os.mkdir("screenshots")
-
-    # List of URLs to test
-    if args.url.endswith(".txt"):
-        with open(args.url, "r") as f:
-            urls = list(
-                set(
-                    [
-                        l.strip().lower()
-                        for l in set(f.readlines())
-                        if len(l) > 0 and not l.startswith("#")
-                    ]
+    if args.consent_managers != None:
+        if not os.path.isfile(args.consent_managers):
+            logging.error(f"Consent managers file not found: {args.consent_managers}")
+            sys.exit(1)
+
+        registry = consent_managers.ConsentManagerRegistry(
+            files=[args.consent_managers]
+        )
+    else:
+        registry = consent_managers.get_registry()
+
+    if args.block_resources != None:
+        args.block_resources = [r.strip() for r in args.block_resources.split(",")]
+        unknown = set(args.block_resources) - set(crawl.BLOCKABLE_RESOURCES)
+        if len(unknown) > 0:
+            logging.error(
+                f"Unable to block resource types {', '.join(unknown)}, choose from: {', '.join(crawl.BLOCKABLE_RESOURCES)}"
+            )
+            sys.exit(1)
+
+    if args.screenshot == True:
+        try:
+            args.screenshot = screenshots.ScreenshotStore(
+                directory=args.screenshot_dir,
+                format=args.screenshot_format,
+                quality=args.screenshot_quality,
+                max_distance=args.screenshot_max_distance,
+            )
+        except Exception as e:
+            logging.error(e)
+            sys.exit(1)
+
+    # results are streamed to the exporters as they are crawled
+    exporters = []
+    if args.ndjson:
+        exporters.append(export.NDJSONExporter())
+    if args.parquet:
+        try:
+            exporters.append(
+                export.ParquetExporter(
+                    args.parquet, max_file_size=args.parquet_file_size * 1024 * 1024
                 )
             )
+        except Exception as e:
+            logging.error(e)
+            sys.exit(1)
 
-    elif args.url != "":
-        urls = args.url.split(",")
-    else:
+    # URLs to test are streamed from the input and deduplicated in constant
+    # memory, so crawling starts right away even for very large lists
+    if args.url == "":
         logging.error("No URL or valid .txt file with URLs to test")
+        sys.exit(1)
+    urls = utils.dedupe(utils.read_urls(args.url))
 
     # Bootstrap blocklists
     blockers = blocklists.Blocklists(
         db_file=args.db_file,
         source_file=args.blocklists,
         force_bootstrap=args.bootstrap,
+        # share one memory-mapped copy of the blocklists between all shards
+        snapshot=args.shards > 1,
     )
 
-    results = asyncio.run(
-        process_urls(
-            urls=urls,
-            batch_size=args.batch_size,
-            tracking_domains_list=blockers.get_domains(),
-            headless=args.headless,
-            screenshot=args.screenshot,
-            results_db_file=args.db_file,
+    crawl_metrics = metrics.get_metrics()
+    if args.metrics_port:
+        crawl_metrics.serve(args.metrics_port)
+    if args.metrics_interval:
+        crawl_metrics.log_periodically(args.metrics_interval)
+
+    with metrics.profile(args.profile) if args.profile else contextlib.nullcontext():
+        results = asyncio.run(
+            process_urls(
+                urls=urls,
+                batch_size=args.batch_size,
+                tracking_domains_list=blockers.get_domains(),
+                headless=args.headless,
+                screenshot=args.screenshot,
+                results_db_file=args.db_file,
+                flush_size=args.flush_size,
+                shards=args.shards,
+                registry=registry,
+                wait_strategy=args.wait_strategy,
+                block_resources=args.block_resources,
+                keep_request_urls=args.keep_request_urls,
+                capture_backend=args.capture,
+                reuse_contexts=args.reuse_contexts,
+                normalise=args.normalise,
+                resume=args.resume,
+                max_age=args.max_age,
+                preflight_concurrency=args.preflight,
+                preflight_check_content=not args.preflight_head,
+                retries=args.retries,
+                adaptive_timeouts=args.adaptive_timeouts,
+                exporters=exporters,
+            )
         )
-    )
 
-    if args.show_output and len(results) < 25:
+    logging.debug(f"Consent manager hit rates: {json.dumps(registry.stats())}")
+    if args.metrics_interval:
+        logging.info(f"Metrics: {json.dumps(crawl_metrics.to_dict())}")
+
+    if args.show_output and not args.ndjson and len(results) < 25:
         sys.stdout.write(json.dumps(results, indent=2))
 
     sys.exit(0)
@@ -0,0 +1,246 @@
+import os
+import logging
+import threading
+import yaml
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from time import monotonic
+
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONSENT_MANAGERS_FILE = f"{MODULE_DIR}/assets/consent_managers.yml"
+ACTION_TYPES = ["iframe", "css-selector", "css-selector-list", "xpath"]
+GENERIC_BRAND = "Custom / Generic"
+
+
+@dataclass(frozen=True)
+class Action:
+    type: str
+    value: object
+
+
+@dataclass(frozen=True)
+class ConsentManager:
+    """
+    Immutable, validated consent manager definition. `rule` is the compiled
+    form used by the in-page detection script.
+    """
+
+    id: str
+    name: str
+    brand: str
+    actions: tuple
+    generic: bool = False
+    rule: dict = field(default=None, compare=False, repr=False)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "brand": self.brand,
+            "actions": [
+                {
+                    "type": a.type,
+                    "value": list(a.value) if isinstance(a.value, tuple) else a.value,
+                }
+                for a in self.actions
+            ],
+        }
+
+
+def compile_consent_manager(data, source="?"):
+    """
+    Validate a consent manager definition from a YAML file and compile it into
+    an immutable ConsentManager.
+    """
+    for key in ["id", "actions"]:
+        if key not in data:
+            raise Exception(f"Consent manager in {source} is missing '{key}': {data}")
+
+    actions = []
+    for action in data["actions"]:
+        if action.get("type") not in ACTION_TYPES:
+            raise Exception(
+                f"Unknown action type '{action.get('type')}' for consent manager '{data['id']}' in {source}"
+            )
+
+        value = action.get("value")
+        if action["type"] == "css-selector-list":
+            if not isinstance(value, list) or len(value) == 0:
+                raise Exception(
+                    f"Action 'css-selector-list' of consent manager '{data['id']}' in {source} needs a list of selectors"
+                )
+            value = tuple(value)
+        elif not isinstance(value, str) or value == "":
+            raise Exception(
+                f"Action '{action['type']}' of consent manager '{data['id']}' in {source} needs a selector"
+            )
+
+        actions.append(Action(type=action["type"], value=value))
+
+    brand = data.get("brand", "")
+    return ConsentManager(
+        id=data["id"],
+        name=data.get("name", data["id"]),
+        brand=brand,
+        actions=tuple(actions),
+        generic=data.get("generic", brand == GENERIC_BRAND),
+        rule={
+            "actions": [
+                {
+                    "type": "iframe" if a.type == "iframe" else "css-selector",
+                    "value": list(a.value) if isinstance(a.value, tuple) else [a.value],
+                }
+                for a in actions
+                if a.type != "xpath"
+            ]
+        },
+    )
+
+
+class ConsentManagerRegistry:
+    """
+    Loads and validates the consent manager definitions once and hands out
+    immutable ConsentManager objects, so definitions are not re-parsed for
+    every page and concurrent crawls can't affect each other.
+
+    Keeps statistics on how often each consent manager is found (overall and
+    per top level domain) and orders them by how likely they are for a site,
+    e.g. Didomi first on .fr sites. Generic definitions always come last.
+    Custom files are checked for changes (at most every `reload_interval`
+    seconds) and reloaded without restarting.
+    """
+
+    def __init__(self, files=None, include_default=True, reload_interval=10):
+        self.files = ([CONSENT_MANAGERS_FILE] if include_default else []) + list(
+            files or []
+        )
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtimes = {}
+        self._last_check = 0
+        self._consent_managers = ()
+        self._order_cache = {}
+        self.pages = Counter()
+        self.hits = defaultdict(Counter)
+        self.load()
+
+    def __reduce__(self):
+        # recreate from the files (without statistics) in other processes
+        return (
+            self.__class__,
+            (self.files, False, self.reload_interval),
+        )
+
+    def load(self):
+        """
+        (Re)load all files. Definitions in later files replace definitions with
+        the same id in earlier files.
+        """
+        consent_managers = {}
+        mtimes = {}
+        for file in self.files:
+            mtimes[file] = os.path.getmtime(file)
+            with open(file, "r") as f:
+                for data in yaml.safe_load(f) or []:
+                    cmp = compile_consent_manager(data, source=file)
+                    consent_managers[cmp.id] = cmp
+
+        with self._lock:
+            self._consent_managers = tuple(consent_managers.values())
+            self._mtimes = mtimes
+            self._order_cache = {}
+        logging.debug(f"Loaded {len(consent_managers)} consent managers")
+
+    def add_file(self, file):
+        self.files.append(file)
+        self.load()
+
+    def reload_if_changed(self):
+        now = monotonic()
+        if now - self._last_check < self.reload_interval:
+            return
+        self._last_check = now
+
+        try:
+            changed = any(
+                os.path.getmtime(file) != mtime for file, mtime in self._mtimes.items()
+            )
+        except OSError:
+            changed = True
+
+        if changed:
+            logging.info("Consent manager definitions changed, reloading")
+            try:
+                self.load()
+            except Exception as e:
+                # keep the previous definitions when an edit is invalid
+                logging.error(f"Unable to reload consent managers: {e}")
+
+    def get_consent_managers(self, tld=None):
+        """
+        Return all consent managers, most likely first for the given top level
+        domain.
+        """
+        self.reload_if_changed()
+
+        with self._lock:
+            if tld not in self._order_cache:
+                tld_hits = self.hits.get(tld, Counter())
+                overall_hits = self.hits[None]
+                order = {cmp.id: i for i, cmp in enumerate(self._consent_managers)}
+                self._order_cache[tld] = tuple(
+                    sorted(
+                        self._consent_managers,
+                        key=lambda cmp: (
+                            cmp.generic,
+                            -tld_hits[cmp.id],
+                            -overall_hits[cmp.id],
+                            order[cmp.id],
+                        ),
+                    )
+                )
+            return self._order_cache[tld]
+
+    def record(self, cmp_id, tld=None):
+        """
+        Record the result of a detection on a page (cmp_id None when no
+        consent manager was found).
+        """
+        with self._lock:
+            for key in {None, tld}:
+                self.pages[key] += 1
+                if cmp_id is not None:
+                    self.hits[key][cmp_id] += 1
+            if cmp_id is not None:
+                self._order_cache = {}
+
+    def stats(self):
+        """
+        Return the hit rate of every consent manager, overall and per top
+        level domain.
+        """
+        with self._lock:
+            return {
+                (tld or "all"): {
+                    "pages": pages,
+                    "hit_rate": sum(self.hits[tld].values()) / pages,
+                    "consent_managers": {
+                        cmp_id: count / pages
+                        for cmp_id, count in self.hits[tld].most_common()
+                    },
+                }
+                for tld, pages in self.pages.items()
+            }
+
+
+_registry = None
+
+
+def get_registry():
+    """
+    Return the shared registry with the default consent manager definitions.
+    """
+    global _registry
+    if _registry is None:
+        _registry = ConsentManagerRegistry()
+    return _registry
@@ -5,17 +5,44 @@ import datetime
 import re
 import base64
 import random
-import yaml
 import asyncio
-import sqlite3
+import time
+import functools
 from datetime import date, datetime
-from pathlib import Path
 from playwright.async_api import TimeoutError as PlaywrightTimeoutError
 from playwright.async_api import async_playwright
-from consentcrawl import utils
+from consentcrawl import (
+    utils,
+    consent_managers,
+    metrics,
+    network,
+    pool,
+    retry,
+    screenshots,
+    storage,
+)
 
 MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
-CONSENT_MANAGERS_FILE = f"{MODULE_DIR}/assets/consent_managers.yml"
+with open(f"{MODULE_DIR}/assets/detect_consent_manager.js", "r") as f:
+    DETECT_CONSENT_MANAGER_SCRIPT = f.read()
+
+# resolves as soon as one of the consent managers has a visible accept button
+WAIT_FOR_CONSENT_MANAGER_SCRIPT = (
+    f"(rules) => ({DETECT_CONSENT_MANAGER_SCRIPT}\n)(rules).match !== null"
+)
+
+# resource types that are not downloaded with `block_resources`, the requests
+# are still recorded
+DEFAULT_BLOCKED_RESOURCES = ["image", "media", "font"]
+# documents, scripts and requests made by scripts always load so the tracking
+# behaviour of a site stays the same
+BLOCKABLE_RESOURCES = ["image", "media", "font", "stylesheet", "texttrack", "manifest"]
+
+# blocked images get a transparent pixel so onload handlers (e.g. of tracking
+# pixels) still fire, other resource types get an empty response
+TRANSPARENT_GIF = base64.b64decode(
+    "R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7"
+)
 
 DEFAULT_UA_STRINGS = [
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 13_5_2) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36 Edg/116.0.1938.81"
@@ -38,77 +65,277 @@ def get_extract_schema():
         "screenshot_files": "STRING",
         "meta_tags": "STRING",
         "json_ld": "STRING",
+        "ready_state": "STRING",
+        "request_stats": "STRING",
+        "request_urls": "STRING",
+        "timings": "STRING",
         "status": "STRING",
         "status_msg": "STRING",
     }
 
 
 def get_consent_managers():
-    with open(CONSENT_MANAGERS_FILE, "r") as f:
-        data = yaml.safe_load(f)
-        return data
+    return [
+        cmp.to_dict() for cmp in consent_managers.get_registry().get_consent_managers()
+    ]
 
 
-async def click_consent_manager(page):
-    """Retrieve list of potential consent managers and required actions to accept. Then click and return the consent manager."""
-    consent_managers = get_consent_managers()
+async def locate_consent_manager(page, cmp):
+    """
+    Find the accept button of a single consent manager with Playwright
+    locators, checking every selector with a separate call to the browser.
+    Returns the locator and the selector or (None, None) when not visible.
+    """
+    parent_locator = page
+
+    for action in cmp.actions:
+        if action.type == "iframe":
+            if await parent_locator.locator(action.value).count() > 0:
+                parent_locator = parent_locator.frame_locator(action.value).first
+            else:
+                continue
 
-    for cmp in consent_managers:
-        parent_locator = page
-        locator = None
+        elif action.type == "css-selector":
+            if await parent_locator.locator(action.value).first.is_visible():
+                return parent_locator.locator(action.value), action.value
 
-        for action in cmp["actions"]:
-            if action["type"] == "iframe":
-                if await parent_locator.locator(action["value"]).count() > 0:
-                    parent_locator = parent_locator.frame_locator(action["value"]).first
-                else:
-                    continue
+        elif action.type == "css-selector-list":
+            for selector in action.value:
+                if await parent_locator.locator(selector).first.is_visible():
+                    return parent_locator.locator(selector), selector
 
-            elif action["type"] == "css-selector":
-                if await parent_locator.locator(action["value"]).first.is_visible():
-                    locator = parent_locator.locator(action["value"])
-                    break
+        elif action.type == "xpath":
+            logging.info("XPath not implemented yet.")
 
-            elif action["type"] == "css-selector-list":
-                for selector in action["value"]:
-                    if await parent_locator.locator(selector).first.is_visible():
-                        locator = parent_locator.locator(selector)
-                        cmp["selector-list-item"] = selector
-                        break
+    return None, None
 
-            elif action["type"] == "xpath":
-                logging.info("XPath not implemented yet.")
 
+async def find_consent_manager(page, consent_managers, detection="script"):
+    """
+    Find the first of a list of (compiled) consent managers with a visible
+    accept button. Returns the consent manager, the locator of the button and
+    the selector that matched, or (None, None, None) if none is found.
+
+    With the (default) 'script' detection all consent managers are checked in
+    a single evaluation in the page (which, like locators, also looks in open
+    shadow roots), only falling back to locators for consent managers in
+    cross-origin iframes or with selectors that aren't valid CSS. With 'locator' detection every consent manager is checked with
+    Playwright locators.
+    """
+    if detection == "locator":
+        for cmp in consent_managers:
+            locator, selector = await locate_consent_manager(page, cmp)
+            if locator is not None:
+                return cmp, locator, selector
+        return None, None, None
+
+    try:
+        result = await page.evaluate(
+            DETECT_CONSENT_MANAGER_SCRIPT, [cmp.rule for cmp in consent_managers]
+        )
+    except Exception as e:
+        # e.g. when the page navigates during the evaluation
+        logging.debug(f"Consent manager detection script failed: {e}")
+        return await find_consent_manager(page, consent_managers, detection="locator")
+
+    match = result["match"]
+    match_index = match["index"] if match else len(consent_managers)
+
+    # consent managers listed before the match that couldn't be checked in
+    # the page take precedence, like they would when checked one by one
+    for index in sorted(result["fallbacks"]):
+        if index >= match_index:
+            break
+        locator, selector = await locate_consent_manager(page, consent_managers[index])
         if locator is not None:
-            logging.debug(
-                f"Found { await locator.count()} elements for consent manager '{cmp['id']}'"
-            )
+            return consent_managers[index], locator, selector
+
+    if match is None:
+        return None, None, None
+
+    parent_locator = page
+    for frame_selector in match["frames"]:
+        parent_locator = parent_locator.frame_locator(frame_selector).first
+
+    return (
+        consent_managers[match_index],
+        parent_locator.locator(match["selector"]),
+        match["selector"],
+    )
+
+
+async def click_consent_manager(page, detection="script", registry=None, timeout=15000):
+    """Retrieve list of potential consent managers and required actions to accept. Then click and return the consent manager.
+    `timeout` is how long (ms) to wait for the page to navigate after the click."""
+    if registry is None:
+        registry = consent_managers.get_registry()
+
+    tld = utils.get_tld(page.url)
+    start_time = time.monotonic()
+    cmp, locator, selector = await find_consent_manager(
+        page, registry.get_consent_managers(tld), detection=detection
+    )
+    logging.debug(
+        f"Consent manager detection ({detection}) took "
+        f"{(time.monotonic() - start_time) * 1000:.0f} ms on {page.url}"
+    )
+    registry.record(cmp.id if cmp else None, tld)
+
+    if cmp is not None:
+        logging.debug(f"Found consent manager '{cmp.id}' with selector '{selector}'")
+        result = cmp.to_dict()
+        if any(action.type == "css-selector-list" for action in cmp.actions):
+            result["selector-list-item"] = selector
+
+        try:
+            # explicit wait for navigation as some pages will reload after accepting cookies
+            async with page.expect_navigation(
+                wait_until="networkidle", timeout=timeout
+            ):
+                await locator.first.click(delay=10)
+                logging.debug(f"Clicked consent manager '{cmp.id}'")
+
+                return result
+        except PlaywrightTimeoutError:
+            logging.debug("Timeout, no navigation")
+            result["status"] = "timeout"
+            return result
 
-            try:
-                # explicit wait for navigation as some pages will reload after accepting cookies
-                async with page.expect_navigation(
-                    wait_until="networkidle", timeout=15000
-                ):
-                    await locator.first.click(delay=10)
-                    logging.debug(f"Clicked consent manager '{cmp['id']}'")
-
-                    return cmp
-            except PlaywrightTimeoutError:
-                logging.debug("Timeout, no navigation")
-                cmp["status"] = "timeout"
-                return cmp
-
-            except Exception as e:
-                error_msg = f"Error clicking consent manager '{cmp['id']}': {e}"
-                logging.debug(error_msg)
-                cmp["status"] = "error"
-                cmp["error"] = error_msg
-                return cmp
+        except Exception as e:
+            error_msg = f"Error clicking consent manager '{cmp.id}': {e}"
+            logging.debug(error_msg)
+            result["status"] = "error"
+            result["error"] = error_msg
+            return result
 
     logging.debug(f"Unable to accept cookies on: {page.url}")
     return {}
 
 
+class NetworkMonitor:
+    """
+    Keep track of the requests of a page that are still in flight, to determine
+    when the network has been quiet for a while. Requests are reported by
+    network.RequestCapture: from a CDP session, or with Playwright's request
+    events (see listen).
+    """
+
+    def __init__(self):
+        self.in_flight = set()
+        self.last_activity = time.monotonic()
+
+    def listen(self, page):
+        page.on("request", self.start)
+        page.on("requestfinished", self.finish)
+        page.on("requestfailed", self.finish)
+
+    def start(self, request):
+        self.in_flight.add(request)
+        self.last_activity = time.monotonic()
+
+    def finish(self, request):
+        self.in_flight.discard(request)
+        self.last_activity = time.monotonic()
+
+    async def wait_for_idle(self, idle_time=500):
+        """Wait until no requests have been in flight for `idle_time` ms."""
+        while True:
+            quiet_for = time.monotonic() - self.last_activity
+            if len(self.in_flight) == 0 and quiet_for * 1000 >= idle_time:
+                return
+            await asyncio.sleep(0.05)
+
+
+async def wait_until_ready(
+    page, monitor, timeout=5000, network_idle_time=500, registry=None
+):
+    """
+    Wait until a consent manager with a visible accept button appears or the
+    network has been quiet for `network_idle_time` ms, whichever comes first,
+    but no longer than `timeout` ms. Returns the condition that fired:
+    "consent_manager", "network_idle" or "timeout".
+    """
+    if registry is None:
+        registry = consent_managers.get_registry()
+
+    rules = [cmp.rule for cmp in registry.get_consent_managers(utils.get_tld(page.url))]
+    conditions = {
+        asyncio.ensure_future(
+            page.wait_for_function(
+                WAIT_FOR_CONSENT_MANAGER_SCRIPT,
+                arg=rules,
+                polling=100,
+                timeout=timeout,
+            )
+        ): "consent_manager",
+        asyncio.ensure_future(monitor.wait_for_idle(network_idle_time)): "network_idle",
+    }
+
+    deadline = time.monotonic() + timeout / 1000
+    try:
+        remaining = conditions
+        while len(remaining) > 0:
+            done, remaining = await asyncio.wait(
+                remaining,
+                timeout=max(deadline - time.monotonic(), 0),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if len(done) == 0:
+                break
+            for task in done:
+                # a failed condition (e.g. the page navigated while polling)
+                # doesn't end the wait, the other condition may still fire
+                if task.exception() is None:
+                    return conditions[task]
+                logging.debug(
+                    f"Readiness condition '{conditions[task]}' failed on {page.url}: {task.exception()}"
+                )
+        return "timeout"
+
+    finally:
+        for task in conditions:
+            task.cancel()
+        await asyncio.gather(*conditions, return_exceptions=True)
+
+
+async def block_resources_route(route, blocked):
+    """
+    Answer requests for the blocked resource types with a stub instead of
+    downloading them, let all other requests through.
+    """
+    resource_type = route.request.resource_type
+    if resource_type not in blocked:
+        await route.continue_()
+    elif resource_type == "image":
+        await route.fulfill(status=200, content_type="image/gif", body=TRANSPARENT_GIF)
+    else:
+        await route.fulfill(status=200, body=b"")
+
+
+async def new_browser_context(browser, device={}, block_resources=None):
+    """
+    Create a browser context with the device profile (a random user agent by
+    default), the init script and the route to block resources applied.
+    """
+    device = {
+        "user_agent": random.choice(DEFAULT_UA_STRINGS),
+        "viewport": {"width": 1366, "height": 768},
+        **device,
+    }
+    browser_context = await browser.new_context(**device)
+    await browser_context.add_init_script(
+        "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
+    )
+
+    if block_resources:
+        blocked = set(block_resources)
+        await browser_context.route(
+            "**/*", lambda route: block_resources_route(route, blocked)
+        )
+
+    return browser_context
+
+
 async def get_jsonld(page):
     json_ld = []
     for item in await page.locator('script[type="application/ld+json"]').all():
@@ -148,10 +375,51 @@ async def crawl_url(
     screenshot=True,
     device={},
     wait_for_timeout=5000,
+    registry=None,
+    wait_strategy="event",
+    network_idle_time=500,
+    block_resources=None,
+    keep_request_urls=False,
+    capture_backend="page",
+    context_pool=None,
+    goto_timeout=90000,
+    consent_timeout=15000,
 ):
     """
     Open a new browser context with a URL and extract data about cookies and
     tracking domains before and after consent.
+
+    With the "event" `wait_strategy` the page is considered ready as soon as a
+    consent manager appears or the network has been quiet for
+    `network_idle_time` ms, with `wait_for_timeout` ms as the upper limit. The
+    "fixed" strategy always waits 2 seconds plus `wait_for_timeout` ms. The
+    condition that ended the wait is stored in `ready_state`.
+
+    `block_resources` is a list of resource types (e.g. DEFAULT_BLOCKED_RESOURCES)
+    that are not downloaded. They are still requested from the page's point of
+    view and recorded, but answered with an empty stub. Note that this disables
+    the browser's HTTP cache for the context.
+
+    Requests are classified as they are made; the full request URLs are only
+    included in the output (`request_urls`) with `keep_request_urls`.
+    `capture_backend` selects how requests are captured, see
+    network.RequestCapture.
+
+    With a `context_pool` (pool.ContextPool) a warm context and page are taken
+    from the pool and returned to it afterwards; `device` and
+    `block_resources` are then set by the pool.
+
+    `screenshot` is True (to use the default screenshots.ScreenshotStore) or
+    a ScreenshotStore. Screenshots are saved in the background and the
+    references to the stored files are included in `screenshot_files`.
+
+    The time spent in each phase of the crawl (in ms) is included in
+    `timings`, see metrics.PhaseTimer.
+
+    `goto_timeout` is the time (ms) the page gets to load, `consent_timeout`
+    the time to wait for a navigation after clicking the consent manager (see
+    retry.CrawlTimeouts for timeouts based on the observed latency).
+
     Returns:
     - All third party domains requested
     - Third party domains requested before consent
@@ -163,6 +431,10 @@ async def crawl_url(
     - Screenshot of the site before consenting
     """
     output = {k: None for k in get_extract_schema().keys()}
+    browser_context = None
+    screenshot_store = screenshots.get_store() if screenshot is True else screenshot
+    screenshot_tasks = []
+    timer = metrics.PhaseTimer()
 
     try:
         if not url.startswith("http"):
@@ -171,77 +443,80 @@ async def crawl_url(
         output["url"] = url
         output["extraction_datetime"] = str(datetime.now())
 
-        if not "user_agent" in device:
-            device["user_agent"] = random.choice(DEFAULT_UA_STRINGS)
-
-        if not "viewport" in device:
-            device["viewport"] = {"width": 1366, "height": 768}
-
-        browser_context = await browser.new_context(
-            **device,
-        )
-        await browser_context.add_init_script(
-            "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
-        )
-
-        output["domain_name"] = re.search("(?:https?://)?(?:www.)?([^/]+)", url).group(
-            1
-        )
-        base64_url = base64.urlsafe_b64encode(
-            output["domain_name"].encode("ascii")
-        ).decode("ascii")
+        if context_pool is not None:
+            browser_context, page = await context_pool.acquire()
+        else:
+            browser_context = await new_browser_context(
+                browser, device=device, block_resources=block_resources
+            )
+            page = await browser_context.new_page()
+        timer.mark("setup")
 
-        output["id"] = base64_url
+        output["domain_name"] = utils.get_domain_name(url)
+        output["id"] = utils.get_crawl_id(url)
 
         logging.info(f"Start extracting data from domain {output['domain_name']}")
 
-        req_urls = []
-
-        page = await browser_context.new_page()
-        page.on("request", lambda req: req_urls.append(req.url))
-
-        await page.goto(url, wait_until="load", timeout=90000)
+        classifier = network.RequestClassifier(
+            output["domain_name"],
+            tracking_domains_list,
+            keep_request_urls=keep_request_urls,
+        )
 
-        # Do some mouse jiggling to keep some pages happy
-        await page.wait_for_timeout(2000)
-        await page.mouse.move(543, 123)
-        await page.mouse.wheel(0, -123)
-        await page.wait_for_timeout(
-            wait_for_timeout
-        )  # additional wait time just to be sure as consent managers can sometimes take a while to load
+        monitor = NetworkMonitor()
+        capture = network.RequestCapture(
+            classifier, backend=capture_backend, monitor=monitor
+        )
+        await capture.start(browser_context, page)
+
+        await page.goto(url, wait_until="load", timeout=goto_timeout)
+        timer.mark("navigation")
+
+        if wait_strategy == "fixed":
+            # Do some mouse jiggling to keep some pages happy
+            await page.wait_for_timeout(2000)
+            await page.mouse.move(543, 123)
+            await page.mouse.wheel(0, -123)
+            await page.wait_for_timeout(
+                wait_for_timeout
+            )  # additional wait time just to be sure as consent managers can sometimes take a while to load
+            output["ready_state"] = "fixed"
+        else:
+            await page.mouse.move(543, 123)
+            await page.mouse.wheel(0, -123)
+            start_time = time.monotonic()
+            output["ready_state"] = await wait_until_ready(
+                page,
+                monitor,
+                timeout=wait_for_timeout,
+                network_idle_time=network_idle_time,
+                registry=registry,
+            )
+            logging.debug(
+                f"Page ready ({output['ready_state']}) after "
+                f"{(time.monotonic() - start_time) * 1000:.0f} ms on {url}"
+            )
+        timer.mark("wait")
 
-        if screenshot:
-            await page.screenshot(path=f'./screenshots/screenshot_{output["id"]}.png')
-            output["screenshot_files"] = [
-                f'./screenshots/screenshot_{output["id"]}.png'
-            ]
+        if screenshot_store:
+            screenshot_tasks.append(
+                screenshot_store.save(
+                    await screenshot_store.capture(page), "no_consent"
+                )
+            )
+            timer.mark("screenshot")
 
         logging.debug(f"Retrieving JSON-LD and meta tags on {output['domain_name']}")
         output["json_ld"] = await get_jsonld(page)
         output["meta_tags"] = await get_meta_tags(page)
+        timer.mark("extract")
 
         # Capture data pre-consent
-        thirdparty_requests = list(
-            filter(lambda req_url: not output["domain_name"] in req_url, req_urls)
+        output["third_party_domains_no_consent"] = classifier.get_third_party_domains(
+            "no_consent"
         )
-        output["third_party_domains_no_consent"] = list(
-            set(
-                map(
-                    lambda r: re.search("https?://(?:www.)?([^\/]+\.[^\/]+)", r).group(
-                        1
-                    ),
-                    thirdparty_requests,
-                )
-            )
-        )
-        output["tracking_domains_no_consent"] = list(
-            set(
-                [
-                    re.search("[^\.]+\.[a-z]+$", d).group(0)
-                    for d in output["third_party_domains_no_consent"]
-                    if d in tracking_domains_list
-                ]
-            )
+        output["tracking_domains_no_consent"] = classifier.get_tracking_domains(
+            "no_consent"
         )
 
         cookies = await browser_context.cookies()
@@ -257,46 +532,46 @@ async def crawl_url(
             }
             for c in cookies
         ]
+        timer.mark("cookies")
 
-        # try to accept full marketing consent
+        # try to accept full marketing consent, requests from here on count as
+        # after consent
+        capture.consent_given()
         logging.debug(
             f"Trying to accept full marketing consent on {output['domain_name']}"
         )
-        output["consent_manager"] = await click_consent_manager(page)
-
-        if screenshot and output["consent_manager"].get("status", "") not in [
-            "error",
-            "",
-        ]:
-            await page.screenshot(
-                path=f'./screenshots/screenshot_{output["id"]}_afterconsent.png'
-            )
-            output["screenshot_files"].append(
-                f'./screenshots/screenshot_{output["id"]}_afterconsent.png'
-            )
-
-        thirdparty_requests = list(
-            filter(lambda req_url: not output["domain_name"] in req_url, req_urls)
+        output["consent_manager"] = await click_consent_manager(
+            page, registry=registry, timeout=consent_timeout
         )
-        output["third_party_domains_all"] = list(
-            set(
-                map(
-                    lambda r: re.search("https?://(?:www.)?([^\/]+\.[^\/]+)", r).group(
-                        1
-                    ),
-                    thirdparty_requests,
+        timer.mark("consent")
+
+        # a consent manager was found and clicked (successful clicks have no
+        # status, "timeout" means the page didn't navigate after the click)
+        if (
+            screenshot_store
+            and output["consent_manager"]
+            and output["consent_manager"].get("status") != "error"
+        ):
+            screenshot_tasks.append(
+                screenshot_store.save(
+                    await screenshot_store.capture(page),
+                    "consent",
+                    previous=screenshot_tasks[0],
                 )
             )
+            timer.mark("screenshot")
+
+        await capture.stop()
+        output["third_party_domains_all"] = classifier.get_third_party_domains()
+        output["tracking_domains_all"] = classifier.get_tracking_domains()
+        output["request_stats"] = {**classifier.stats(), "capture": capture.backend}
+        logging.debug(
+            f"Classified {output['request_stats']['requests']} requests on {url} "
+            f"({output['request_stats']['memory_bytes'] / 1024:.0f} KiB)"
         )
-        output["tracking_domains_all"] = list(
-            set(
-                [
-                    re.search("[^\.]+\.[a-z]+$", d).group(0)
-                    for d in output["third_party_domains_all"]
-                    if d in tracking_domains_list
-                ]
-            )
-        )
+        if keep_request_urls:
+            output["request_urls"] = classifier.request_urls
+        timer.mark("requests")
 
         cookies = await browser_context.cookies()
 
@@ -312,8 +587,18 @@ async def crawl_url(
             }
             for c in cookies
         ]
+        timer.mark("cookies")
 
-        await browser_context.close()
+        await close_browser_context(browser_context, context_pool)
+        timer.mark("close")
+
+        if screenshot_store:
+            output["screenshot_files"] = await screenshot_store.get_references(
+                screenshot_tasks
+            )
+            timer.mark("screenshot_write")
+
+        output["timings"] = timer.finish()
 
         output["status"] = "success"
         output["status_msg"] = f"Successfully extracted data from {url}"
@@ -327,9 +612,29 @@ async def crawl_url(
         output["status"] = "error"
         output["status_msg"] = error_msg
 
+        if browser_context is not None:
+            await close_browser_context(browser_context, context_pool, discard=True)
+
+        # don't leave screenshots half written
+        await asyncio.gather(*screenshot_tasks, return_exceptions=True)
+
+        timer.mark("error")
+        output["timings"] = timer.finish()
+
         return output
 
 
+async def close_browser_context(browser_context, context_pool=None, discard=False):
+    """Close a browser context or return it to the pool it came from."""
+    try:
+        if context_pool is not None:
+            await context_pool.release(browser_context, discard=discard)
+        else:
+            await browser_context.close()
+    except Exception as e:
+        logging.debug(f"Error closing browser context: {e}")
+
+
 async def crawl_batch(
     urls,
     results_function,
@@ -337,43 +642,169 @@ async def crawl_batch(
     tracking_domains_list=[],
     browser_config=None,
     screenshot=False,
+    flush_size=None,
+    registry=None,
+    wait_strategy="event",
+    block_resources=None,
+    keep_request_urls=False,
+    capture_backend="page",
+    reuse_contexts=0,
+    retries=2,
+    adaptive_timeouts=False,
+    on_result=None,
     **kwargs,
 ):
     """
-    Run the crawler for multiple URLs in batches and apply a (async) function
-    to the results. Additional arguments can be passed to the results function.
+    Run the crawler for multiple URLs and apply a (async) function to the
+    results. Additional arguments can be passed to the results function.
+    `urls` can be any sync or async iterable, URLs are taken from it as slots
+    become available.
+
+    `batch_size` is the number of crawls kept in flight: as soon as one URL
+    finishes the next one is started, so a single slow site only holds up its
+    own slot. Results are passed to `results_function` in groups of
+    `flush_size` (defaults to `batch_size`). `registry` is the
+    ConsentManagerRegistry to use (defaults to the built-in consent managers).
+    With `reuse_contexts` browser contexts are taken from a pool of warm
+    contexts and reset and reused up to `reuse_contexts` times. `screenshot`
+    can be True or a screenshots.ScreenshotStore, see crawl_url.
+
+    URLs that fail with a transient error (e.g. a timeout or connection reset)
+    are retried up to `retries` times once the input is exhausted, with
+    backoff, so they don't hold up the main pass; see retry.RetryQueue. With
+    `adaptive_timeouts` the navigation and consent timeouts follow the
+    latency observed in this run, see retry.CrawlTimeouts.
+
+    `on_result` is called with every result as soon as its crawl is done,
+    before the results are passed on in groups (e.g. an exporter's
+    write_result, see export.py).
     """
 
     if not browser_config:
         browser_config = {"headless": True, "channel": "msedge"}
 
+    if not flush_size:
+        flush_size = batch_size
+
+    next_url = utils.shared_iterator(urls)
+    pending = []
+    results = []
+    stats = {"crawled": 0, "busy_time": 0.0}
+    crawl_metrics = metrics.get_metrics()
+    timeouts = retry.CrawlTimeouts(adaptive=adaptive_timeouts)
+    retry_queue = retry.RetryQueue(max_retries=retries)
+    active = 0
+
+    async def flush():
+        nonlocal pending, results
+        if len(pending) == 0:
+            return
+        results, pending = pending, []
+        logging.debug(f"Flushing {len(results)} results")
+        await results_function(results, **kwargs)
+
+    async def worker(browser):
+        nonlocal active
+        while True:
+            # all workers share the same (sync or async) iterator, then the
+            # retries once it's exhausted
+            url = await next_url()
+            if url is None:
+                url = await retry_queue.get(lambda: active > 0)
+                if url is None:
+                    return
+
+            active += 1
+            start_time = time.monotonic()
+            crawl_metrics.crawl_started()
+            result = await crawl_url(
+                url=url,
+                browser=browser,
+                tracking_domains_list=tracking_domains_list,
+                screenshot=screenshot,
+                registry=registry,
+                wait_strategy=wait_strategy,
+                block_resources=block_resources,
+                keep_request_urls=keep_request_urls,
+                capture_backend=capture_backend,
+                context_pool=context_pool,
+                **timeouts.get(retry=retry_queue.is_retry(url)),
+            )
+            crawl_metrics.crawl_finished()
+            stats["busy_time"] += time.monotonic() - start_time
+            timeouts.observe(result)
+            queued = retry_queue.add(url, result)
+            active -= 1
+            if queued:
+                crawl_metrics.record_retry(result)
+                continue
+
+            crawl_metrics.record_result(result)
+            stats["crawled"] += 1
+            if on_result is not None:
+                on_result(result)
+
+            pending.append(result)
+            if len(pending) >= flush_size:
+                await flush()
+                log_throughput(stats, batch_size, time.monotonic() - crawl_start)
+
     async with async_playwright() as p:
         logging.debug("Starting browser")
         browser = await p.chromium.launch(**browser_config)
+        context_pool = await start_context_pool(
+            browser, batch_size, reuse_contexts, block_resources
+        )
 
-        for urls_batch in utils.batch(urls, batch_size):
-            data = [
-                crawl_url(
-                    url=url,
-                    browser=browser,
-                    tracking_domains_list=tracking_domains_list,
-                    screenshot=screenshot,
-                )
-                for url in urls_batch
-            ]
-            results = [
-                r for r in await asyncio.gather(*data)
-            ]  # run all urls in parallel
-            logging.debug(f"Retrieved batch of {len(data)} URLs")
+        crawl_start = time.monotonic()
+        await asyncio.gather(*[worker(browser) for _ in range(batch_size)])
+        await flush()
 
-            await results_function(results, **kwargs)
+        log_throughput(
+            stats, batch_size, time.monotonic() - crawl_start, level=logging.INFO
+        )
+        if retry_queue.stats["retried"] > 0:
+            logging.info(f"Retries: {json.dumps(retry_queue.stats)}")
+        if context_pool is not None:
+            logging.info(f"Context pool: {json.dumps(context_pool.get_stats())}")
+            await context_pool.close()
 
         await browser.close()
 
-        # return the last batch for convenience
+    # return the last flushed results for convenience
     return results
 
 
+async def start_context_pool(browser, size, reuse_contexts, block_resources=None):
+    """Start a warm pool of `size` contexts if contexts are reused."""
+    if not reuse_contexts:
+        return None
+
+    context_pool = pool.ContextPool(
+        functools.partial(
+            new_browser_context, browser, block_resources=block_resources
+        ),
+        size=size,
+        max_uses=reuse_contexts,
+    )
+    await context_pool.start()
+    return context_pool
+
+
+def log_throughput(stats, slots, elapsed, level=logging.DEBUG):
+    """
+    Log the throughput (URLs/min) and slot utilisation (share of the available
+    slot time spent crawling) of a running crawl.
+    """
+    urls_per_minute = stats["crawled"] / elapsed * 60 if elapsed > 0 else 0
+    utilisation = stats["busy_time"] / (slots * elapsed) if elapsed > 0 else 0
+    logging.log(
+        level,
+        f"Crawled {stats['crawled']} URLs in {elapsed:.1f}s "
+        f"({urls_per_minute:.1f} URLs/min, slot utilisation {utilisation:.0%})",
+    )
+
+
 async def crawl_single(url, tracking_domains_list=[], browser_config=None):
     """Crawl a single URL asynchronously."""
 
@@ -390,35 +821,25 @@ async def crawl_single(url, tracking_domains_list=[], browser_config=None):
 
 
 async def store_crawl_results(
-    data, table_name="crawl_results", file=None, results_db_file="crawl_results.db"
+    data,
+    table_name="crawl_results",
+    file=None,
+    results_db_file="crawl_results.db",
+    normalise=False,
 ):
-    if file is not None:
-        Path.mkdir(Path(results_db_file).parent, exist_ok=True)
-        with open(file, "a") as f:
-            f.writelines([json.dumps(item) + "\n" for item in data])
-
-    if results_db_file is not None:
-        Path.mkdir(Path(results_db_file).parent, exist_ok=True)
-
-        conn = sqlite3.connect(results_db_file)
-        c = conn.cursor()
-        c.execute(
-            f"CREATE TABLE IF NOT EXISTS {table_name} ({','.join([f'{k} TEXT' for k in get_extract_schema().keys()])})"
-        )
-        conn.commit()
-
-        logging.info(f"Storing {len(data)} records in database")
-        c = conn.cursor()
-        for d in data:
-            logging.info(f"Storing {d['url']}")
-            d = {
-                k: json.dumps(v) if type(v) in [dict, list, tuple] else v
-                for k, v in d.items()
-            }
-            c.execute(
-                f"INSERT INTO {table_name} VALUES ({','.join(['?' for k in d.keys()])})",
-                tuple(d.values()),
-            )
-            conn.commit()
-
-        conn.close()
+    """
+    Store crawl results in a JSON lines file and/or SQLite database, off the
+    event loop. Opens a connection for every call; storage.ResultWriter keeps
+    one open for a whole crawl.
+    """
+    await asyncio.get_running_loop().run_in_executor(
+        None,
+        functools.partial(
+            storage.store_results,
+            data,
+            db_file=results_db_file,
+            table_name=table_name,
+            file=file,
+            normalise=normalise,
+        ),
+    )
@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from consentcrawl import crawl
+
+# the scalar fields of consent managers and screenshot references that are
+# exported, e.g. not the actions of a consent manager
+CONSENT_MANAGER_FIELDS = ["id", "name", "brand", "status", "error"]
+SCREENSHOT_FIELDS = ["phase", "sha256", "path", "format", "same_as"]
+
+
+def load_pyarrow():
+    """pyarrow is optional, it's only needed for Parquet export."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception(
+            "Parquet export needs pyarrow, install it with `pip install pyarrow`"
+        )
+    return pyarrow
+
+
+def get_parquet_schema(pa):
+    """
+    Arrow schema of the crawl results: domains are lists, cookies and
+    screenshots lists of structs and meta tags and timings maps. Columns
+    without a type here (e.g. json_ld) are stored as JSON strings.
+    """
+    cookie = pa.struct(
+        [("name", pa.string()), ("domain", pa.string()), ("expires_days", pa.int64())]
+    )
+    types = {
+        "extraction_datetime": pa.timestamp("us"),
+        "cookies_all": pa.list_(cookie),
+        "cookies_no_consent": pa.list_(cookie),
+        "third_party_domains_all": pa.list_(pa.string()),
+        "third_party_domains_no_consent": pa.list_(pa.string()),
+        "tracking_domains_all": pa.list_(pa.string()),
+        "tracking_domains_no_consent": pa.list_(pa.string()),
+        "consent_manager": pa.struct(
+            [(key, pa.string()) for key in CONSENT_MANAGER_FIELDS]
+        ),
+        "screenshot_files": pa.list_(
+            pa.struct([(key, pa.string()) for key in SCREENSHOT_FIELDS])
+        ),
+        "meta_tags": pa.map_(pa.string(), pa.string()),
+        "request_urls": pa.list_(pa.string()),
+        "timings": pa.map_(pa.string(), pa.int64()),
+    }
+    return pa.schema(
+        [
+            (column, types.get(column, pa.string()))
+            for column in crawl.get_extract_schema()
+        ]
+    )
+
+
+def to_record(result, schema):
+    """Convert a crawl result to a row that matches the Parquet schema."""
+    record = {}
+    for field in schema:
+        value = result.get(field.name)
+        if value is None:
+            record[field.name] = None
+        elif field.name == "extraction_datetime":
+            record[field.name] = datetime.fromisoformat(value)
+        elif field.name == "consent_manager":
+            record[field.name] = (
+                {key: none_or_str(value.get(key)) for key in CONSENT_MANAGER_FIELDS}
+                if value
+                else None
+            )
+        elif field.name == "screenshot_files":
+            record[field.name] = [
+                {key: none_or_str(item.get(key)) for key in SCREENSHOT_FIELDS}
+                for item in value
+            ]
+        elif field.name in ["meta_tags", "timings"]:
+            record[field.name] = list(value.items())
+        elif str(field.type) == "string":
+            record[field.name] = (
+                value if isinstance(value, str) else json.dumps(value, default=str)
+            )
+        else:
+            record[field.name] = list(value)
+    return record
+
+
+def none_or_str(value):
+    return None if value is None else str(value)
+
+
+class NDJSONExporter:
+    """
+    Writes every result as a line of JSON to `file` (stdout by default) as
+    soon as it's available, e.g. to pipe a crawl into jq.
+    """
+
+    def __init__(self, file=None):
+        self.file = file or sys.stdout
+        self.closed = False
+
+    def write_result(self, result):
+        if self.closed:
+            return
+        try:
+            self.file.write(json.dumps(result, default=str) + "\n")
+            self.file.flush()
+        except BrokenPipeError:
+            # e.g. `| head`, keep crawling but stop writing
+            logging.warning("Output closed, no longer writing NDJSON")
+            self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+class ParquetExporter:
+    """
+    Writes results to Parquet files in `directory` (typed columns, see
+    get_parquet_schema), in row groups of `row_group_size` results. A new
+    file is started when a file exceeds `max_file_size` bytes. Files are
+    named <prefix>-<start time>-<number>.parquet and only get that name once
+    they are complete, so readers that glob the directory never see a
+    partial file.
+
+    Row groups are encoded and written by a background thread, so the event
+    loop isn't held up. Needs pyarrow.
+    """
+
+    def __init__(
+        self,
+        directory="results",
+        prefix="crawl_results",
+        max_file_size=256 * 1024 * 1024,
+        row_group_size=1000,
+        compression="zstd",
+    ):
+        self.pa = load_pyarrow()
+        self.schema = get_parquet_schema(self.pa)
+        self.directory = directory
+        self.prefix = f"{prefix}-{time.strftime('%Y%m%dT%H%M%S')}"
+        self.max_file_size = max_file_size
+        self.row_group_size = row_group_size
+        self.compression = compression
+        os.makedirs(directory, exist_ok=True)
+
+        self.buffer = []
+        self.writer = None
+        self.path = None
+        self.file_number = 0
+        self.files = []
+        self.stats = {"rows": 0, "row_groups": 0, "errors": 0}
+        # a single thread keeps the row groups in order
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="consentcrawl-parquet"
+        )
+
+    def write_result(self, result):
+        self.buffer.append(result)
+        if len(self.buffer) >= self.row_group_size:
+            rows, self.buffer = self.buffer, []
+            self.executor.submit(self.write_row_group, rows)
+
+    def write_row_group(self, rows):
+        try:
+            table = self.pa.Table.from_pylist(
+                [to_record(row, self.schema) for row in rows], schema=self.schema
+            )
+            if self.writer is None:
+                self.path = os.path.join(
+                    self.directory, f"{self.prefix}-{self.file_number:05d}.parquet"
+                )
+                self.writer = self.pa.parquet.ParquetWriter(
+                    f"{self.path}.tmp", self.schema, compression=self.compression
+                )
+            self.writer.write_table(table)
+            self.stats["rows"] += len(rows)
+            self.stats["row_groups"] += 1
+
+            if os.path.getsize(f"{self.path}.tmp") >= self.max_file_size:
+                self.finish_file()
+
+        except Exception as e:
+            self.stats["errors"] += 1
+            logging.error(f"Unable to write {len(rows)} results to Parquet: {e}")
+
+    def finish_file(self):
+        self.writer.close()
+        os.replace(f"{self.path}.tmp", self.path)
+        logging.debug(f"Wrote {self.path}")
+        self.files.append(self.path)
+        self.writer = None
+        self.file_number += 1
+
+    def close(self):
+        """Write the remaining results and finish the current file."""
+        if len(self.buffer) > 0:
+            rows, self.buffer = self.buffer, []
+            self.executor.submit(self.write_row_group, rows)
+        self.executor.shutdown(wait=True)
+        if self.writer is not None:
+            self.finish_file()
+        logging.info(
+            f"Exported {self.stats['rows']} results to {len(self.files)} Parquet "
+            f"files in {self.directory} ({self.stats['errors']} row groups failed)"
+        )
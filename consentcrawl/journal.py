@@ -0,0 +1,273 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from consentcrawl import storage, utils
+
+
+class CrawlJournal:
+    """
+    Keeps track of the state of every URL (pending, in_flight, done or error)
+    of a crawl run in the `crawl_state` table of the results database, keyed
+    by the crawl id (the base64 encoded domain name) of the URL.
+
+    `filter` passes on the URLs that still need to be crawled and marks them
+    in flight as they are taken. URLs are marked done (or error) in the same
+    transaction in which their results are stored, by using `on_flush` as the
+    ResultWriter's on_flush hook. So after a crash, a run started with
+    `resume` skips exactly the sites whose results were stored, and with
+    `max_age` (seconds) URLs with a successful result that is fresher than
+    that are skipped as well. Without either, every URL is passed on, also
+    URLs of a site that's already in the journal.
+    """
+
+    def __init__(self, db_file="crawl_results.db", resume=False, max_age=None):
+        self.db_file = db_file
+        self.resume = resume
+        self.max_age = max_age
+        self.started_at = time.time()
+        self.conn = storage.connect(db_file)
+        self.lock = threading.Lock()
+        self.in_flight = []
+        self.stats = {"skipped_done": 0, "skipped_fresh": 0, "queued": 0}
+        self.create_tables()
+        self.run_id = self.get_run(resume)
+
+    def create_tables(self):
+        with self.conn:
+            self.conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS crawl_runs (
+                    run_id INTEGER PRIMARY KEY,
+                    started_at REAL,
+                    finished_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS crawl_state (
+                    id TEXT PRIMARY KEY,
+                    url TEXT,
+                    state TEXT,
+                    run_id INTEGER,
+                    attempts INTEGER DEFAULT 0,
+                    updated_at REAL,
+                    last_success_at REAL
+                );
+                CREATE INDEX IF NOT EXISTS crawl_state_run_id ON crawl_state (run_id, state);
+                """
+            )
+
+        if self.conn.execute("SELECT COUNT(*) FROM crawl_state").fetchone()[0] == 0:
+            self.import_results()
+
+    def import_results(self):
+        """
+        Fill the journal with the last successful crawl of every site in the
+        results table, so `max_age` also applies to crawls from before the
+        journal existed.
+        """
+        tables = [
+            row[0]
+            for row in self.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'crawl_results'"
+            )
+        ]
+        if len(tables) == 0:
+            return
+
+        rows = []
+        for crawl_id, url, extraction_datetime in self.conn.execute(
+            """
+            SELECT id, MAX(url), MAX(extraction_datetime)
+            FROM crawl_results
+            WHERE status = 'success' AND id IS NOT NULL
+            GROUP BY id
+            """
+        ):
+            try:
+                timestamp = datetime.fromisoformat(extraction_datetime).timestamp()
+            except (TypeError, ValueError):
+                continue
+            rows.append((crawl_id, url, "done", timestamp, timestamp))
+
+        with self.conn:
+            self.conn.executemany(
+                """
+                INSERT OR IGNORE INTO crawl_state (id, url, state, updated_at, last_success_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+        logging.debug(f"Imported {len(rows)} crawls into the journal")
+
+    def get_run(self, resume=False):
+        """Continue the last run with `resume`, otherwise start a new one."""
+        if resume:
+            row = self.conn.execute(
+                "SELECT run_id, finished_at FROM crawl_runs ORDER BY run_id DESC LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                run_id, finished_at = row
+                done = self.conn.execute(
+                    "SELECT COUNT(*) FROM crawl_state WHERE run_id = ? AND state IN ('done', 'error')",
+                    (run_id,),
+                ).fetchone()[0]
+                logging.info(
+                    f"Resuming crawl run {run_id} ({done} URLs done"
+                    f"{', already finished' if finished_at else ''})"
+                )
+                return run_id
+            logging.info("No crawl run to resume, starting a new run")
+
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO crawl_runs (started_at) VALUES (?)", (time.time(),)
+            )
+        return cursor.lastrowid
+
+    def filter(self, urls, chunk_size=1000):
+        """
+        Yield the URLs that need to be crawled: skip URLs of sites that were
+        done in this run before it was resumed, or that have a successful
+        result younger than `max_age`. The others are registered as pending
+        and marked in flight as they are taken from the generator.
+        """
+        chunk = []
+        for url in urls:
+            chunk.append(url)
+            if len(chunk) >= chunk_size:
+                yield from self.filter_chunk(chunk)
+                chunk = []
+        if len(chunk) > 0:
+            yield from self.filter_chunk(chunk)
+
+    def filter_chunk(self, urls):
+        items = []
+        for url in urls:
+            try:
+                items.append((utils.get_crawl_id(url), url))
+            except Exception:
+                # let the crawler report invalid URLs
+                yield url
+
+        # URLs of the same site share their state, but are all crawled
+        ids = list({crawl_id for crawl_id, _ in items})
+        known = {}
+        placeholders = ",".join(["?"] * len(ids))
+        for crawl_id, state, run_id, updated_at, last_success_at in self.conn.execute(
+            f"SELECT id, state, run_id, updated_at, last_success_at FROM crawl_state WHERE id IN ({placeholders})",
+            ids,
+        ):
+            known[crawl_id] = (state, run_id, updated_at, last_success_at)
+
+        now = time.time()
+        queued = []
+        for crawl_id, url in items:
+            state, run_id, updated_at, last_success_at = known.get(
+                crawl_id, (None, None, None, None)
+            )
+            if (
+                self.resume
+                and run_id == self.run_id
+                and state in ["done", "error"]
+                and updated_at is not None
+                and updated_at < self.started_at
+            ):
+                self.stats["skipped_done"] += 1
+                continue
+            if (
+                self.max_age is not None
+                and last_success_at is not None
+                and now - last_success_at < self.max_age
+            ):
+                self.stats["skipped_fresh"] += 1
+                continue
+            queued.append((crawl_id, url))
+
+        with self.conn:
+            self.conn.executemany(
+                """
+                INSERT INTO crawl_state (id, url, state, run_id, updated_at)
+                VALUES (?, ?, 'pending', ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    url = excluded.url,
+                    state = excluded.state,
+                    run_id = excluded.run_id,
+                    updated_at = excluded.updated_at
+                """,
+                [(crawl_id, url, self.run_id, now) for crawl_id, url in queued],
+            )
+
+        for crawl_id, url in queued:
+            self.stats["queued"] += 1
+            with self.lock:
+                self.in_flight.append((time.time(), crawl_id))
+            yield url
+
+    def on_flush(self, conn, rows):
+        """
+        ResultWriter hook: mark the URLs of stored results done (or error) in
+        the same transaction, along with the URLs that went in flight since
+        the last flush.
+        """
+        with self.lock:
+            in_flight, self.in_flight = self.in_flight, []
+        conn.executemany(
+            """
+            UPDATE crawl_state SET state = 'in_flight', attempts = attempts + 1, updated_at = ?
+            WHERE id = ? AND state = 'pending'
+            """,
+            in_flight,
+        )
+
+        now = time.time()
+        updates = []
+        for row in rows:
+            crawl_id = row.get("id")
+            if crawl_id is None:
+                try:
+                    crawl_id = utils.get_crawl_id(row["url"])
+                except Exception:
+                    continue
+            success = row.get("status") == "success"
+            updates.append(
+                (
+                    "done" if success else "error",
+                    now,
+                    now if success else None,
+                    crawl_id,
+                )
+            )
+        conn.executemany(
+            """
+            UPDATE crawl_state SET
+                state = ?,
+                updated_at = ?,
+                last_success_at = COALESCE(?, last_success_at)
+            WHERE id = ?
+            """,
+            updates,
+        )
+
+    def finish(self):
+        """Mark the run as finished."""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE crawl_runs SET finished_at = ? WHERE run_id = ?",
+                (time.time(), self.run_id),
+            )
+        logging.info(
+            f"Crawl run {self.run_id}: {self.stats['queued']} URLs crawled, "
+            f"{self.stats['skipped_done']} skipped (already done), "
+            f"{self.stats['skipped_fresh']} skipped (fresh result)"
+        )
+
+    def get_states(self):
+        """Number of URLs per state in this run."""
+        return dict(
+            self.conn.execute(
+                "SELECT state, COUNT(*) FROM crawl_state WHERE run_id = ? GROUP BY state",
+                (self.run_id,),
+            ).fetchall()
+        )
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,310 @@
+import cProfile
+import contextlib
+import io
+import json
+import logging
+import pstats
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# histogram buckets in seconds
+BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+ERROR_PATTERN = re.compile(r"net::ERR_[A-Z0-9_]+|Timeout|Target (?:page|closed)")
+
+
+class PhaseTimer:
+    """
+    Records how long each phase of a crawl takes (in ms). Phases are marked
+    when they end, so each phase runs from the previous mark; a phase that's
+    marked more than once (e.g. screenshots) adds up.
+    """
+
+    def __init__(self):
+        self.start_time = time.monotonic()
+        self.last_time = self.start_time
+        self.timings = {}
+
+    def mark(self, phase):
+        now = time.monotonic()
+        self.timings[phase] = self.timings.get(phase, 0) + round(
+            (now - self.last_time) * 1000
+        )
+        self.last_time = now
+
+    def finish(self):
+        self.timings["total"] = round((time.monotonic() - self.start_time) * 1000)
+        return self.timings
+
+
+def get_error_class(status_msg):
+    """Short class of a crawl error, e.g. net::ERR_NAME_NOT_RESOLVED or Timeout."""
+    match = ERROR_PATTERN.search(status_msg or "")
+    return match.group(0) if match else "other"
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket that contains the q-quantile, None when it's
+        beyond the last bucket.
+        """
+        for bucket, count in zip(self.buckets, self.counts):
+            if self.count > 0 and count >= q * self.count:
+                return bucket
+        return None
+
+
+class Metrics:
+    """
+    Aggregated crawl metrics: counters per status, error class (of final
+    errors and of retried crawls) and consent manager, the number of pages
+    in flight and histograms of the duration of every crawl phase (from the
+    `timings` of the results) and of database writes. Thread safe, so the
+    result writer thread can record as well.
+
+    Exported as Prometheus text (`to_prometheus`, or over HTTP with `serve`)
+    or as a JSON summary (`to_dict`, or logged periodically with
+    `log_periodically`).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.start_time = time.monotonic()
+            self.in_flight = 0
+            self.counters = defaultdict(Counter)
+            self.histograms = defaultdict(Histogram)
+
+    def crawl_started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def crawl_finished(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def record_result(self, result):
+        """Record the status, error class, consent manager and timings of a result."""
+        with self.lock:
+            status = result.get("status") or "unknown"
+            self.counters["crawls"][status] += 1
+            if status == "error":
+                error_class = get_error_class(result.get("status_msg"))
+                self.counters["errors"][error_class] += 1
+            elif status == "success":
+                consent_manager = result.get("consent_manager") or {}
+                self.counters["consent_managers"][
+                    consent_manager.get("id", "none")
+                ] += 1
+
+            for phase, ms in (result.get("timings") or {}).items():
+                self.histograms[f"phase:{phase}"].observe(ms / 1000)
+
+    def record_retry(self, result):
+        """Record a failed crawl that is retried (and not a result yet)."""
+        with self.lock:
+            self.counters["retries"][get_error_class(result.get("status_msg"))] += 1
+
+    def record_write(self, rows, seconds):
+        with self.lock:
+            self.counters["rows_written"]["all"] += rows
+            self.histograms["db_write"].observe(seconds)
+
+    def to_dict(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.start_time
+            crawls = sum(self.counters["crawls"].values())
+            return {
+                "elapsed_seconds": round(elapsed, 1),
+                "in_flight": self.in_flight,
+                "urls_per_minute": round(crawls / elapsed * 60, 1) if elapsed else 0,
+                "crawls": dict(self.counters["crawls"]),
+                "errors": dict(self.counters["errors"]),
+                "retries": dict(self.counters["retries"]),
+                "consent_managers": dict(self.counters["consent_managers"]),
+                "rows_written": self.counters["rows_written"]["all"],
+                "durations_ms": {
+                    name.replace("phase:", ""): {
+                        "count": h.count,
+                        "mean": round(h.sum / h.count * 1000),
+                        # upper bound of the bucket
+                        "p95": h.quantile(0.95) and h.quantile(0.95) * 1000,
+                    }
+                    for name, h in self.histograms.items()
+                    if h.count > 0
+                },
+            }
+
+    def to_prometheus(self):
+        """Metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def counter(name, help_text, label, values):
+            lines.append(f"# HELP consentcrawl_{name} {help_text}")
+            lines.append(f"# TYPE consentcrawl_{name} counter")
+            for value, count in sorted(values.items()):
+                lines.append(
+                    f'consentcrawl_{name}{{{label}="{escape(value)}"}} {count}'
+                )
+
+        def histogram(name, help_text, label, histograms):
+            lines.append(f"# HELP consentcrawl_{name} {help_text}")
+            lines.append(f"# TYPE consentcrawl_{name} histogram")
+            for value, h in histograms:
+                labels = f'{label}="{escape(value)}",' if label else ""
+                for bucket, count in zip(h.buckets, h.counts):
+                    lines.append(
+                        f'consentcrawl_{name}_bucket{{{labels}le="{bucket}"}} {count}'
+                    )
+                lines.append(
+                    f'consentcrawl_{name}_bucket{{{labels}le="+Inf"}} {h.count}'
+                )
+                labels = f"{{{labels.rstrip(',')}}}" if labels else ""
+                lines.append(f"consentcrawl_{name}_sum{labels} {h.sum}")
+                lines.append(f"consentcrawl_{name}_count{labels} {h.count}")
+
+        with self.lock:
+            lines.append("# HELP consentcrawl_pages_in_flight Pages being crawled")
+            lines.append("# TYPE consentcrawl_pages_in_flight gauge")
+            lines.append(f"consentcrawl_pages_in_flight {self.in_flight}")
+            counter(
+                "crawls_total", "Crawls per status", "status", self.counters["crawls"]
+            )
+            counter(
+                "errors_total",
+                "Failed crawls per error class",
+                "error",
+                self.counters["errors"],
+            )
+            counter(
+                "retries_total",
+                "Failed crawls that were retried per error class",
+                "error",
+                self.counters["retries"],
+            )
+            counter(
+                "consent_managers_total",
+                "Successful crawls per consent manager",
+                "consent_manager",
+                self.counters["consent_managers"],
+            )
+            lines.append("# HELP consentcrawl_rows_written_total Results stored")
+            lines.append("# TYPE consentcrawl_rows_written_total counter")
+            lines.append(
+                f"consentcrawl_rows_written_total {self.counters['rows_written']['all']}"
+            )
+            histogram(
+                "phase_seconds",
+                "Duration of crawl phases",
+                "phase",
+                [
+                    (name.split(":", 1)[1], h)
+                    for name, h in sorted(self.histograms.items())
+                    if name.startswith("phase:")
+                ],
+            )
+            if "db_write" in self.histograms:
+                histogram(
+                    "db_write_seconds",
+                    "Duration of database transactions",
+                    None,
+                    [(None, self.histograms["db_write"])],
+                )
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="0.0.0.0"):
+        """Serve the Prometheus metrics on http://host:port/metrics (in a thread)."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(
+            target=server.serve_forever, name="consentcrawl-metrics", daemon=True
+        ).start()
+        logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+        return server
+
+    def log_periodically(self, interval):
+        """Log the metrics as JSON every `interval` seconds (in a thread)."""
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                logging.info(f"Metrics: {json.dumps(self.to_dict())}")
+
+        threading.Thread(
+            target=run, name="consentcrawl-metrics-log", daemon=True
+        ).start()
+        return stop
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+@contextlib.contextmanager
+def profile(file=None, limit=25):
+    """
+    Profile the code within the block with cProfile. The stats are written to
+    `file` (for e.g. snakeviz) and the top functions by cumulative time are
+    logged.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if file is not None:
+            profiler.dump_stats(file)
+            logging.info(f"Profile written to {file}")
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(
+            limit
+        )
+        logging.info(output.getvalue())
+
+
+_metrics = None
+
+
+def get_metrics():
+    """Return the metrics shared by everything in this process."""
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
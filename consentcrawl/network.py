@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import re
+import sys
+
+HOST_PATTERN = re.compile(
+    r"^https?://(?:[^@/?#]*@)?(\[[^\]]*\]|[^:/?#]+)", re.IGNORECASE
+)
+PHASES = ["no_consent", "consent"]
+CAPTURE_BACKENDS = ["page", "context", "cdp"]
+
+
+class RequestClassifier:
+    """
+    Classify the requests of a page as they are made. Every host is only
+    classified once (first or third party, tracking domain or not) and added
+    to the running sets of the current phase: "no_consent" until
+    `consent_given` is called, "consent" after. The full request URLs are only
+    kept with `keep_request_urls`.
+    """
+
+    def __init__(self, domain_name, tracking_domains_list=[], keep_request_urls=False):
+        self.domain_name = self.normalise_host(domain_name.split(":")[0])
+        self.tracking_domains_list = tracking_domains_list
+        self.phase = PHASES[0]
+        self.hosts = {}
+        self.third_party_domains = {phase: set() for phase in PHASES}
+        self.tracking_domains = {phase: set() for phase in PHASES}
+        self.requests = {phase: 0 for phase in PHASES}
+        self.third_party_requests = {phase: 0 for phase in PHASES}
+        self.request_urls = [] if keep_request_urls else None
+
+    @staticmethod
+    def normalise_host(host):
+        host = host.lower().rstrip(".")
+        return host[4:] if host.startswith("www.") else host
+
+    def add(self, url):
+        if self.request_urls is not None:
+            self.request_urls.append(url)
+
+        self.requests[self.phase] += 1
+
+        match = HOST_PATTERN.match(url)
+        if match is None:
+            # data:, blob: and other URLs without a host
+            return
+
+        host = match.group(1)
+        if host not in self.hosts:
+            self.hosts[host] = self.classify(host)
+
+        third_party_domain, tracking_domain = self.hosts[host]
+        if third_party_domain is None:
+            return
+
+        self.third_party_requests[self.phase] += 1
+        self.third_party_domains[self.phase].add(third_party_domain)
+        if tracking_domain is not None:
+            self.tracking_domains[self.phase].add(tracking_domain)
+
+    def classify(self, host):
+        """
+        Return the third party domain (None for first party requests) and the
+        tracking domain (None if not on the blocklists) of a host.
+        """
+        domain = self.normalise_host(host)
+        if domain == self.domain_name or domain.endswith("." + self.domain_name):
+            return None, None
+
+        if domain in self.tracking_domains_list:
+            labels = domain.rsplit(".", 2)
+            if len(labels) > 1 and labels[-1].isalpha():
+                return domain, ".".join(labels[-2:])
+            return domain, domain
+
+        return domain, None
+
+    def consent_given(self):
+        self.phase = PHASES[1]
+
+    def get_third_party_domains(self, phase=None):
+        """All third party domains, or only those of a phase."""
+        if phase is not None:
+            return list(self.third_party_domains[phase])
+        return list(set().union(*self.third_party_domains.values()))
+
+    def get_tracking_domains(self, phase=None):
+        """All tracking domains, or only those of a phase."""
+        if phase is not None:
+            return list(self.tracking_domains[phase])
+        return list(set().union(*self.tracking_domains.values()))
+
+    def memory_size(self):
+        """Approximate number of bytes held by the classifier."""
+        size = sys.getsizeof(self.hosts) + sum(
+            sys.getsizeof(host) for host in self.hosts
+        )
+        for domains in [self.third_party_domains, self.tracking_domains]:
+            size += sum(sys.getsizeof(s) for s in domains.values())
+        if self.request_urls is not None:
+            size += sys.getsizeof(self.request_urls) + sum(
+                sys.getsizeof(url) for url in self.request_urls
+            )
+        return size
+
+    def stats(self):
+        return {
+            "requests": sum(self.requests.values()),
+            "requests_no_consent": self.requests["no_consent"],
+            "third_party_requests": sum(self.third_party_requests.values()),
+            "hosts": len(self.hosts),
+            "memory_bytes": self.memory_size(),
+        }
+
+
+class RequestCapture:
+    """
+    Capture the request URLs of a page (or a whole browser context) and pass
+    them to a RequestClassifier as they are made. Backends:
+    - "page": Playwright's request event of the page (main frame and iframes)
+    - "context": Playwright's request event of the browser context, which also
+      covers popups and service workers
+    - "cdp": the Network domain of Chromium CDP sessions of the page and of
+      its out-of-process (cross-origin) iframes. Those iframes are attached
+      when they navigate, so their first requests can be missed. Chromium
+      only.
+
+    The "page" and "context" backends run a Python callback with a Playwright
+    Request object for every request, which is what capturing costs on pages
+    with many requests. Only "cdp" reduces that: its events are plain dicts,
+    and as it also tracks the requests in flight for the `monitor` (see
+    crawl.NetworkMonitor), Playwright doesn't report requests at all. As it
+    can miss requests, it's opt-in.
+    """
+
+    def __init__(self, classifier, backend="page", monitor=None):
+        if backend not in CAPTURE_BACKENDS:
+            raise Exception(
+                f"Unknown capture backend '{backend}', choose from: {', '.join(CAPTURE_BACKENDS)}"
+            )
+        self.classifier = classifier
+        self.backend = backend
+        self.monitor = monitor
+        self.events = 0
+        self.emitter = None
+        self.page = None
+        self.cdp_sessions = {}
+        self.attach_tasks = set()
+
+    async def start(self, browser_context, page):
+        if self.backend == "cdp":
+            self.page = page
+            await self.attach(browser_context, page)
+            page.on("framenavigated", self.on_frame_navigated)
+            return
+
+        self.emitter = page if self.backend == "page" else browser_context
+        self.emitter.on("request", self.on_request)
+        if self.monitor is not None:
+            self.monitor.listen(page)
+
+    async def attach(self, browser_context, target):
+        """Capture the requests of a page or frame with a CDP session."""
+        cdp_session = await browser_context.new_cdp_session(target)
+        self.cdp_sessions[target] = cdp_session
+
+        def on_request(event):
+            self.add(event["request"]["url"])
+            if self.monitor is not None:
+                self.monitor.start((id(cdp_session), event["requestId"]))
+
+        def on_finished(event):
+            if self.monitor is not None:
+                self.monitor.finish((id(cdp_session), event["requestId"]))
+
+        cdp_session.on("Network.requestWillBeSent", on_request)
+        cdp_session.on("Network.loadingFinished", on_finished)
+        cdp_session.on("Network.loadingFailed", on_finished)
+        await cdp_session.send("Network.enable")
+
+    def on_frame_navigated(self, frame):
+        if frame == self.page.main_frame or frame in self.cdp_sessions:
+            return
+        self.cdp_sessions[frame] = None
+        task = asyncio.ensure_future(self.attach_frame(frame))
+        self.attach_tasks.add(task)
+        task.add_done_callback(self.attach_tasks.discard)
+
+    async def attach_frame(self, frame):
+        try:
+            await self.attach(self.page.context, frame)
+        except Exception as e:
+            # frames in the page's process are covered by its session, try
+            # again when the frame navigates to another site
+            self.cdp_sessions.pop(frame, None)
+            logging.debug(f"Not attaching to frame {frame.url}: {e}")
+
+    def on_request(self, request):
+        self.add(request.url)
+
+    def add(self, url):
+        self.events += 1
+        self.classifier.add(url)
+
+    def consent_given(self):
+        self.classifier.consent_given()
+
+    async def stop(self):
+        # stop listening, the context may be reused for other pages
+        if self.emitter is not None:
+            self.emitter.remove_listener("request", self.on_request)
+            self.emitter = None
+        if self.page is not None:
+            self.page.remove_listener("framenavigated", self.on_frame_navigated)
+            self.page = None
+        for task in list(self.attach_tasks):
+            task.cancel()
+        await asyncio.gather(*self.attach_tasks, return_exceptions=True)
+        for cdp_session in self.cdp_sessions.values():
+            if cdp_session is None:
+                continue
+            try:
+                await cdp_session.detach()
+            except Exception as e:
+                # e.g. the frame is gone
+                logging.debug(f"Unable to detach CDP session: {e}")
+        self.cdp_sessions = {}
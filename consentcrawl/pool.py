@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import time
+from urllib.parse import urlparse
+
+
+class ContextPool:
+    """
+    Pool of warm browser contexts, each with a page that is ready to use.
+    `new_context` is a coroutine function that creates a context with the
+    device profile, init script and routes applied (e.g. a partial of
+    crawl.new_browser_context).
+
+    When a context is released all its pages are closed and its cookies,
+    permissions and storage (localStorage, IndexedDB, cache storage, service
+    workers, ...) are cleared. The context is only reused when the reset can be
+    verified, and at most `max_uses` times; otherwise it is closed and replaced.
+    """
+
+    def __init__(self, new_context, size=10, max_uses=20):
+        self.new_context = new_context
+        self.size = size
+        self.max_uses = max_uses
+        self.idle = asyncio.Queue()
+        self.uses = {}
+        self.created = 0
+        self.stats = {
+            "acquired": 0,
+            "hits": 0,
+            "misses": 0,
+            "recycled": 0,
+            "discarded": 0,
+            "contexts_created": 0,
+            "reset_failures": 0,
+            "setup_time": 0.0,
+            "reset_time": 0.0,
+        }
+
+    async def start(self):
+        """Warm up the pool by creating all contexts up front."""
+        await asyncio.gather(*[self.add_context() for _ in range(self.size)])
+
+    async def add_context(self):
+        self.created += 1
+        try:
+            browser_context, page = await self.setup_context()
+        except Exception:
+            self.created -= 1
+            raise
+        self.uses[browser_context] = 0
+        self.idle.put_nowait((browser_context, page))
+
+    async def setup_context(self):
+        start_time = time.monotonic()
+        browser_context = await self.new_context()
+        page = await browser_context.new_page()
+        self.stats["contexts_created"] += 1
+        self.stats["setup_time"] += time.monotonic() - start_time
+        return browser_context, page
+
+    async def acquire(self):
+        """Return a context and a fresh page."""
+        self.stats["acquired"] += 1
+        if self.idle.empty() and self.created < self.size:
+            # no warm context available, create one on demand
+            self.stats["misses"] += 1
+            await self.add_context()
+        else:
+            self.stats["hits"] += 1
+
+        browser_context, page = await self.idle.get()
+        self.uses[browser_context] += 1
+        return browser_context, page
+
+    async def release(self, browser_context, discard=False):
+        """
+        Reset a context and return it to the pool, or replace it with a new one
+        when it can't be reset, has been used `max_uses` times or `discard` is
+        set (e.g. after an error).
+        """
+        page = None
+        if not discard and self.uses[browser_context] < self.max_uses:
+            start_time = time.monotonic()
+            try:
+                if await self.reset_context(browser_context):
+                    page = await browser_context.new_page()
+                else:
+                    self.stats["reset_failures"] += 1
+            except Exception as e:
+                logging.debug(f"Unable to reset browser context: {e}")
+                self.stats["reset_failures"] += 1
+            self.stats["reset_time"] += time.monotonic() - start_time
+
+        if page is not None:
+            self.stats["recycled"] += 1
+            self.idle.put_nowait((browser_context, page))
+            return
+
+        self.stats["discarded"] += 1
+        self.uses.pop(browser_context, None)
+        self.created -= 1
+        try:
+            await browser_context.close()
+        except Exception as e:
+            logging.debug(f"Error closing browser context: {e}")
+        await self.add_context()
+
+    async def reset_context(self, browser_context):
+        """
+        Clear all state of a context and verify that it's gone. Returns False
+        if any state is left.
+        """
+        state = await browser_context.storage_state()
+        origins = {origin["origin"] for origin in state["origins"]}
+        for page in browser_context.pages:
+            for frame in page.frames:
+                origin = get_origin(frame.url)
+                if origin is not None:
+                    origins.add(origin)
+
+        if len(origins) > 0 and len(browser_context.pages) > 0:
+            # clears localStorage, sessionStorage, IndexedDB, cache storage,
+            # service workers etc. of each origin (Chromium only)
+            cdp_session = await browser_context.new_cdp_session(
+                browser_context.pages[0]
+            )
+            for origin in origins:
+                await cdp_session.send(
+                    "Storage.clearDataForOrigin",
+                    {"origin": origin, "storageTypes": "all"},
+                )
+            await cdp_session.detach()
+
+        for page in browser_context.pages:
+            await page.close()
+
+        await browser_context.clear_cookies()
+        await browser_context.clear_permissions()
+
+        state = await browser_context.storage_state()
+        if len(state["cookies"]) > 0 or len(state["origins"]) > 0:
+            logging.debug(
+                f"Browser context still has {len(state['cookies'])} cookies and "
+                f"storage for {len(state['origins'])} origins after reset"
+            )
+            return False
+
+        return len(browser_context.pages) == 0
+
+    def get_stats(self):
+        """
+        Pool statistics, including an estimate of the setup time saved by
+        reusing contexts.
+        """
+        average_setup_time = self.stats["setup_time"] / max(
+            self.stats["contexts_created"], 1
+        )
+        return {
+            **self.stats,
+            "size": self.size,
+            "idle": self.idle.qsize(),
+            "setup_time_saved": max(
+                self.stats["recycled"] * average_setup_time - self.stats["reset_time"],
+                0,
+            ),
+        }
+
+    async def close(self):
+        while not self.idle.empty():
+            browser_context, _ = self.idle.get_nowait()
+            await browser_context.close()
+        self.uses = {}
+        self.created = 0
+
+
+def get_origin(url):
+    parsed = urlparse(url)
+    if parsed.scheme not in ["http", "https"] or not parsed.netloc:
+        return None
+    return f"{parsed.scheme}://{parsed.netloc}"
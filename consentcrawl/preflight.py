@@ -0,0 +1,291 @@
+import asyncio
+import logging
+import re
+import socket
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlparse
+from consentcrawl import crawl, metrics, utils
+
+# domain parking and domain sale services that parked domains redirect to
+PARKING_HOSTS = [
+    "sedoparking.com",
+    "sedo.com",
+    "parkingcrew.net",
+    "bodis.com",
+    "above.com",
+    "dan.com",
+    "afternic.com",
+    "hugedomains.com",
+    "buydomains.com",
+    "undeveloped.com",
+    "parklogic.com",
+    "domainmarket.com",
+]
+
+PARKED_PATTERN = re.compile(
+    r"(this domain (name )?(is|may be) for sale|buy this domain|domain is parked"
+    r"|parked free|sedoparking|parkingcrew|window\.park\b)",
+    re.IGNORECASE,
+)
+
+# parking pages are small, the markers are near the top
+MAX_BODY_SIZE = 32 * 1024
+
+
+def is_parking_host(host):
+    host = (host or "").lower()
+    return any(host == h or host.endswith(f".{h}") for h in PARKING_HOSTS)
+
+
+def is_dead_site(error):
+    """
+    Whether a request error means there's no site to crawl: the host doesn't
+    resolve or refuses connections. Other errors (certificate problems,
+    timeouts, resets) may not affect the browser.
+    """
+    if isinstance(error, (requests.exceptions.SSLError, requests.exceptions.Timeout)):
+        return False
+
+    # requests wraps the socket error in one or more urllib3 errors
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (ConnectionRefusedError, socket.gaierror)):
+            return True
+        error = (
+            getattr(error, "reason", None)
+            or error.__cause__
+            or error.__context__
+            or next((a for a in error.args if isinstance(a, BaseException)), None)
+        )
+    return False
+
+
+def canonicalise_url(url):
+    """
+    Canonical form of a URL: lowercase scheme and host, without the default
+    port, the fragment and an empty path.
+    """
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    netloc = (parsed.hostname or "").lower()
+    if parsed.port is not None and (scheme, parsed.port) not in [
+        ("http", 80),
+        ("https", 443),
+    ]:
+        netloc = f"{netloc}:{parsed.port}"
+    path = parsed.path or "/"
+    query = f"?{parsed.query}" if parsed.query else ""
+    return f"{scheme}://{netloc}{path}{query}"
+
+
+class Preflight:
+    """
+    Cheap reachability checks that run ahead of the browser, so dead and
+    parked domains don't take up a browser slot. For every URL the host is
+    resolved and the URL is requested (following redirects) over a pooled
+    session, `concurrency` URLs at a time.
+
+    URLs that don't resolve or refuse connections, parked domains and URLs
+    that redirect to a site that was already seen are recorded as results
+    (with status "unreachable", "parked" or "duplicate") instead of being
+    crawled. URLs whose request fails otherwise (e.g. a certificate error or
+    a timeout, also of the DNS lookup) are logged and passed on unchecked,
+    the browser may still be able to load them. Live URLs are passed on,
+    canonicalised to the final URL when that's on the same site, so the
+    browser doesn't need to follow the same redirects again. URLs that
+    redirect to another site are passed on as is, so their results keep the
+    crawl id of the input URL.
+
+    With `check_content` the first bytes of the page are fetched (GET) to
+    detect parking pages, otherwise a HEAD request is used when the server
+    supports it and only redirects to parking services are detected.
+    """
+
+    def __init__(
+        self,
+        concurrency=100,
+        timeout=10,
+        dns_timeout=5,
+        check_content=True,
+        capacity=10_000_000,
+    ):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.dns_timeout = dns_timeout
+        self.check_content = check_content
+        self.seen = utils.BloomFilter(capacity)
+        self.executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="consentcrawl-preflight"
+        )
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=concurrency, pool_maxsize=concurrency
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = crawl.DEFAULT_UA_STRINGS[0]
+        self.stats = {
+            "checked": 0,
+            "live": 0,
+            "unreachable": 0,
+            "parked": 0,
+            "duplicate": 0,
+            "canonicalised": 0,
+            "unchecked": 0,
+        }
+
+    async def filter(self, urls, results_function, **kwargs):
+        """
+        Check a (sync or async) iterable of URLs and yield the live, unique
+        URLs as their checks complete. Results for the other URLs are passed
+        to the (async) `results_function`, like crawl results.
+        """
+        next_url = utils.shared_iterator(urls)
+        pending = set()
+        checks = {}
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < self.concurrency:
+                url = await next_url()
+                if url is None:
+                    exhausted = True
+                    break
+                task = asyncio.ensure_future(self.check(url))
+                checks[task] = url
+                pending.add(task)
+
+            if len(pending) == 0:
+                break
+
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                url = checks.pop(task)
+                try:
+                    url, result = task.result()
+                except Exception as e:
+                    # let the crawler report URLs that can't be checked
+                    logging.debug(f"Preflight check of {url} failed: {e}")
+                    result = None
+                if result is None:
+                    yield url
+                else:
+                    metrics.get_metrics().record_result(result)
+                    await results_function([result], **kwargs)
+
+        logging.info(f"Preflight: {self.stats}")
+
+    async def check(self, url):
+        """
+        Check a single URL. Returns the URL to crawl and None, or the URL and
+        the result to record instead of crawling it.
+        """
+        self.stats["checked"] += 1
+        if not url.startswith("http"):
+            # the same URL the browser would load
+            url = "http://" + url
+
+        status, message, final_url = await self.check_url(url)
+        if status == "live":
+            site = utils.get_domain_name(canonicalise_url(final_url))
+            if not self.seen.add(site):
+                status = "duplicate"
+                message = (
+                    f"{url} redirects to {final_url}, a site that's already queued"
+                )
+
+        self.stats[status] += 1
+        if status != "live":
+            logging.debug(f"Preflight: {message}")
+            return url, self.get_result(url, status, message)
+
+        canonical_url = canonicalise_url(final_url)
+        if canonical_url != url and utils.get_crawl_id(
+            canonical_url
+        ) == utils.get_crawl_id(url):
+            self.stats["canonicalised"] += 1
+            return canonical_url, None
+        return url, None
+
+    async def check_url(self, url):
+        loop = asyncio.get_running_loop()
+        host = urlparse(url).hostname
+        try:
+            await asyncio.wait_for(
+                loop.run_in_executor(self.executor, socket.getaddrinfo, host, None),
+                self.dns_timeout,
+            )
+        except (socket.gaierror, UnicodeError) as e:
+            return "unreachable", f"Unable to resolve {host}: {e}", None
+        except asyncio.TimeoutError:
+            # a slow resolver doesn't mean the site is gone
+            logging.info(
+                f"Preflight: passing on {url} unchecked: timeout resolving {host}"
+            )
+            self.stats["unchecked"] += 1
+            return "live", None, url
+
+        try:
+            final_url, body = await loop.run_in_executor(
+                self.executor, self.request, url
+            )
+        except requests.RequestException as e:
+            if is_dead_site(e):
+                return "unreachable", f"Unable to connect to {url}: {e}", None
+            logging.info(f"Preflight: passing on {url} unchecked: {e}")
+            self.stats["unchecked"] += 1
+            return "live", None, url
+
+        if is_parking_host(urlparse(final_url).hostname):
+            return "parked", f"{url} redirects to parking service {final_url}", None
+        if body is not None and PARKED_PATTERN.search(body):
+            return "parked", f"{url} looks like a parked domain", None
+
+        return "live", None, final_url
+
+    def request(self, url):
+        """
+        Request a URL, following redirects. Returns the final URL and the
+        start of the body (None for HEAD requests).
+        """
+        if not self.check_content:
+            response = self.session.head(
+                url, allow_redirects=True, timeout=self.timeout
+            )
+            response.close()
+            if response.status_code not in [405, 501]:
+                return response.url, None
+
+        with self.session.get(
+            url, allow_redirects=True, timeout=self.timeout, stream=True
+        ) as response:
+            body = b""
+            for chunk in response.iter_content(chunk_size=8192):
+                body += chunk
+                if len(body) >= MAX_BODY_SIZE:
+                    break
+            return response.url, body.decode(
+                response.encoding or "utf-8", errors="replace"
+            )
+
+    def get_result(self, url, status, message):
+        result = {k: None for k in crawl.get_extract_schema().keys()}
+        result.update(
+            {
+                "id": utils.get_crawl_id(url),
+                "url": url,
+                "domain_name": utils.get_domain_name(url),
+                "extraction_datetime": str(datetime.now()),
+                "status": status,
+                "status_msg": message,
+            }
+        )
+        return result
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
@@ -0,0 +1,243 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+from consentcrawl import storage
+
+
+def fetch(conn, query, params=()):
+    cursor = conn.execute(query, params)
+    columns = [c[0] for c in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]
+
+
+def sites_loading_domain(conn, domain, before_consent=True, table_name="crawl_results"):
+    """
+    Sites that request a domain (or one of its subdomains), by default only
+    those that do so before consent is given.
+    """
+    domain = domain.lower()
+    return fetch(
+        conn,
+        f"""
+        SELECT DISTINCT r.domain_name, d.domain, r.extraction_datetime
+        FROM {table_name}_domains d
+        JOIN {table_name} r ON r.crawl_id = d.crawl_id
+        WHERE d.base_domain = ?
+            AND d.tracking = 0
+            AND (d.domain = ? OR d.domain LIKE ?)
+            AND d.before_consent >= ?
+        ORDER BY r.domain_name
+        """,
+        (storage.get_base_domain(domain), domain, f"%.{domain}", int(before_consent)),
+    )
+
+
+def top_tracking_domains(
+    conn, before_consent=True, limit=25, table_name="crawl_results"
+):
+    """Tracking domains requested by the most sites (before consent)."""
+    return fetch(
+        conn,
+        f"""
+        SELECT domain, COUNT(DISTINCT crawl_id) AS sites
+        FROM {table_name}_domains
+        WHERE tracking = 1 AND before_consent >= ?
+        GROUP BY domain
+        ORDER BY sites DESC
+        LIMIT ?
+        """,
+        (int(before_consent), limit),
+    )
+
+
+def sites_with_cookies_before_consent(
+    conn, cookie_domain=None, limit=None, table_name="crawl_results"
+):
+    """
+    Sites that set cookies before consent is given, with the number of
+    cookies, optionally only cookies for a (cookie) domain.
+    """
+    params = []
+    where = ""
+    if cookie_domain is not None:
+        where = "AND (c.domain = ? OR c.domain = ? OR c.domain LIKE ?)"
+        cookie_domain = cookie_domain.lower().lstrip(".")
+        params = [cookie_domain, f".{cookie_domain}", f"%.{cookie_domain}"]
+    return fetch(
+        conn,
+        f"""
+        SELECT r.domain_name, COUNT(*) AS cookies
+        FROM {table_name}_cookies c
+        JOIN {table_name} r ON r.crawl_id = c.crawl_id
+        WHERE c.before_consent = 1 {where}
+        GROUP BY c.crawl_id
+        ORDER BY cookies DESC
+        LIMIT ?
+        """,
+        (*params, limit or -1),
+    )
+
+
+def consent_managers(conn, table_name="crawl_results"):
+    """Number of sites per consent manager (None when none was found)."""
+    return fetch(
+        conn,
+        f"""
+        SELECT consent_manager_id, COUNT(*) AS sites
+        FROM {table_name}_consent_managers
+        GROUP BY consent_manager_id
+        ORDER BY sites DESC
+        """,
+    )
+
+
+def sites_without_consent_manager(conn, table_name="crawl_results"):
+    """Successfully crawled sites where no consent manager was found."""
+    return fetch(
+        conn,
+        f"""
+        SELECT r.domain_name, r.extraction_datetime
+        FROM {table_name}_consent_managers m
+        JOIN {table_name} r ON r.crawl_id = m.crawl_id
+        WHERE m.consent_manager_id IS NULL
+        ORDER BY r.domain_name
+        """,
+    )
+
+
+def status(conn, table_name="crawl_results"):
+    """Number of crawls per status."""
+    return fetch(
+        conn,
+        f"""
+        SELECT status, COUNT(*) AS crawls
+        FROM {table_name}
+        GROUP BY status
+        ORDER BY crawls DESC
+        """,
+    )
+
+
+def print_rows(rows, as_json=False):
+    if as_json:
+        for row in rows:
+            sys.stdout.write(json.dumps(row) + "\n")
+        return
+
+    if len(rows) == 0:
+        logging.warning("No results")
+        return
+
+    sys.stdout.write("\t".join(rows[0].keys()) + "\n")
+    for row in rows:
+        sys.stdout.write(
+            "\t".join("" if v is None else str(v) for v in row.values()) + "\n"
+        )
+
+
+def cli(argv=None):
+    """consentcrawl query: answer common questions about crawl results."""
+    parser = argparse.ArgumentParser(
+        prog="consentcrawl query",
+        description="Query crawl results. Except for 'status', this needs the normalised tables (crawl with --normalise or run 'consentcrawl query rebuild').",
+    )
+    parser.add_argument(
+        "--db_file",
+        "-db",
+        default="crawl_results.db",
+        help="Path to crawl results database",
+    )
+    parser.add_argument(
+        "--table", default="crawl_results", help="Name of the results table"
+    )
+    parser.add_argument(
+        "--json", default=False, action="store_true", help="Output JSON lines"
+    )
+    subparsers = parser.add_subparsers(dest="question", required=True)
+
+    domain_parser = subparsers.add_parser(
+        "domain", help="Sites that load a domain (or its subdomains) before consent"
+    )
+    domain_parser.add_argument("domain")
+    domain_parser.add_argument(
+        "--all",
+        default=False,
+        action="store_true",
+        help="Also include sites that only load the domain after consent",
+    )
+
+    top_parser = subparsers.add_parser(
+        "top-tracking", help="Tracking domains loaded by the most sites before consent"
+    )
+    top_parser.add_argument("--limit", default=25, type=int)
+    top_parser.add_argument(
+        "--all",
+        default=False,
+        action="store_true",
+        help="Count tracking domains after consent as well",
+    )
+
+    cookies_parser = subparsers.add_parser(
+        "cookies", help="Sites that set cookies before consent"
+    )
+    cookies_parser.add_argument(
+        "--domain", default=None, help="Only cookies for this (cookie) domain"
+    )
+    cookies_parser.add_argument("--limit", default=None, type=int)
+
+    subparsers.add_parser(
+        "consent-managers", help="Number of sites per consent manager"
+    )
+    subparsers.add_parser(
+        "no-consent-manager", help="Sites where no consent manager was found"
+    )
+    subparsers.add_parser("status", help="Number of crawls per status")
+    subparsers.add_parser(
+        "rebuild", help="(Re)build the normalised tables from the results table"
+    )
+
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.db_file):
+        logging.error(f"Database file not found: {args.db_file}")
+        sys.exit(1)
+
+    conn = sqlite3.connect(args.db_file)
+    table_name = storage.validate_table_name(args.table)
+
+    if args.question == "rebuild":
+        logging.basicConfig(level=logging.INFO)
+        storage.rebuild_normalised_tables(conn, table_name)
+        return
+
+    questions = {
+        "domain": lambda: sites_loading_domain(
+            conn, args.domain, before_consent=not args.all, table_name=table_name
+        ),
+        "top-tracking": lambda: top_tracking_domains(
+            conn, before_consent=not args.all, limit=args.limit, table_name=table_name
+        ),
+        "cookies": lambda: sites_with_cookies_before_consent(
+            conn, cookie_domain=args.domain, limit=args.limit, table_name=table_name
+        ),
+        "consent-managers": lambda: consent_managers(conn, table_name=table_name),
+        "no-consent-manager": lambda: sites_without_consent_manager(
+            conn, table_name=table_name
+        ),
+        "status": lambda: status(conn, table_name=table_name),
+    }
+
+    try:
+        rows = questions[args.question]()
+    except sqlite3.OperationalError as e:
+        if "no such table" in str(e):
+            logging.error(
+                f"{e}: crawl with --normalise or run 'consentcrawl query rebuild' first"
+            )
+            sys.exit(1)
+        raise
+
+    print_rows(rows, as_json=args.json)
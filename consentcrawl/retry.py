@@ -0,0 +1,185 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from collections import deque
+from consentcrawl import metrics
+
+# errors that are likely to go away when the URL is crawled again later, all
+# others (e.g. net::ERR_NAME_NOT_RESOLVED or certificate errors) are permanent
+TRANSIENT_ERRORS = [
+    "Timeout",
+    "Target page",
+    "Target closed",
+    "net::ERR_CONNECTION_RESET",
+    "net::ERR_CONNECTION_CLOSED",
+    "net::ERR_CONNECTION_TIMED_OUT",
+    "net::ERR_TIMED_OUT",
+    "net::ERR_EMPTY_RESPONSE",
+    "net::ERR_NETWORK_CHANGED",
+    "net::ERR_INTERNET_DISCONNECTED",
+    "net::ERR_HTTP2_PROTOCOL_ERROR",
+    "net::ERR_SOCKET_NOT_CONNECTED",
+]
+
+
+def classify_error(status_msg):
+    """Whether a crawl error is "transient" or "permanent"."""
+    if metrics.get_error_class(status_msg) in TRANSIENT_ERRORS:
+        return "transient"
+    return "permanent"
+
+
+class AdaptiveTimeout:
+    """
+    Timeout (ms) derived from the durations observed in this run: `multiplier`
+    times the `quantile` of the last `window` durations, within `minimum` and
+    `maximum`. Until `min_samples` durations are observed it's `initial`.
+    """
+
+    def __init__(
+        self,
+        initial,
+        minimum,
+        maximum,
+        multiplier=3,
+        quantile=0.95,
+        window=500,
+        min_samples=20,
+    ):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.samples = deque(maxlen=window)
+
+    def observe(self, ms):
+        self.samples.append(ms)
+
+    def get(self):
+        if len(self.samples) < self.min_samples:
+            return self.initial
+        ordered = sorted(self.samples)
+        value = ordered[int(self.quantile * (len(ordered) - 1))] * self.multiplier
+        return int(min(max(value, self.minimum), self.maximum))
+
+
+class CrawlTimeouts:
+    """
+    Navigation (`page.goto`) and consent click timeouts for crawl_url. With
+    `adaptive` they follow the navigation and consent times of successful
+    crawls (see AdaptiveTimeout), otherwise they're fixed at the maximum.
+    Retries always get the maximum, so a site that's slower than most isn't
+    lost because of a tight timeout.
+    """
+
+    def __init__(self, adaptive=False, navigation=90000, consent=15000):
+        self.adaptive = adaptive
+        self.navigation = AdaptiveTimeout(
+            navigation, minimum=min(10000, navigation), maximum=navigation
+        )
+        self.consent = AdaptiveTimeout(
+            consent, minimum=min(3000, consent), maximum=consent
+        )
+
+    def get(self, retry=False):
+        if not self.adaptive or retry:
+            return {
+                "goto_timeout": self.navigation.maximum,
+                "consent_timeout": self.consent.maximum,
+            }
+        return {
+            "goto_timeout": self.navigation.get(),
+            "consent_timeout": self.consent.get(),
+        }
+
+    def observe(self, result):
+        if result.get("status") != "success":
+            return
+        timings = result.get("timings") or {}
+        if "navigation" in timings:
+            self.navigation.observe(timings["navigation"])
+        # only clicks that were followed by a navigation, timeouts are capped
+        consent_manager = result.get("consent_manager") or {}
+        if consent_manager and "status" not in consent_manager:
+            self.consent.observe(timings.get("consent", 0))
+
+
+class RetryQueue:
+    """
+    URLs that failed with a transient error, to be crawled again after the
+    main pass. Every URL is retried at most `max_retries` times, with an
+    exponential backoff (with jitter) of `base_delay` seconds up to
+    `max_delay` seconds.
+    """
+
+    def __init__(self, max_retries=2, base_delay=5.0, max_delay=60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.heap = []
+        self.counter = itertools.count()
+        self.attempts = {}
+        self.stats = {"retried": 0, "recovered": 0, "failed": 0}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def is_retry(self, url):
+        return url in self.attempts
+
+    def add(self, url, result):
+        """
+        Queue a URL again if its result is a transient error and it has
+        retries left. Returns True if it's queued, False if the result is
+        final.
+        """
+        retries = self.attempts.pop(url, 0)
+        if (
+            result.get("status") != "error"
+            or classify_error(result.get("status_msg")) != "transient"
+        ):
+            if retries > 0 and result.get("status") == "success":
+                self.stats["recovered"] += 1
+            return False
+
+        if retries >= self.max_retries:
+            if retries > 0:
+                self.stats["failed"] += 1
+                result[
+                    "status_msg"
+                ] = f"{result.get('status_msg')} (after {retries + 1} attempts)"
+            return False
+
+        self.attempts[url] = retries + 1
+        self.stats["retried"] += 1
+        delay = min(self.base_delay * 2**retries, self.max_delay)
+        delay *= random.uniform(0.5, 1.5)
+        heapq.heappush(self.heap, (time.monotonic() + delay, next(self.counter), url))
+        logging.debug(f"Retrying {url} in {delay:.1f}s: {result.get('status_msg')}")
+        return True
+
+    def pop_due(self):
+        """The next URL whose backoff has passed, or None."""
+        if len(self.heap) > 0 and self.heap[0][0] <= time.monotonic():
+            return heapq.heappop(self.heap)[2]
+        return None
+
+    async def get(self, active):
+        """
+        Wait for the next URL to retry. Returns None when the queue is empty
+        and `active()` is false, i.e. no crawls are running that could still
+        add URLs.
+        """
+        while True:
+            url = self.pop_due()
+            if url is not None:
+                return url
+            if len(self.heap) == 0 and not active():
+                return None
+            wait = self.heap[0][0] - time.monotonic() if self.heap else 0.1
+            await asyncio.sleep(min(max(wait, 0), 0.1))
@@ -0,0 +1,235 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+FORMATS = ["png", "jpeg", "webp"]
+EXTENSIONS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+# width and height of the difference hash (HASH_SIZE ** 2 bits) that is used
+# to find nearly identical screenshots
+HASH_SIZE = 32
+
+
+def load_pillow():
+    """Pillow is optional, it's only needed for WebP and `max_distance`."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+class ScreenshotStore:
+    """
+    Stores screenshots content-addressed by their SHA-256 hash in
+    `directory`/<first two hex digits>/<hash>.<ext>, so a screenshot that
+    was stored before (e.g. by an earlier crawl of the same site) isn't
+    written again.
+
+    Screenshots are taken as bytes and hashed, encoded and written in a thread
+    pool, so the crawl continues while they are saved. JPEG and PNG are
+    encoded by the browser, WebP needs Pillow. `quality` applies to JPEG and
+    WebP.
+
+    The screenshot after consent isn't stored when it's identical to the one
+    before consent. With `max_distance` (needs Pillow) it also isn't stored
+    when it's nearly identical: at most `max_distance` bits of their
+    1024-bit difference hashes differ.
+    """
+
+    def __init__(
+        self,
+        directory="screenshots",
+        format="png",
+        quality=80,
+        max_distance=None,
+        max_workers=2,
+    ):
+        if format not in FORMATS:
+            raise Exception(
+                f"Unknown screenshot format {format}, choose from: {', '.join(FORMATS)}"
+            )
+        self.pillow = load_pillow()
+        if format == "webp" and self.pillow is None:
+            raise Exception(
+                "WebP screenshots need Pillow, install it with `pip install Pillow`"
+            )
+        if max_distance is not None and self.pillow is None:
+            raise Exception(
+                "Finding nearly identical screenshots needs Pillow, install it with `pip install Pillow`"
+            )
+
+        self.directory = directory
+        self.format = format
+        self.quality = quality
+        self.max_distance = max_distance
+        self.max_workers = max_workers
+        self.executor = None
+        self.lock = threading.Lock()
+        self.stats = {
+            "screenshots": 0,
+            "written": 0,
+            "existing": 0,
+            "similar": 0,
+            "bytes_written": 0,
+        }
+
+    def __reduce__(self):
+        # recreate with the same settings (without the thread pool) in other
+        # processes
+        return (
+            self.__class__,
+            (
+                self.directory,
+                self.format,
+                self.quality,
+                self.max_distance,
+                self.max_workers,
+            ),
+        )
+
+    async def capture(self, page):
+        """Take a screenshot of the page, encoded by the browser if possible."""
+        if self.format == "jpeg":
+            return await page.screenshot(type="jpeg", quality=self.quality)
+        # WebP is encoded from a (lossless) PNG
+        return await page.screenshot(type="png")
+
+    def save(self, image, phase, previous=None):
+        """
+        Save a screenshot in the background. Returns a task that resolves to
+        the reference to the stored file. With `previous` (the task of an
+        earlier screenshot of the same page) the screenshot is only stored
+        when it differs from that one.
+        """
+        return asyncio.ensure_future(self.save_async(image, phase, previous))
+
+    async def save_async(self, image, phase, previous=None):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="consentcrawl-screenshots",
+            )
+        previous_reference = await previous if previous is not None else None
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.store, image, phase, previous_reference
+        )
+
+    def store(self, image, phase, previous=None):
+        """
+        Encode, deduplicate and write a screenshot. Returns its reference:
+        the phase, the SHA-256 hash and the path relative to the directory
+        (see `get_path`). When the screenshot is (nearly) identical to
+        `previous`, the reference to that screenshot is returned instead,
+        with `same_as` set to the phase of it.
+        """
+        fingerprint = self.get_fingerprint(image)
+        with self.lock:
+            self.stats["screenshots"] += 1
+
+        if previous is not None and self.is_similar(
+            fingerprint, previous["fingerprint"]
+        ):
+            with self.lock:
+                self.stats["similar"] += 1
+            return {
+                **previous,
+                "phase": phase,
+                "same_as": previous["phase"],
+            }
+
+        if self.format == "webp":
+            image = self.encode(image)
+
+        sha256 = hashlib.sha256(image).hexdigest()
+        path = f"{sha256[:2]}/{sha256}.{EXTENSIONS[self.format]}"
+        self.write(os.path.join(self.directory, path), image)
+
+        return {
+            "phase": phase,
+            "sha256": sha256,
+            "path": path,
+            "format": self.format,
+            "fingerprint": fingerprint,
+        }
+
+    def encode(self, image):
+        with self.pillow.open(io.BytesIO(image)) as img:
+            output = io.BytesIO()
+            img.save(output, format=self.format.upper(), quality=self.quality)
+        return output.getvalue()
+
+    def write(self, file, image):
+        if os.path.exists(file):
+            with self.lock:
+                self.stats["existing"] += 1
+            return
+
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        # write to a temporary file first so there are never partial files
+        # under the content hash, even with multiple processes
+        tmp_file = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(image)
+        os.replace(tmp_file, file)
+
+        with self.lock:
+            self.stats["written"] += 1
+            self.stats["bytes_written"] += len(image)
+
+    def get_fingerprint(self, image):
+        """
+        Hash of the image bytes (so only identical screenshots match), or with
+        `max_distance` the difference hash of the image.
+        """
+        if self.max_distance is None:
+            return hashlib.sha256(image).hexdigest()
+
+        with self.pillow.open(io.BytesIO(image)) as img:
+            pixels = list(img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE)).getdata())
+        bits = 0
+        for row in range(HASH_SIZE):
+            for col in range(HASH_SIZE):
+                left = pixels[row * (HASH_SIZE + 1) + col]
+                right = pixels[row * (HASH_SIZE + 1) + col + 1]
+                bits = (bits << 1) | (left > right)
+        return bits
+
+    def is_similar(self, fingerprint, other):
+        if isinstance(fingerprint, int) and isinstance(other, int):
+            return bin(fingerprint ^ other).count("1") <= self.max_distance
+        return fingerprint == other
+
+    def get_path(self, reference):
+        """Path of the file of a screenshot reference."""
+        return os.path.join(self.directory, reference["path"])
+
+    @staticmethod
+    async def get_references(tasks):
+        """Wait for screenshot tasks and return their references."""
+        references = []
+        for task in tasks:
+            reference = dict(await task)
+            reference.pop("fingerprint", None)
+            references.append(reference)
+        return references
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        logging.debug(f"Screenshots: {self.stats}")
+
+
+_store = None
+
+
+def get_store():
+    """Return the shared store with the default settings."""
+    global _store
+    if _store is None:
+        _store = ScreenshotStore()
+    return _store
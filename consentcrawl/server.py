@@ -0,0 +1,422 @@
+import argparse
+import asyncio
+import collections
+import contextlib
+import logging
+import sys
+import time
+import uuid
+from playwright.async_api import async_playwright
+from consentcrawl import blocklists, crawl, metrics, utils
+
+
+class ServiceBusy(Exception):
+    """The crawl service's queue is full, try again later."""
+
+
+class ResultCache:
+    """LRU cache of at most `max_size` results that expire after `ttl` seconds."""
+
+    def __init__(self, max_size=10000, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self.items[key]
+            return None
+        self.items.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        self.items[key] = (time.monotonic() + self.ttl, value)
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+
+class CrawlService:
+    """
+    Crawls URLs on request with one shared browser, for use behind an API
+    (see create_app). At most `max_in_flight` pages are crawled at a time;
+    up to `max_queue` URLs wait their turn, beyond that requests are refused
+    with ServiceBusy so callers can back off.
+
+    Requests for a site (see utils.get_crawl_id) that is queued or being
+    crawled wait for that crawl instead of starting another one, and
+    successful results are served from a cache for `cache_ttl` seconds.
+
+    URLs can also be submitted as a batch job (`submit_batch`) and its
+    results polled with `get_job`; the last `max_jobs` jobs are kept.
+
+    `browser_config` is passed to chromium.launch, e.g. with the `args` of
+    a local test site (see benchmarks/site_farm.py). Other keyword arguments
+    (e.g. `registry`, `wait_strategy`, `block_resources` and
+    `reuse_contexts`) are passed on to crawl.crawl_url.
+    """
+
+    def __init__(
+        self,
+        tracking_domains_list=[],
+        browser_config=None,
+        max_in_flight=5,
+        max_queue=100,
+        cache_size=10000,
+        cache_ttl=3600,
+        max_jobs=1000,
+        screenshot=False,
+        **crawl_options,
+    ):
+        self.tracking_domains_list = tracking_domains_list
+        self.browser_config = browser_config or {"headless": True, "channel": "msedge"}
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_jobs = max_jobs
+        self.reuse_contexts = crawl_options.pop("reuse_contexts", 0)
+        self.crawl_options = {"screenshot": screenshot, **crawl_options}
+        self.cache = ResultCache(max_size=cache_size, ttl=cache_ttl)
+        self.queue = None
+        self.crawls = {}
+        self.jobs = collections.OrderedDict()
+        self.workers = []
+        self.playwright = None
+        self.browser = None
+        self.context_pool = None
+        self.browser_lock = None
+        self.stats = {"requests": 0, "cache_hits": 0, "coalesced": 0, "rejected": 0}
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.browser_lock = asyncio.Lock()
+        self.playwright = await async_playwright().start()
+        await self.launch_browser()
+        self.workers = [
+            asyncio.ensure_future(self.worker()) for _ in range(self.max_in_flight)
+        ]
+        logging.info(
+            f"Crawl service started ({self.max_in_flight} pages in flight, "
+            f"queue of {self.max_queue})"
+        )
+
+    async def launch_browser(self):
+        logging.debug("Starting browser")
+        self.browser = await self.playwright.chromium.launch(**self.browser_config)
+        self.context_pool = await crawl.start_context_pool(
+            self.browser,
+            self.max_in_flight,
+            self.reuse_contexts,
+            self.crawl_options.get("block_resources"),
+        )
+
+    async def ensure_browser(self):
+        """Start a new browser when the current one crashed."""
+        async with self.browser_lock:
+            if self.browser.is_connected():
+                return
+            logging.warning("Browser disconnected, starting a new one")
+            if self.context_pool is not None:
+                await self.context_pool.close()
+            await self.launch_browser()
+
+    async def close(self):
+        for task in self.workers:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        for future in self.crawls.values():
+            future.cancel()
+        if self.context_pool is not None:
+            await self.context_pool.close()
+        if self.browser is not None:
+            await self.browser.close()
+        if self.playwright is not None:
+            await self.playwright.stop()
+
+    def submit(self, url):
+        """
+        Queue a URL and return a future of its result. Raises ServiceBusy when
+        the queue is full.
+        """
+        self.stats["requests"] += 1
+        key = utils.get_crawl_id(url)
+        future = asyncio.get_running_loop().create_future()
+
+        result = self.cache.get(key)
+        if result is not None:
+            self.stats["cache_hits"] += 1
+            future.set_result(result)
+            return future
+
+        if key in self.crawls:
+            self.stats["coalesced"] += 1
+            return self.crawls[key]
+
+        try:
+            self.queue.put_nowait((url, key, future))
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            raise ServiceBusy(
+                f"The crawl queue is full ({self.max_queue} URLs), try again later"
+            )
+        self.crawls[key] = future
+        return future
+
+    async def crawl(self, url):
+        """Crawl a URL (or wait for a crawl of the same site) and return the result."""
+        # a caller that goes away doesn't cancel a crawl others may wait for
+        return await asyncio.shield(self.submit(url))
+
+    def submit_batch(self, urls):
+        """
+        Queue a list of URLs as a job and return its id, see get_job. Raises
+        ServiceBusy (without queueing any of them) when the URLs don't fit in
+        the queue.
+        """
+        new = {
+            utils.get_crawl_id(url)
+            for url in urls
+            if self.cache.get(utils.get_crawl_id(url)) is None
+        } - set(self.crawls)
+        if self.queue.qsize() + len(new) > self.max_queue:
+            self.stats["rejected"] += 1
+            raise ServiceBusy(
+                f"Not enough room in the crawl queue for {len(new)} URLs, try again later"
+            )
+
+        job_id = uuid.uuid4().hex
+        self.jobs[job_id] = (urls, [self.submit(url) for url in urls])
+        while len(self.jobs) > self.max_jobs:
+            self.jobs.popitem(last=False)
+        return job_id
+
+    def get_job(self, job_id):
+        """Status and the results so far of a batch job, None if it's unknown."""
+        if job_id not in self.jobs:
+            return None
+        urls, futures = self.jobs[job_id]
+        results = []
+        for url, future in zip(urls, futures):
+            if not future.done():
+                continue
+            if future.cancelled() or future.exception() is not None:
+                results.append(
+                    {
+                        "url": url,
+                        "status": "error",
+                        "status_msg": f"Unable to crawl {url}",
+                    }
+                )
+            else:
+                results.append(future.result())
+        return {
+            "id": job_id,
+            "status": "done" if len(results) == len(urls) else "pending",
+            "total": len(urls),
+            "done": len(results),
+            "results": results,
+        }
+
+    def get_stats(self):
+        return {
+            **self.stats,
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "crawling": len(self.crawls) - (self.queue.qsize() if self.queue else 0),
+            "cached": len(self.cache),
+            "jobs": len(self.jobs),
+        }
+
+    async def worker(self):
+        crawl_metrics = metrics.get_metrics()
+        while True:
+            url, key, future = await self.queue.get()
+            try:
+                await self.ensure_browser()
+                crawl_metrics.crawl_started()
+                try:
+                    result = await crawl.crawl_url(
+                        url,
+                        browser=self.browser,
+                        tracking_domains_list=self.tracking_domains_list,
+                        context_pool=self.context_pool,
+                        **self.crawl_options,
+                    )
+                finally:
+                    crawl_metrics.crawl_finished()
+                crawl_metrics.record_result(result)
+                if result["status"] == "success":
+                    self.cache.set(key, result)
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                logging.error(f"Crawl service failed to crawl {url}: {e}")
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.crawls.pop(key, None)
+                self.queue.task_done()
+
+
+def create_app(**options):
+    """
+    FastAPI app around a CrawlService (created with `options`):
+
+    - POST /crawl?url=...: crawl a URL and wait for the result
+    - POST /batch with {"urls": [...]}: submit a batch job
+    - GET /batch/{id}: status and results of a batch job
+    - GET /stats: queue and cache statistics
+    - GET /metrics: Prometheus metrics, see metrics.Metrics
+
+    A full queue is answered with 503 and a Retry-After header.
+    """
+    try:
+        from fastapi import Body, FastAPI, HTTPException
+        from fastapi.responses import PlainTextResponse
+    except ImportError:
+        raise Exception(
+            "The crawl service API needs FastAPI, install it with `pip install fastapi uvicorn`"
+        )
+
+    service = CrawlService(**options)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        await service.start()
+        yield
+        await service.close()
+
+    app = FastAPI(title="consentcrawl", lifespan=lifespan)
+    app.state.service = service
+
+    def busy(e):
+        return HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": "10"}
+        )
+
+    @app.post("/crawl")
+    async def crawl_url(url: str):
+        try:
+            result = await service.crawl(url)
+        except ServiceBusy as e:
+            raise busy(e)
+
+        if result.get("status") == "error":
+            error_class = metrics.get_error_class(result.get("status_msg"))
+            result = {
+                "error": error_class
+                if error_class != "other"
+                else result.get("status_msg", "Unknown error"),
+                **result,
+            }
+        return {"results": [result]}
+
+    @app.post("/batch", status_code=202)
+    async def submit_batch(urls: list[str] = Body(..., embed=True)):
+        try:
+            job_id = service.submit_batch(urls)
+        except ServiceBusy as e:
+            raise busy(e)
+        return service.get_job(job_id)
+
+    @app.get("/batch/{job_id}")
+    async def get_batch(job_id: str):
+        job = service.get_job(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+        return job
+
+    @app.get("/stats")
+    async def get_stats():
+        return service.get_stats()
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def get_metrics():
+        return metrics.get_metrics().to_prometheus()
+
+    return app
+
+
+def cli(argv=None):
+    """consentcrawl serve: run the crawl service API with uvicorn."""
+    parser = argparse.ArgumentParser(
+        prog="consentcrawl serve",
+        description="Run an HTTP API that crawls URLs on request, see consentcrawl.server.create_app. Needs FastAPI and uvicorn.",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Default: 127.0.0.1")
+    parser.add_argument("--port", default=8080, type=int, help="Default: 8080")
+    parser.add_argument(
+        "--max_in_flight",
+        default=5,
+        type=int,
+        help="Number of pages crawled at the same time. Default: 5",
+    )
+    parser.add_argument(
+        "--max_queue",
+        default=100,
+        type=int,
+        help="Number of URLs that can wait for a crawl slot, requests beyond that get a 503. Default: 100",
+    )
+    parser.add_argument(
+        "--cache_ttl",
+        default=3600,
+        type=utils.parse_duration,
+        help="How long to serve successful results from the cache, e.g. 30m or 12h (0 disables the cache). Default: 1h",
+    )
+    parser.add_argument(
+        "--cache_size",
+        default=10000,
+        type=int,
+        help="Number of results to keep in the cache. Default: 10000",
+    )
+    parser.add_argument(
+        "--headless",
+        default=True,
+        type=utils.string_to_boolean,
+        const=False,
+        nargs="?",
+        help="Run browser in headless mode (yes/no)",
+    )
+    parser.add_argument(
+        "--db_file",
+        "-db",
+        default="crawl_results.db",
+        help="Path to the blocklist database",
+    )
+    parser.add_argument(
+        "--debug", default=False, action="store_true", help="Enable debug logging"
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    try:
+        import uvicorn
+    except ImportError:
+        logging.error(
+            "consentcrawl serve needs uvicorn, install it with `pip install fastapi uvicorn`"
+        )
+        sys.exit(1)
+
+    blockers = blocklists.Blocklists(db_file=args.db_file)
+    try:
+        app = create_app(
+            tracking_domains_list=blockers.get_domains(),
+            browser_config={"headless": args.headless, "channel": "msedge"},
+            max_in_flight=args.max_in_flight,
+            max_queue=args.max_queue,
+            cache_ttl=args.cache_ttl,
+            cache_size=args.cache_size,
+        )
+    except Exception as e:
+        logging.error(e)
+        sys.exit(1)
+
+    uvicorn.run(app, host=args.host, port=args.port)
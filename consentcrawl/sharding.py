@@ -0,0 +1,319 @@
+import asyncio
+import collections
+import logging
+import multiprocessing
+import os
+import queue
+from playwright.async_api import async_playwright
+from consentcrawl import crawl, metrics, retry, utils
+
+MAX_URL_ATTEMPTS = 3
+MAX_SHARD_RESTARTS = 5
+
+
+def run_shard(
+    shard_id,
+    generation,
+    task_queue,
+    result_queue,
+    batch_size,
+    tracking_domains_list,
+    browser_config,
+    crawl_options,
+    log_level,
+):
+    """
+    Entry point of a shard worker process: start a Playwright instance with its
+    own browser and crawl URLs from the shard's task queue until the `None`
+    sentinels are received. Messages are tagged with the `generation` of the
+    shard (the number of restarts), so the parent can ignore messages of a
+    crashed predecessor.
+    """
+    logging.basicConfig(level=log_level)
+    asyncio.run(
+        crawl_shard(
+            shard_id,
+            generation,
+            task_queue,
+            result_queue,
+            batch_size,
+            tracking_domains_list,
+            browser_config,
+            crawl_options,
+        )
+    )
+
+
+async def crawl_shard(
+    shard_id,
+    generation,
+    task_queue,
+    result_queue,
+    batch_size,
+    tracking_domains_list,
+    browser_config,
+    crawl_options,
+):
+    loop = asyncio.get_running_loop()
+    crawl_options = dict(crawl_options)
+    reuse_contexts = crawl_options.pop("reuse_contexts", 0)
+    timeouts = retry.CrawlTimeouts(
+        adaptive=crawl_options.pop("adaptive_timeouts", False)
+    )
+
+    async def worker(browser, context_pool):
+        while True:
+            task = await loop.run_in_executor(None, task_queue.get)
+            if task is None:
+                return
+            # retries are sent as (url, True)
+            url, is_retry = task if isinstance(task, tuple) else (task, False)
+
+            result_queue.put(("start", shard_id, generation, url, None))
+            result = await crawl.crawl_url(
+                url=url,
+                browser=browser,
+                tracking_domains_list=tracking_domains_list,
+                context_pool=context_pool,
+                **crawl_options,
+                **timeouts.get(retry=is_retry),
+            )
+            timeouts.observe(result)
+
+            if not browser.is_connected():
+                # don't report results from a crashed browser, exit so the
+                # parent re-queues the URLs that were in flight in this shard
+                logging.error(f"Browser in shard {shard_id} disconnected")
+                os._exit(1)
+
+            result_queue.put(("result", shard_id, generation, url, result))
+
+    async with async_playwright() as p:
+        logging.debug(f"Starting browser for shard {shard_id}")
+        browser = await p.chromium.launch(**browser_config)
+        context_pool = await crawl.start_context_pool(
+            browser, batch_size, reuse_contexts, crawl_options.get("block_resources")
+        )
+        await asyncio.gather(
+            *[worker(browser, context_pool) for _ in range(batch_size)]
+        )
+        if context_pool is not None:
+            await context_pool.close()
+        await browser.close()
+
+
+async def crawl_sharded(
+    urls,
+    results_function,
+    shards=2,
+    batch_size=10,
+    tracking_domains_list=[],
+    browser_config=None,
+    screenshot=False,
+    flush_size=None,
+    registry=None,
+    wait_strategy="event",
+    block_resources=None,
+    keep_request_urls=False,
+    capture_backend="page",
+    reuse_contexts=0,
+    retries=2,
+    adaptive_timeouts=False,
+    on_result=None,
+    **kwargs,
+):
+    """
+    Run the crawler across multiple worker processes, each with its own
+    Playwright instance and browser running `batch_size` concurrent crawls.
+    Results of all shards are collected in this process and passed to the
+    (async) results function in groups of `flush_size`.
+
+    When a shard dies only the URLs it had in flight are re-queued and the
+    shard is restarted. URLs that fail with a transient error are retried
+    (see crawl.crawl_batch) by the least busy shard once the input is
+    exhausted. `on_result` is called with every result as it arrives.
+    """
+
+    if not browser_config:
+        browser_config = {"headless": True, "channel": "msedge"}
+
+    if not flush_size:
+        flush_size = batch_size
+
+    # passed on to crawl_url in the shards
+    crawl_options = {
+        "screenshot": screenshot,
+        "registry": registry,
+        "wait_strategy": wait_strategy,
+        "block_resources": block_resources,
+        "keep_request_urls": keep_request_urls,
+        "capture_backend": capture_backend,
+        "reuse_contexts": reuse_contexts,
+        "adaptive_timeouts": adaptive_timeouts,
+    }
+
+    context = multiprocessing.get_context("spawn")
+    result_queue = context.Queue()
+    next_input_url = utils.shared_iterator(urls)
+    backlog = collections.deque()
+
+    def start_shard(shard_id, generation=0):
+        task_queue = context.Queue()
+        process = context.Process(
+            target=run_shard,
+            args=(
+                shard_id,
+                generation,
+                task_queue,
+                result_queue,
+                batch_size,
+                tracking_domains_list,
+                browser_config,
+                crawl_options,
+                logging.getLogger().level,
+            ),
+            daemon=True,
+        )
+        process.start()
+        logging.debug(f"Started shard {shard_id} (pid {process.pid})")
+        return process, task_queue
+
+    def get_message():
+        try:
+            return result_queue.get(timeout=1)
+        except queue.Empty:
+            return None
+
+    async def next_url():
+        if len(backlog) > 0:
+            return backlog.popleft()
+        return await next_input_url()
+
+    workers = {shard_id: start_shard(shard_id) for shard_id in range(shards)}
+    # URLs handed to each shard (queued or in flight) that have no result yet
+    assigned = {shard_id: set() for shard_id in workers}
+    in_flight = {shard_id: set() for shard_id in workers}
+    restarts = {shard_id: 0 for shard_id in workers}
+    attempts = collections.Counter()
+    pending = []
+    results = []
+    input_exhausted = False
+    crawl_metrics = metrics.get_metrics()
+    retry_queue = retry.RetryQueue(max_retries=retries)
+
+    async def flush():
+        nonlocal pending, results
+        if len(pending) == 0:
+            return
+        results, pending = pending, []
+        await results_function(results, **kwargs)
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            # keep every shard's queue topped up so its crawl slots stay busy,
+            # handing out URLs round-robin so re-queued URLs get spread out
+            while not input_exhausted:
+                hungry = [
+                    shard_id
+                    for shard_id in workers
+                    if len(assigned[shard_id]) < 2 * batch_size
+                ]
+                if len(hungry) == 0:
+                    break
+                for shard_id in hungry:
+                    url = await next_url()
+                    if url is None:
+                        input_exhausted = True
+                        break
+                    assigned[shard_id].add(url)
+                    workers[shard_id][1].put(url)
+
+            # retries are only handed out after the main pass
+            while input_exhausted and (url := retry_queue.pop_due()) is not None:
+                shard_id = min(workers, key=lambda s: len(assigned[s]))
+                assigned[shard_id].add(url)
+                workers[shard_id][1].put((url, True))
+
+            if input_exhausted and not any(assigned.values()) and len(retry_queue) == 0:
+                break
+
+            message = await loop.run_in_executor(None, get_message)
+            if message is not None:
+                kind, shard_id, generation, url, result = message
+                if generation != restarts[shard_id]:
+                    # sent by a shard that crashed before the message was read,
+                    # its URLs have been re-queued
+                    logging.debug(f"Ignoring message of crashed shard {shard_id}")
+                elif kind == "start":
+                    in_flight[shard_id].add(url)
+                    crawl_metrics.crawl_started()
+                elif url in assigned[shard_id]:
+                    assigned[shard_id].discard(url)
+                    if url in in_flight[shard_id]:
+                        in_flight[shard_id].discard(url)
+                        crawl_metrics.crawl_finished()
+                    if retry_queue.add(url, result):
+                        crawl_metrics.record_retry(result)
+                    else:
+                        crawl_metrics.record_result(result)
+                        if on_result is not None:
+                            on_result(result)
+                        pending.append(result)
+                        if len(pending) >= flush_size:
+                            await flush()
+
+            # checked on every message too, so a crashed shard is noticed
+            # while the others keep sending results
+            for shard_id, (process, _) in workers.items():
+                if process.is_alive():
+                    continue
+
+                logging.warning(
+                    f"Shard {shard_id} exited with code {process.exitcode}, "
+                    f"re-queueing {len(assigned[shard_id])} URLs"
+                )
+                # only the URLs that were being crawled count as a failed
+                # attempt, URLs that were still queued are simply handed out again
+                for url in in_flight[shard_id]:
+                    attempts[url] += 1
+                    crawl_metrics.crawl_finished()
+
+                for url in assigned[shard_id]:
+                    if attempts[url] < MAX_URL_ATTEMPTS:
+                        backlog.append(url)
+                        input_exhausted = False
+                    else:
+                        result = {
+                            **{k: None for k in crawl.get_extract_schema()},
+                            "url": url,
+                            "status": "error",
+                            "status_msg": f"Shard crashed {attempts[url]} times while crawling {url}",
+                        }
+                        crawl_metrics.record_result(result)
+                        if on_result is not None:
+                            on_result(result)
+                        pending.append(result)
+                assigned[shard_id] = set()
+                in_flight[shard_id] = set()
+
+                if restarts[shard_id] >= MAX_SHARD_RESTARTS:
+                    raise Exception(f"Shard {shard_id} keeps crashing, giving up")
+                restarts[shard_id] += 1
+                workers[shard_id] = start_shard(shard_id, restarts[shard_id])
+
+        await flush()
+        if retry_queue.stats["retried"] > 0:
+            logging.info(f"Retries: {retry_queue.stats}")
+
+    finally:
+        for process, task_queue in workers.values():
+            for _ in range(batch_size):
+                task_queue.put(None)
+        for process, _ in workers.values():
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+
+    # return the last flushed results for convenience
+    return results
@@ -0,0 +1,458 @@
+import asyncio
+import json
+import logging
+import queue
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from consentcrawl import crawl, metrics
+
+TABLE_NAME_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def validate_table_name(table_name):
+    """
+    Table names can't be passed as query parameters, so only allow plain
+    identifiers.
+    """
+    if not TABLE_NAME_PATTERN.match(table_name or ""):
+        raise Exception(f"Invalid table name: {table_name}")
+    return table_name
+
+
+def connect(db_file):
+    Path.mkdir(Path(db_file).parent, exist_ok=True)
+    # wait for other connections (e.g. the crawl journal) instead of failing
+    conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False)
+    # with WAL readers don't block the writer and commits need fewer fsyncs
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def create_results_table(conn, table_name="crawl_results"):
+    """
+    Create the results table, or add columns that were added to the extract
+    schema to a table created by an older version. Every crawl gets a stable
+    `crawl_id` (an INTEGER PRIMARY KEY), which the normalised tables refer to.
+    """
+    validate_table_name(table_name)
+    schema = crawl.get_extract_schema()
+    conn.execute(
+        f'CREATE TABLE IF NOT EXISTS "{table_name}" (crawl_id INTEGER PRIMARY KEY, {",".join([f"{k} TEXT" for k in schema.keys()])})'
+    )
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')]
+    if "crawl_id" not in columns:
+        add_crawl_id(conn, table_name, columns)
+    for column in schema.keys():
+        if column not in columns:
+            logging.info(f"Adding column {column} to {table_name}")
+            conn.execute(f'ALTER TABLE "{table_name}" ADD COLUMN {column} TEXT')
+    conn.commit()
+
+
+def add_crawl_id(conn, table_name, columns):
+    """
+    Migrate a results table of an older version, which used the implicit
+    rowid as crawl id. That changes on VACUUM, so copy it to an explicit
+    INTEGER PRIMARY KEY (keeping the existing child tables valid).
+    """
+    logging.info(f"Adding column crawl_id to {table_name}")
+    indexes = [
+        row[0]
+        for row in conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+            (table_name,),
+        )
+    ]
+    with conn:
+        conn.execute(
+            f'CREATE TABLE "{table_name}_migrate" (crawl_id INTEGER PRIMARY KEY, {",".join([f"{k} TEXT" for k in columns])})'
+        )
+        conn.execute(
+            f'INSERT INTO "{table_name}_migrate" (crawl_id, {",".join(columns)}) SELECT rowid, {",".join(columns)} FROM "{table_name}"'
+        )
+        conn.execute(f'DROP TABLE "{table_name}"')
+        conn.execute(f'ALTER TABLE "{table_name}_migrate" RENAME TO "{table_name}"')
+        for sql in indexes:
+            conn.execute(sql)
+
+
+def insert_results(conn, table_name, rows):
+    """
+    Insert crawl results in a single statement. Values that are lists or
+    dicts are stored as JSON. Doesn't commit. Returns the crawl ids of the
+    inserted rows, which are consecutive as long as there's a single writer
+    within the transaction.
+    """
+    columns = list(crawl.get_extract_schema().keys())
+    cursor = conn.executemany(
+        f'INSERT INTO "{table_name}" ({",".join(columns)}) VALUES ({",".join(["?"] * len(columns))})',
+        [
+            tuple(
+                json.dumps(row.get(k))
+                if type(row.get(k)) in [dict, list, tuple]
+                else row.get(k)
+                for k in columns
+            )
+            for row in rows
+        ],
+    )
+    last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+    return list(range(last_id - cursor.rowcount + 1, last_id + 1))
+
+
+def create_normalised_tables(conn, table_name="crawl_results"):
+    """
+    Create the child tables of the normalised schema. Rows are keyed by the
+    crawl_id of the crawl in the results table.
+    """
+    validate_table_name(table_name)
+    conn.executescript(
+        f"""
+        CREATE TABLE IF NOT EXISTS {table_name}_domains (
+            crawl_id INTEGER NOT NULL,
+            domain TEXT NOT NULL,
+            base_domain TEXT NOT NULL,
+            tracking INTEGER NOT NULL,
+            before_consent INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS {table_name}_domains_base_domain
+            ON {table_name}_domains (base_domain, before_consent);
+        CREATE INDEX IF NOT EXISTS {table_name}_domains_crawl_id
+            ON {table_name}_domains (crawl_id);
+
+        CREATE TABLE IF NOT EXISTS {table_name}_cookies (
+            crawl_id INTEGER NOT NULL,
+            name TEXT,
+            domain TEXT,
+            expires_days INTEGER,
+            before_consent INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS {table_name}_cookies_domain
+            ON {table_name}_cookies (domain, before_consent);
+        CREATE INDEX IF NOT EXISTS {table_name}_cookies_name
+            ON {table_name}_cookies (name);
+        CREATE INDEX IF NOT EXISTS {table_name}_cookies_crawl_id
+            ON {table_name}_cookies (crawl_id);
+
+        CREATE TABLE IF NOT EXISTS {table_name}_consent_managers (
+            crawl_id INTEGER NOT NULL,
+            consent_manager_id TEXT,
+            status TEXT
+        );
+        CREATE INDEX IF NOT EXISTS {table_name}_consent_managers_id
+            ON {table_name}_consent_managers (consent_manager_id);
+        CREATE INDEX IF NOT EXISTS {table_name}_consent_managers_crawl_id
+            ON {table_name}_consent_managers (crawl_id);
+
+        CREATE INDEX IF NOT EXISTS {table_name}_status ON {table_name} (status);
+        CREATE INDEX IF NOT EXISTS {table_name}_domain_name ON {table_name} (domain_name);
+        """
+    )
+    conn.commit()
+
+
+def get_base_domain(domain):
+    return ".".join(domain.rsplit(".", 2)[-2:])
+
+
+def parse_json(value):
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return None
+    return value
+
+
+def insert_normalised_results(conn, table_name, crawl_ids, rows):
+    """
+    Insert the domains, cookies and consent manager of crawl results (as
+    returned by crawl_url, or as stored as JSON) into the child tables.
+    Doesn't commit.
+    """
+    domains, cookies, consent_managers = [], [], []
+    for crawl_id, row in zip(crawl_ids, rows):
+        for kind, tracking in [("third_party_domains", 0), ("tracking_domains", 1)]:
+            before_consent = set(parse_json(row.get(f"{kind}_no_consent")) or [])
+            for domain in (
+                set(parse_json(row.get(f"{kind}_all")) or []) | before_consent
+            ):
+                domains.append(
+                    (
+                        crawl_id,
+                        domain,
+                        get_base_domain(domain),
+                        tracking,
+                        int(domain in before_consent),
+                    )
+                )
+
+        before_consent = {
+            (c["name"], c["domain"])
+            for c in parse_json(row.get("cookies_no_consent")) or []
+        }
+        for c in parse_json(row.get("cookies_all")) or []:
+            cookies.append(
+                (
+                    crawl_id,
+                    c["name"],
+                    c["domain"],
+                    c.get("expires_days"),
+                    int((c["name"], c["domain"]) in before_consent),
+                )
+            )
+
+        consent_manager = parse_json(row.get("consent_manager")) or {}
+        if row.get("status") == "success":
+            consent_managers.append(
+                (
+                    crawl_id,
+                    consent_manager.get("id"),
+                    consent_manager.get(
+                        "status", "clicked" if consent_manager else None
+                    ),
+                )
+            )
+
+    conn.executemany(
+        f"INSERT INTO {table_name}_domains VALUES (?, ?, ?, ?, ?)", domains
+    )
+    conn.executemany(
+        f"INSERT INTO {table_name}_cookies VALUES (?, ?, ?, ?, ?)", cookies
+    )
+    conn.executemany(
+        f"INSERT INTO {table_name}_consent_managers VALUES (?, ?, ?)", consent_managers
+    )
+
+
+def rebuild_normalised_tables(conn, table_name="crawl_results", batch_size=1000):
+    """
+    (Re)fill the child tables from the JSON columns of the results table, e.g.
+    for results that were stored without the normalised schema.
+    """
+    create_results_table(conn, table_name)
+    create_normalised_tables(conn, table_name)
+    with conn:
+        for child in ["domains", "cookies", "consent_managers"]:
+            conn.execute(f"DELETE FROM {table_name}_{child}")
+
+        columns = list(crawl.get_extract_schema().keys())
+        cursor = conn.execute(f"SELECT crawl_id, {','.join(columns)} FROM {table_name}")
+        count = 0
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if len(batch) == 0:
+                break
+            insert_normalised_results(
+                conn,
+                table_name,
+                [row[0] for row in batch],
+                [dict(zip(columns, row[1:])) for row in batch],
+            )
+            count += len(batch)
+
+    logging.info(f"Normalised {count} crawl results")
+    return count
+
+
+def store_results(
+    rows,
+    db_file="crawl_results.db",
+    table_name="crawl_results",
+    file=None,
+    normalise=False,
+):
+    """Write crawl results to a JSON lines file and/or database in one go."""
+    if file is not None:
+        with open(file, "a") as f:
+            f.writelines([json.dumps(row) + "\n" for row in rows])
+
+    if db_file is not None:
+        conn = connect(db_file)
+        create_results_table(conn, table_name)
+        if normalise:
+            create_normalised_tables(conn, table_name)
+        logging.info(f"Storing {len(rows)} records in database")
+        with conn:
+            crawl_ids = insert_results(conn, table_name, rows)
+            if normalise:
+                insert_normalised_results(conn, table_name, crawl_ids, rows)
+        conn.close()
+
+
+class ResultWriter:
+    """
+    Long-lived writer for crawl results. Results are put on a bounded queue
+    and written by a dedicated thread: each flush of up to `flush_size` rows
+    (or whatever arrived within `flush_interval` seconds) is written with a
+    single executemany in one transaction, so the event loop driving the
+    browsers never waits for the disk. When the queue is full, `write` waits
+    (without blocking the event loop) until there's room again.
+
+    With `normalise` the domains, cookies and consent manager of every result
+    are also written to indexed child tables (see create_normalised_tables).
+
+    `on_flush(conn, rows)` is called within the transaction of every flush,
+    e.g. to write related tables atomically with the results. Results can
+    also be appended to a JSON lines `file`.
+
+    A flush that fails is retried `max_retries` times (with backoff). When it
+    still fails the results are lost, so the writer fails loudly: `write`,
+    `put` and `close` raise an Exception from then on. As the transaction is
+    rolled back, related tables (e.g. the crawl journal) aren't updated
+    either.
+
+    Use as `results_function` of crawl_batch:
+
+        writer = ResultWriter("crawl_results.db")
+        await crawl_batch(urls, writer.write)
+        await writer.aclose()
+    """
+
+    def __init__(
+        self,
+        db_file="crawl_results.db",
+        table_name="crawl_results",
+        file=None,
+        max_queue_size=1000,
+        flush_size=100,
+        flush_interval=1.0,
+        on_flush=None,
+        normalise=False,
+        max_retries=3,
+        retry_delay=1.0,
+    ):
+        self.db_file = db_file
+        self.table_name = validate_table_name(table_name)
+        self.file = file
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self.normalise = normalise
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.stats = {
+            "rows": 0,
+            "flushes": 0,
+            "errors": 0,
+            "lost_rows": 0,
+            "write_time": 0.0,
+        }
+        self.error = None
+        self.closed = False
+
+        # create the table up front so configuration errors surface right away
+        conn = connect(self.db_file)
+        create_results_table(conn, self.table_name)
+        if self.normalise:
+            create_normalised_tables(conn, self.table_name)
+        conn.close()
+
+        self.thread = threading.Thread(
+            target=self.run, name="consentcrawl-result-writer", daemon=True
+        )
+        self.thread.start()
+
+    async def write(self, rows, **kwargs):
+        """Queue results to be written (async, can be used as results_function)."""
+        self.raise_error()
+        loop = asyncio.get_running_loop()
+        for row in rows:
+            try:
+                self.queue.put_nowait(row)
+            except queue.Full:
+                await loop.run_in_executor(None, self.queue.put, row)
+
+    def put(self, rows):
+        """Queue results to be written, blocking when the queue is full."""
+        self.raise_error()
+        for row in rows:
+            self.queue.put(row)
+
+    def run(self):
+        conn = connect(self.db_file)
+        done = False
+        while not done:
+            rows = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.flush_size:
+                try:
+                    row = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if row is None:
+                    done = True
+                    break
+                rows.append(row)
+
+            if len(rows) > 0:
+                self.flush(conn, rows)
+
+        conn.close()
+
+    def flush(self, conn, rows):
+        start_time = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            try:
+                with conn:
+                    crawl_ids = insert_results(conn, self.table_name, rows)
+                    if self.normalise:
+                        insert_normalised_results(
+                            conn, self.table_name, crawl_ids, rows
+                        )
+                    if self.on_flush is not None:
+                        self.on_flush(conn, rows)
+                break
+
+            except Exception as e:
+                self.stats["errors"] += 1
+                if attempt == self.max_retries:
+                    logging.error(f"Unable to store {len(rows)} records: {e}")
+                    self.stats["lost_rows"] += len(rows)
+                    self.error = e
+                    self.stats["write_time"] += time.monotonic() - start_time
+                    return
+                logging.warning(f"Unable to store {len(rows)} records, retrying: {e}")
+                time.sleep(self.retry_delay * 2**attempt)
+
+        if self.file is not None:
+            try:
+                with open(self.file, "a") as f:
+                    f.writelines([json.dumps(row) + "\n" for row in rows])
+            except Exception as e:
+                logging.error(
+                    f"Unable to write {len(rows)} records to {self.file}: {e}"
+                )
+
+        self.stats["rows"] += len(rows)
+        self.stats["flushes"] += 1
+        metrics.get_metrics().record_write(len(rows), time.monotonic() - start_time)
+        logging.debug(f"Stored {len(rows)} records in {self.db_file}")
+        self.stats["write_time"] += time.monotonic() - start_time
+
+    def raise_error(self):
+        if self.error is not None:
+            raise Exception(
+                f"Unable to store {self.stats['lost_rows']} results in {self.db_file}: {self.error}"
+            )
+
+    def close(self):
+        """Write the remaining results and stop the writer thread."""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        logging.info(
+            f"Stored {self.stats['rows']} records in {self.stats['flushes']} "
+            f"transactions ({self.stats['errors']} failed)"
+        )
+        self.raise_error()
+
+    async def aclose(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
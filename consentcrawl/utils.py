@@ -1,11 +1,214 @@
+import argparse
+import asyncio
+import base64
+import gzip
+import hashlib
+import logging
+import math
+import re
+import sys
+from itertools import islice
+from urllib.parse import urlparse
+
+DOMAIN_NAME_PATTERN = re.compile("(?:https?://)?(?:www.)?([^/]+)")
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
 def batch(iterable, n=1):
     """
-    Turn any iterable into a generator of batches of batch size n
-    from: https://stackoverflow.com/a/8290508
+    Turn any iterable (including iterators and generators) into a generator of
+    lists of batch size n
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, n))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def read_urls(source):
+    """
+    Stream URLs from a file (one per line, gzip compressed when it ends with
+    .gz), from stdin ("-") or from a comma separated string. Lines are
+    stripped and lowercased, empty lines and comments (#) are skipped.
+    """
+    if source == "-":
+        lines = sys.stdin
+    elif source.endswith(".gz"):
+        lines = gzip.open(source, "rt")
+    elif source.endswith(".txt"):
+        lines = open(source, "r")
+    else:
+        lines = source.split(",")
+
+    try:
+        for line in lines:
+            line = line.strip().lower()
+            if len(line) > 0 and not line.startswith("#"):
+                yield line
+    finally:
+        if hasattr(lines, "close") and lines is not sys.stdin:
+            lines.close()
+
+
+class BloomFilter:
+    """
+    Set membership in constant memory: `add` returns False for items that
+    were (probably) added before. With `capacity` items at most a fraction
+    `error_rate` of new items is wrongly reported as seen; beyond the capacity
+    the error rate goes up.
+
+    The first `exact_limit` items are kept in a plain set, so small inputs
+    are deduplicated exactly and without allocating the filter (about 24MB
+    for the default capacity). The filter takes over when the set is full.
+    """
+
+    def __init__(self, capacity=10_000_000, error_rate=0.0001, exact_limit=100_000):
+        self.capacity = capacity
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.exact_limit = exact_limit
+        self.items = set()
+        self.bits = None
+        self.count = 0
+
+    def positions(self, item):
+        # double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, item):
+        if self.bits is None:
+            return item in self.items
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self.positions(item))
+
+    def add(self, item):
+        if self.bits is None:
+            if item in self.items:
+                return False
+            self.items.add(item)
+            self.count += 1
+            if len(self.items) > self.exact_limit:
+                self.allocate()
+            return True
+
+        new = self.set_bits(item)
+        if new:
+            self.count += 1
+            if self.count == self.capacity + 1:
+                logging.warning(
+                    f"More than {self.capacity} unique items, deduplication will skip more items than expected"
+                )
+        return new
+
+    def set_bits(self, item):
+        new = False
+        for p in self.positions(item):
+            if not self.bits[p >> 3] & (1 << (p & 7)):
+                self.bits[p >> 3] |= 1 << (p & 7)
+                new = True
+        return new
+
+    def allocate(self):
+        """Move the items of the exact set to the filter."""
+        logging.debug(
+            f"More than {self.exact_limit} unique items, switching to a Bloom filter"
+        )
+        self.bits = bytearray((self.size + 7) // 8)
+        for item in self.items:
+            self.set_bits(item)
+        self.items = set()
+
+
+def dedupe(iterable, seen=None):
+    """
+    Yield the unique items of an iterable, using a Bloom filter by default to
+    keep memory use flat for very large inputs.
+    """
+    if seen is None:
+        seen = BloomFilter()
+    for item in iterable:
+        if seen.add(item):
+            yield item
+
+
+async def iterate_in_thread(iterable, chunk_size=100):
+    """
+    Turn a (blocking) iterable, like a file or stdin, into an async iterator
+    that reads `chunk_size` items at a time in a thread.
+    """
+    loop = asyncio.get_running_loop()
+    chunks = batch(iterable, chunk_size)
+    while True:
+        chunk = await loop.run_in_executor(None, next, chunks, None)
+        if chunk is None:
+            return
+        for item in chunk:
+            yield item
+
+
+def shared_iterator(iterable):
+    """
+    Return an async function that returns the next item of a sync or async
+    iterable, or None when it is exhausted. Safe to share between tasks.
+    """
+    if hasattr(iterable, "__aiter__"):
+        iterator = iterable.__aiter__()
+        lock = asyncio.Lock()
+
+        async def next_item():
+            async with lock:
+                return await anext(iterator, None)
+
+    else:
+        iterator = iter(iterable)
+
+        async def next_item():
+            # next() on a sync iterator can't be interrupted by other tasks
+            return next(iterator, None)
+
+    return next_item
+
+
+def get_tld(url):
+    """
+    Return the top level domain of a URL, e.g. "fr" for https://www.example.fr/
+    """
+    host = urlparse(url if "//" in url else f"//{url}").hostname or ""
+    return host.rstrip(".").rsplit(".", 1)[-1] or None
+
+
+def get_domain_name(url):
+    """
+    Return the domain name of a URL as used by the crawler (without www.)
+    """
+    return DOMAIN_NAME_PATTERN.search(url).group(1)
+
+
+def get_crawl_id(url):
+    """
+    Return the stable id of the crawl results of a URL: the base64 encoded
+    domain name.
+    """
+    return base64.urlsafe_b64encode(get_domain_name(url).encode("ascii")).decode(
+        "ascii"
+    )
+
+
+def parse_duration(v):
+    """
+    Convert a duration like "90", "30m", "12h" or "7d" to seconds. Useful for
+    argparsing.
     """
-    l = len(iterable)
-    for ndx in range(0, l, n):
-        yield iterable[ndx : min(ndx + n, l)]
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*", str(v).lower())
+    if match is None:
+        raise argparse.ArgumentTypeError(
+            f"Duration expected (e.g. 90, 30m, 12h or 7d), got: {v}"
+        )
+    return float(match.group(1)) * DURATION_UNITS.get(match.group(2) or "s")
 
 
 def string_to_boolean(v):
@@ -0,0 +1,523 @@
+import abc
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from consentcrawl import blocklists, crawl, metrics, storage, utils
+
+STATES = ["pending", "leased", "done", "error"]
+
+
+class WorkQueue(abc.ABC):
+    """
+    Interface of a work queue shared by multiple workers (e.g. on different
+    machines). Every URL (keyed by its crawl id) is leased to one worker at a
+    time for `lease_time` seconds. Workers renew the leases of the URLs they
+    hold while they crawl them; the URLs of a worker that dies become
+    available again once their leases expire, up to `max_attempts` times.
+    Results are committed together with the completion of their URLs, and
+    only by the worker that holds the lease.
+
+    SQLiteWorkQueue is the default implementation, other stores implement
+    the same methods.
+    """
+
+    @abc.abstractmethod
+    def add(self, urls):
+        """Queue URLs, re-queueing URLs that are done. Returns the number queued."""
+
+    @abc.abstractmethod
+    def lease(self, worker_id, count):
+        """Lease up to `count` URLs, returns a list of (crawl id, URL)."""
+
+    @abc.abstractmethod
+    def renew(self, worker_id, ids):
+        """Extend the leases of `ids`, returns the ids of the leases that were lost."""
+
+    @abc.abstractmethod
+    def complete(self, worker_id, results):
+        """
+        Store results and mark their URLs done (or error) atomically, only for
+        URLs still leased by this worker. Returns the results that were stored.
+        """
+
+    @abc.abstractmethod
+    def release(self, worker_id, ids):
+        """Give up the leases of `ids`, so other workers can take the URLs."""
+
+    @abc.abstractmethod
+    def get_states(self, exclude_worker=None):
+        """
+        Number of URLs per state (see STATES). With `exclude_worker` the
+        URLs leased by that worker aren't counted as leased.
+        """
+
+    def close(self):
+        pass
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """
+    WorkQueue in the `work_queue` table of the SQLite results database, for
+    workers that share the database file (e.g. on one machine or on a network
+    file system that supports SQLite's locking). Leases are taken in BEGIN
+    IMMEDIATE transactions, so two workers never lease the same URL, and
+    results are inserted into `table_name` in the same transaction that marks
+    their URLs done.
+    """
+
+    def __init__(
+        self,
+        db_file="crawl_results.db",
+        table_name="crawl_results",
+        lease_time=300,
+        max_attempts=3,
+        normalise=False,
+    ):
+        self.db_file = db_file
+        self.table_name = storage.validate_table_name(table_name)
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        self.normalise = normalise
+        self.conn = storage.connect(db_file)
+        # transactions are managed explicitly, see transaction()
+        self.conn.isolation_level = None
+        # the connection is shared with the heartbeat
+        self.lock = threading.Lock()
+        self.create_tables()
+
+    def create_tables(self):
+        with self.transaction() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS work_queue (
+                    id TEXT PRIMARY KEY,
+                    url TEXT,
+                    state TEXT,
+                    worker_id TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER DEFAULT 0,
+                    updated_at REAL
+                )"""
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS work_queue_state ON work_queue (state, lease_expires)"
+            )
+        storage.create_results_table(self.conn, self.table_name)
+        if self.normalise:
+            storage.create_normalised_tables(self.conn, self.table_name)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Write transaction that takes the database lock up front (BEGIN
+        IMMEDIATE), so concurrent workers wait for each other instead of
+        failing when they upgrade a read to a write.
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def add(self, urls):
+        count = 0
+        for chunk in utils.batch(urls, 1000):
+            rows = {}
+            for url in chunk:
+                try:
+                    rows.setdefault(utils.get_crawl_id(url), url)
+                except Exception:
+                    logging.warning(f"Skipping invalid URL: {url}")
+            now = time.time()
+            with self.transaction() as conn:
+                before = conn.total_changes
+                conn.executemany(
+                    """
+                    INSERT INTO work_queue (id, url, state, attempts, updated_at)
+                    VALUES (?, ?, 'pending', 0, ?)
+                    ON CONFLICT (id) DO UPDATE SET
+                        url = excluded.url,
+                        state = 'pending',
+                        attempts = 0,
+                        updated_at = excluded.updated_at
+                    WHERE state IN ('done', 'error')
+                    """,
+                    [(crawl_id, url, now) for crawl_id, url in rows.items()],
+                )
+                count += conn.total_changes - before
+        return count
+
+    def lease(self, worker_id, count):
+        now = time.time()
+        with self.transaction() as conn:
+            # URLs whose leases expired too often (e.g. because they crash the
+            # browser) are given up on
+            failed = conn.execute(
+                """
+                SELECT id, url, attempts FROM work_queue
+                WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?
+                """,
+                (now, self.max_attempts),
+            ).fetchall()
+            if len(failed) > 0:
+                storage.insert_results(
+                    conn,
+                    self.table_name,
+                    [
+                        {
+                            **{k: None for k in crawl.get_extract_schema()},
+                            "id": crawl_id,
+                            "url": url,
+                            "status": "error",
+                            "status_msg": f"Lease expired {attempts} times while crawling {url}",
+                        }
+                        for crawl_id, url, attempts in failed
+                    ],
+                )
+                conn.executemany(
+                    "UPDATE work_queue SET state = 'error', worker_id = NULL, lease_expires = NULL, updated_at = ? WHERE id = ?",
+                    [(now, crawl_id) for crawl_id, _, _ in failed],
+                )
+
+            items = conn.execute(
+                """
+                SELECT id, url FROM work_queue
+                WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?)
+                ORDER BY rowid
+                LIMIT ?
+                """,
+                (now, count),
+            ).fetchall()
+            conn.executemany(
+                """
+                UPDATE work_queue SET
+                    state = 'leased',
+                    worker_id = ?,
+                    lease_expires = ?,
+                    attempts = attempts + 1,
+                    updated_at = ?
+                WHERE id = ?
+                """,
+                [
+                    (worker_id, now + self.lease_time, now, crawl_id)
+                    for crawl_id, _ in items
+                ],
+            )
+        return items
+
+    def renew(self, worker_id, ids):
+        ids = list(ids)
+        now = time.time()
+        with self.transaction() as conn:
+            held = self.get_held(conn, worker_id, ids)
+            conn.executemany(
+                "UPDATE work_queue SET lease_expires = ?, updated_at = ? WHERE id = ?",
+                [(now + self.lease_time, now, crawl_id) for crawl_id in held],
+            )
+        return [crawl_id for crawl_id in ids if crawl_id not in held]
+
+    def complete(self, worker_id, results):
+        start_time = time.monotonic()
+        now = time.time()
+        with self.transaction() as conn:
+            held = self.get_held(conn, worker_id, [get_id(r) for r in results])
+            rows = [r for r in results if get_id(r) in held]
+            if len(rows) > 0:
+                crawl_ids = storage.insert_results(conn, self.table_name, rows)
+                if self.normalise:
+                    storage.insert_normalised_results(
+                        conn, self.table_name, crawl_ids, rows
+                    )
+            conn.executemany(
+                """
+                UPDATE work_queue SET
+                    state = ?,
+                    worker_id = NULL,
+                    lease_expires = NULL,
+                    updated_at = ?
+                WHERE id = ?
+                """,
+                [
+                    (
+                        "done" if r.get("status") == "success" else "error",
+                        now,
+                        get_id(r),
+                    )
+                    for r in rows
+                ],
+            )
+        metrics.get_metrics().record_write(len(rows), time.monotonic() - start_time)
+        return rows
+
+    def release(self, worker_id, ids):
+        with self.transaction() as conn:
+            conn.executemany(
+                """
+                UPDATE work_queue SET
+                    state = 'pending',
+                    worker_id = NULL,
+                    lease_expires = NULL,
+                    attempts = attempts - 1
+                WHERE id = ? AND worker_id = ? AND state = 'leased'
+                """,
+                [(crawl_id, worker_id) for crawl_id in ids],
+            )
+
+    def get_held(self, conn, worker_id, ids):
+        """The ids of `ids` that are leased by this worker."""
+        held = set()
+        for chunk in utils.batch(ids, 500):
+            placeholders = ",".join(["?"] * len(chunk))
+            held.update(
+                row[0]
+                for row in conn.execute(
+                    f"SELECT id FROM work_queue WHERE state = 'leased' AND worker_id = ? AND id IN ({placeholders})",
+                    [worker_id, *chunk],
+                )
+            )
+        return held
+
+    def get_states(self, exclude_worker=None):
+        with self.lock:
+            states = dict(
+                self.conn.execute(
+                    """
+                    SELECT state, COUNT(*) FROM work_queue
+                    WHERE state != 'leased' OR worker_id IS NOT ?
+                    GROUP BY state
+                    """,
+                    (exclude_worker,),
+                ).fetchall()
+            )
+        return {state: states.get(state, 0) for state in STATES}
+
+    def close(self):
+        self.conn.close()
+
+
+def get_id(result):
+    if result.get("id") is not None:
+        return result["id"]
+    return utils.get_crawl_id(result["url"])
+
+
+def get_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+async def run_worker(
+    work_queue,
+    worker_id=None,
+    batch_size=10,
+    heartbeat_interval=None,
+    poll_interval=5,
+    follow=False,
+    **crawl_options,
+):
+    """
+    Crawl URLs leased from a WorkQueue with crawl.crawl_batch until the queue
+    is empty (or forever with `follow`). URLs are leased as crawl slots become
+    available, their leases are renewed every `heartbeat_interval` seconds
+    (a third of the lease time by default) and results are committed to the
+    queue as they are flushed. Leases that are still held when the worker
+    stops are released.
+
+    When the queue has no URLs left for this worker but others still hold
+    leases, the worker keeps polling, in case their leases expire. Its own
+    leases don't count: URLs it's still crawling or retrying (see
+    crawl.crawl_batch) are only crawled once the input is exhausted.
+    """
+    worker_id = worker_id or get_worker_id()
+    if heartbeat_interval is None:
+        heartbeat_interval = getattr(work_queue, "lease_time", 300) / 3
+    loop = asyncio.get_running_loop()
+    held = set()
+    stats = {"leased": 0, "completed": 0, "lost": 0}
+
+    async def leased_urls():
+        while True:
+            items = await loop.run_in_executor(
+                None, work_queue.lease, worker_id, batch_size
+            )
+            if len(items) == 0:
+                states = await loop.run_in_executor(
+                    None, work_queue.get_states, worker_id
+                )
+                if not follow and states["pending"] == 0 and states["leased"] == 0:
+                    return
+                await asyncio.sleep(poll_interval)
+                continue
+
+            stats["leased"] += len(items)
+            for crawl_id, url in items:
+                held.add(crawl_id)
+                yield url
+
+    async def commit(results):
+        stored = await loop.run_in_executor(
+            None, work_queue.complete, worker_id, results
+        )
+        stats["completed"] += len(stored)
+        stats["lost"] += len(results) - len(stored)
+        if len(stored) < len(results):
+            logging.warning(
+                f"Dropped {len(results) - len(stored)} results of URLs that were leased by another worker"
+            )
+        for result in results:
+            held.discard(get_id(result))
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(heartbeat_interval)
+            if len(held) == 0:
+                continue
+            lost = await loop.run_in_executor(
+                None, work_queue.renew, worker_id, list(held)
+            )
+            if len(lost) > 0:
+                logging.warning(f"Lost the leases of {len(lost)} URLs")
+
+    logging.info(f"Worker {worker_id} started")
+    heartbeat_task = asyncio.ensure_future(heartbeat())
+    try:
+        await crawl.crawl_batch(
+            leased_urls(), commit, batch_size=batch_size, **crawl_options
+        )
+    finally:
+        heartbeat_task.cancel()
+        await asyncio.gather(heartbeat_task, return_exceptions=True)
+        if len(held) > 0:
+            logging.info(f"Releasing the leases of {len(held)} URLs")
+            await loop.run_in_executor(None, work_queue.release, worker_id, held)
+        logging.info(f"Worker {worker_id}: {json.dumps(stats)}")
+
+    return stats
+
+
+def cli(argv=None):
+    """consentcrawl worker: crawl URLs from a work queue shared by multiple workers."""
+    parser = argparse.ArgumentParser(
+        prog="consentcrawl worker",
+        description="Crawl URLs from a work queue in the results database. Start any number of workers (on machines that share the database file) after adding URLs with 'consentcrawl worker add'.",
+    )
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="run",
+        choices=["run", "add", "status"],
+        help="'run' (default) crawls until the queue is empty, 'add' queues URLs, 'status' shows the number of URLs per state",
+    )
+    parser.add_argument(
+        "url",
+        nargs="?",
+        help="For 'add': URL, comma separated URLs or file with URLs (.txt, .gz or - for stdin)",
+    )
+    parser.add_argument(
+        "--db_file",
+        "-db",
+        default="crawl_results.db",
+        help="Path to the results database with the work queue",
+    )
+    parser.add_argument("--batch_size", "-b", default=10, type=int)
+    parser.add_argument(
+        "--lease_time",
+        default=300,
+        type=utils.parse_duration,
+        help="How long a URL is leased to a worker before others can take it over, renewed while crawling, e.g. 300 or 5m. Default: 5m",
+    )
+    parser.add_argument(
+        "--max_attempts",
+        default=3,
+        type=int,
+        help="Give up on URLs whose lease expired this many times. Default: 3",
+    )
+    parser.add_argument(
+        "--follow",
+        default=False,
+        action="store_true",
+        help="Keep polling for new URLs when the queue is empty",
+    )
+    parser.add_argument(
+        "--headless",
+        default=True,
+        type=utils.string_to_boolean,
+        const=False,
+        nargs="?",
+        help="Run browser in headless mode (yes/no)",
+    )
+    parser.add_argument(
+        "--block_resources",
+        default=None,
+        const=",".join(crawl.DEFAULT_BLOCKED_RESOURCES),
+        nargs="?",
+        help="Don't download these resource types (comma separated)",
+    )
+    parser.add_argument("--reuse_contexts", default=0, const=20, nargs="?", type=int)
+    parser.add_argument("--retries", default=2, type=int)
+    parser.add_argument("--adaptive_timeouts", default=False, action="store_true")
+    parser.add_argument("--normalise", default=False, action="store_true")
+    parser.add_argument(
+        "--blocklists",
+        "-bf",
+        default=None,
+        help="For 'add': path to custom blocklists file (YAML)",
+    )
+    parser.add_argument(
+        "--debug", default=False, action="store_true", help="Enable debug logging"
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    work_queue = SQLiteWorkQueue(
+        args.db_file,
+        lease_time=args.lease_time,
+        max_attempts=args.max_attempts,
+        normalise=args.normalise,
+    )
+
+    if args.command == "add":
+        if not args.url:
+            logging.error("No URLs to add")
+            sys.exit(1)
+        # the blocklists are (re)fetched here, once, workers only read them
+        blocklists.Blocklists(db_file=args.db_file, source_file=args.blocklists)
+        count = work_queue.add(utils.dedupe(utils.read_urls(args.url)))
+        logging.info(f"Queued {count} URLs")
+
+    elif args.command == "status":
+        sys.stdout.write(json.dumps(work_queue.get_states()) + "\n")
+
+    else:
+        if args.block_resources is not None:
+            args.block_resources = [r.strip() for r in args.block_resources.split(",")]
+        try:
+            blockers = blocklists.Blocklists(db_file=args.db_file, read_only=True)
+        except Exception as e:
+            logging.error(f"{e} Queue URLs with 'consentcrawl worker add' first.")
+            sys.exit(1)
+        asyncio.run(
+            run_worker(
+                work_queue,
+                batch_size=args.batch_size,
+                follow=args.follow,
+                tracking_domains_list=blockers.get_domains(),
+                browser_config={"headless": args.headless, "channel": "msedge"},
+                block_resources=args.block_resources,
+                reuse_contexts=args.reuse_contexts,
+                retries=args.retries,
+                adaptive_timeouts=args.adaptive_timeouts,
+            )
+        )
+
+    work_queue.close()
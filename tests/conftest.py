@@ -0,0 +1,73 @@
+import hashlib
+import http.server
+import threading
+import pytest
+import fake_playwright
+from consentcrawl import crawl, retry, server
+
+
+@pytest.fixture
+def browser(monkeypatch):
+    """Fake browser used by crawl.py and server.py, see fake_playwright.py."""
+    browser = fake_playwright.Browser()
+    for module in [crawl, server]:
+        monkeypatch.setattr(
+            module, "async_playwright", lambda: fake_playwright.FakePlaywright(browser)
+        )
+    return browser
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    """Retry transient errors without the backoff of real crawls."""
+    monkeypatch.setattr(retry.RetryQueue.__init__, "__defaults__", (2, 0.05, 0.1))
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        if self.path in self.server.redirects:
+            self.send_response(301)
+            self.send_header("Location", self.server.redirects[self.path])
+            self.end_headers()
+            return
+
+        if self.path not in self.server.files:
+            self.send_error(404)
+            return
+
+        body = self.server.files[self.path].encode()
+        etag = f'"{hashlib.sha256(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    """
+    Local HTTP server for the files in `http_server.files` (path -> text), with
+    ETags, and the redirects in `http_server.redirects` (path -> location).
+    Requests are recorded as (path, headers) in `http_server.requests`.
+    """
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.files = {}
+    httpd.redirects = {}
+    httpd.requests = []
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
@@ -0,0 +1,277 @@
+"""
+Minimal stand-in for the Playwright async API, so crawls can run offline and
+without a browser. Every page loads a few tracking requests, sets a cookie and
+has a consent manager whose accept button sets a consent cookie.
+"""
+import asyncio
+import collections
+import contextlib
+
+
+class Emitter:
+    def __init__(self):
+        self.handlers = {}
+
+    def on(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+
+    def remove_listener(self, event, handler):
+        self.handlers[event].remove(handler)
+
+    def emit(self, event, *args):
+        for handler in list(self.handlers.get(event, [])):
+            handler(*args)
+
+
+class Request:
+    def __init__(self, url, resource_type="script"):
+        self.url = url
+        self.resource_type = resource_type
+
+
+class Locator:
+    def __init__(self, page, selector):
+        self.page = page
+        self.selector = selector
+        self.first = self
+
+    async def all(self):
+        return []
+
+    async def count(self):
+        return 0
+
+    async def is_visible(self):
+        return False
+
+    def locator(self, selector):
+        return Locator(self.page, selector)
+
+    def frame_locator(self, selector):
+        return self
+
+    async def click(self, delay=0):
+        self.page.context.cookies_.append(
+            {"name": "consent", "domain": ".example.com", "expires": 1e10}
+        )
+        self.page.fire("https://connect.facebook.net/after.js")
+
+
+class Mouse:
+    async def move(self, *args):
+        pass
+
+    async def wheel(self, *args):
+        pass
+
+
+class Frame:
+    def __init__(self, url, out_of_process=False):
+        self.url = url
+        self.out_of_process = out_of_process
+
+
+class Page(Emitter):
+    def __init__(self, context):
+        super().__init__()
+        self.context = context
+        self.url = "about:blank"
+        self.mouse = Mouse()
+        self.main_frame = Frame("about:blank")
+        self.frames = [self.main_frame]
+
+    def fire(self, url, resource_type="script", frame=None):
+        """
+        Make a request from the page, or from an out-of-process `frame` (only
+        seen by CDP sessions of that frame).
+        """
+        request = Request(url, resource_type)
+        self.emit("request", request)
+        self.context.emit("request", request)
+        self.context.browser.request_ids += 1
+        event = {
+            "requestId": str(self.context.browser.request_ids),
+            "request": {"url": url},
+        }
+        for session in self.context.cdp_sessions:
+            if session.target is (frame or self):
+                session.emit("Network.requestWillBeSent", event)
+                session.emit("Network.loadingFinished", event)
+        self.emit("requestfinished", request)
+
+    async def goto(self, url, wait_until=None, timeout=None):
+        browser = self.context.browser
+        browser.calls[url] += 1
+        for host, errors in browser.errors.items():
+            if host in url and len(errors) > 0:
+                raise Exception(errors.pop(0))
+        await asyncio.sleep(browser.delay)
+        self.url = url
+        self.main_frame = Frame(url)
+        iframe = Frame("https://cmp.example.net/frame", out_of_process=True)
+        self.frames = [self.main_frame, iframe]
+        self.fire(url, "document")
+        self.emit("framenavigated", iframe)
+        await asyncio.sleep(0)
+        self.fire("https://cmp.example.net/cmp.js", frame=iframe)
+        self.fire("https://www.google-analytics.com/analytics.js")
+        self.fire("https://cdn.example.com/img.png", "image")
+        self.context.cookies_.append(
+            {"name": "_ga", "domain": ".example.com", "expires": -1}
+        )
+
+    async def wait_for_timeout(self, ms):
+        await asyncio.sleep(0)
+
+    async def wait_for_function(self, script, arg=None, polling=None, timeout=None):
+        raise Exception("Timeout")
+
+    async def evaluate(self, script, arg=None):
+        return {
+            "match": {"index": 0, "frames": [], "selector": "#accept"},
+            "fallbacks": [],
+        }
+
+    def locator(self, selector):
+        return Locator(self, selector)
+
+    def frame_locator(self, selector):
+        return Locator(self, selector)
+
+    async def screenshot(self, path=None, **kwargs):
+        return b"\x89PNG"
+
+    @contextlib.asynccontextmanager
+    async def expect_navigation(self, **kwargs):
+        yield
+
+    async def close(self):
+        self.context.pages.remove(self)
+
+    async def content(self):
+        return "<html></html>"
+
+    async def title(self):
+        return "Example"
+
+
+class CDPSession(Emitter):
+    def __init__(self, context, target):
+        super().__init__()
+        self.context = context
+        self.target = target
+
+    async def send(self, method, params=None):
+        return {}
+
+    async def detach(self):
+        self.context.cdp_sessions.remove(self)
+
+
+class Context(Emitter):
+    def __init__(self, browser, **kwargs):
+        super().__init__()
+        self.browser = browser
+        self.pages = []
+        self.cookies_ = []
+        self.cdp_sessions = []
+
+    async def add_init_script(self, script):
+        pass
+
+    async def route(self, pattern, handler):
+        pass
+
+    async def new_page(self):
+        page = Page(self)
+        self.pages.append(page)
+        return page
+
+    async def cookies(self):
+        return list(self.cookies_)
+
+    async def clear_cookies(self):
+        self.cookies_ = []
+
+    async def clear_permissions(self):
+        pass
+
+    async def storage_state(self):
+        return {"cookies": list(self.cookies_), "origins": []}
+
+    async def new_cdp_session(self, target):
+        if isinstance(target, Frame) and not target.out_of_process:
+            raise Exception("This frame does not have a separate CDP session")
+        session = CDPSession(self, target)
+        self.cdp_sessions.append(session)
+        return session
+
+    async def close(self):
+        self.browser.contexts.remove(self)
+
+
+class BrowserType:
+    name = "chromium"
+
+
+class Browser:
+    """
+    Fake Chromium. Pages take `delay` seconds to load; `errors` maps hosts to
+    the errors raised by their next page loads (one per load).
+    """
+
+    def __init__(self, delay=0.01, errors=None):
+        self.delay = delay
+        self.errors = errors if errors is not None else {}
+        self.browser_type = BrowserType()
+        self.contexts = []
+        self.calls = collections.Counter()
+        self.request_ids = 0
+
+    async def new_context(self, **kwargs):
+        context = Context(self, **kwargs)
+        self.contexts.append(context)
+        return context
+
+    def is_connected(self):
+        return True
+
+    async def close(self):
+        pass
+
+
+class Chromium:
+    def __init__(self, browser):
+        self.browser = browser
+
+    async def launch(self, **kwargs):
+        return self.browser
+
+
+class FakePlaywright:
+    """
+    Replacement for `async_playwright()`, both as async context manager (as
+    in crawl.py) and with start()/stop() (as in server.py).
+    """
+
+    def __init__(self, browser):
+        self.chromium = Chromium(browser)
+
+    async def start(self):
+        return self
+
+    async def stop(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+def install(browser, *modules):
+    """Make `modules` (e.g. crawl, server) use `browser`, returns it."""
+    for module in modules:
+        module.async_playwright = lambda: FakePlaywright(browser)
+    return browser
@@ -0,0 +1,151 @@
+import sqlite3
+import pytest
+import yaml
+from consentcrawl import blocklists
+
+
+def write_sources(path, http_server, ids):
+    with open(path, "w") as f:
+        yaml.safe_dump(
+            [
+                {
+                    "id": list_id,
+                    "name": list_id,
+                    "url": f"{http_server.url}/{list_id}.txt",
+                    "type": "blocklist",
+                }
+                for list_id in ids
+            ],
+            f,
+        )
+
+
+def test_parse_line():
+    assert blocklists.parse_line("0.0.0.0 Tracker.com") == ("tracker.com", False)
+    assert blocklists.parse_line("||ads.example.com^") == ("ads.example.com", False)
+    assert blocklists.parse_line("||ads.example.com^$third-party") == (
+        "ads.example.com",
+        False,
+    )
+    assert blocklists.parse_line("@@||cdn.example.com^") == ("cdn.example.com", True)
+    assert blocklists.parse_line("||example.com^$domain=other.com") is None
+    # rules for some resource types or popups don't block the whole domain
+    assert blocklists.parse_line("||example.com^$popup") is None
+    assert blocklists.parse_line("||example.com^$script,image") is None
+    assert blocklists.parse_line("||example.com^$third-party,xhr") is None
+    assert blocklists.parse_line("||example.com^$~image,third-party") == (
+        "example.com",
+        False,
+    )
+    assert blocklists.parse_line("# comment") is None
+    assert blocklists.parse_line("0.0.0.0 localhost") is None
+
+
+def test_download_and_refresh(tmp_path, http_server):
+    http_server.files["/ads.txt"] = "||ads.example.com^\n@@||ok.ads.example.com^\n"
+    http_server.files["/hosts.txt"] = "0.0.0.0 tracker.com\n"
+    source_file = tmp_path / "blocklists.yml"
+    write_sources(source_file, http_server, ["ads", "hosts"])
+    db_file = tmp_path / "blocklists.db"
+
+    domains = blocklists.Blocklists(
+        db_file=db_file, source_file=source_file
+    ).get_domains()
+    assert domains.match("stats.ads.example.com") == {"ads"}
+    assert "ok.ads.example.com" not in domains
+    assert "www.tracker.com" in domains
+    assert "example.com" not in domains
+    assert len(http_server.requests) == 2
+
+    # unchanged lists are requested conditionally and not downloaded again
+    http_server.requests.clear()
+    http_server.files["/hosts.txt"] = "0.0.0.0 tracker.net\n"
+    domains = blocklists.Blocklists(
+        db_file=db_file, source_file=source_file, max_age_days=-1
+    ).get_domains()
+    assert all("If-None-Match" in headers for _, headers in http_server.requests)
+    assert "ads.example.com" in domains
+    assert "tracker.net" in domains and "tracker.com" not in domains
+
+
+def test_failed_download_keeps_list(tmp_path, http_server):
+    http_server.files["/ads.txt"] = "||ads.example.com^\n"
+    source_file = tmp_path / "blocklists.yml"
+    write_sources(source_file, http_server, ["ads"])
+    db_file = tmp_path / "blocklists.db"
+    blocklists.Blocklists(db_file=db_file, source_file=source_file)
+
+    del http_server.files["/ads.txt"]
+    domains = blocklists.Blocklists(
+        db_file=db_file, source_file=source_file, max_age_days=-1
+    ).get_domains()
+    assert "ads.example.com" in domains
+
+
+def test_snapshot_follows_removed_lists(tmp_path, http_server):
+    http_server.files["/ads.txt"] = "||ads.example.com^\n"
+    http_server.files["/hosts.txt"] = "0.0.0.0 tracker.com\n"
+    source_file = tmp_path / "blocklists.yml"
+    write_sources(source_file, http_server, ["ads", "hosts"])
+    db_file = tmp_path / "blocklists.db"
+
+    domains = blocklists.Blocklists(
+        db_file=db_file, source_file=source_file, snapshot=True
+    ).get_domains()
+    assert isinstance(domains, blocklists.BlocklistSnapshot)
+    assert "tracker.com" in domains and "ads.example.com" in domains
+
+    # the remaining list is unchanged (304), the removed one has to go
+    write_sources(source_file, http_server, ["ads"])
+    domains = blocklists.Blocklists(
+        db_file=db_file, source_file=source_file, snapshot=True, max_age_days=-1
+    ).get_domains()
+    assert "tracker.com" not in domains
+    assert "ads.example.com" in domains
+
+
+def test_read_only_never_fetches(tmp_path, http_server):
+    http_server.files["/ads.txt"] = "||ads.example.com^\n"
+    source_file = tmp_path / "blocklists.yml"
+    write_sources(source_file, http_server, ["ads"])
+    db_file = tmp_path / "blocklists.db"
+
+    with pytest.raises(Exception, match="No blocklists"):
+        blocklists.Blocklists(db_file=db_file, read_only=True)
+
+    blocklists.Blocklists(db_file=db_file, source_file=source_file)
+    http_server.requests.clear()
+    # e.g. workers: stale blocklists are used as they are
+    domains = blocklists.Blocklists(
+        db_file=db_file, source_file=source_file, max_age_days=-1, read_only=True
+    ).get_domains()
+    assert "ads.example.com" in domains
+    assert http_server.requests == []
+
+
+def test_legacy_table_is_kept_when_fetching_fails(tmp_path, http_server):
+    source_file = tmp_path / "blocklists.yml"
+    write_sources(source_file, http_server, ["ads", "hosts"])
+    db_file = tmp_path / "blocklists.db"
+    # the combined table of previous versions
+    conn = sqlite3.connect(db_file)
+    conn.execute("CREATE TABLE blocklists (url TEXT, ids TEXT, last_fetch_time TEXT)")
+    conn.executemany(
+        "INSERT INTO blocklists VALUES (?, ?, ?)",
+        [("ads.example.com", "ads", "1"), ("tracker.com", "ads,hosts", "1")],
+    )
+    conn.commit()
+    conn.close()
+
+    # the lists are stale and can't be downloaded (404)
+    domains = blocklists.Blocklists(
+        db_file=db_file, source_file=source_file, snapshot=True
+    ).get_domains()
+    assert domains.match("www.tracker.com") == {"ads", "hosts"}
+    assert "ads.example.com" in domains
+    # only the snapshot itself, no temporary files are left behind
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "blocklists.blocklists",
+        "blocklists.db",
+        "blocklists.yml",
+    ]
@@ -0,0 +1,55 @@
+import asyncio
+import pathlib
+import pytest
+from playwright.async_api import async_playwright
+from consentcrawl import consent_managers, crawl
+
+FIXTURE = pathlib.Path(__file__).parent / "fixtures" / "shadow_dom_banners.html"
+
+
+async def detect(banner):
+    """Detect the consent manager of a fixture banner in a real Chromium."""
+    async with async_playwright() as p:
+        try:
+            browser = await p.chromium.launch()
+        except Exception as e:
+            pytest.skip(f"Chromium is not available: {str(e).splitlines()[0]}")
+
+        page = await browser.new_page()
+        await page.goto(f"{FIXTURE.as_uri()}#banner={banner}")
+        registry = consent_managers.ConsentManagerRegistry()
+
+        detected = {}
+        for detection in ["script", "locator"]:
+            cmp, locator, selector = await crawl.find_consent_manager(
+                page, registry.get_consent_managers(), detection=detection
+            )
+            detected[detection] = (cmp.id if cmp else None, selector)
+
+        detected["wait"] = await page.evaluate(
+            crawl.WAIT_FOR_CONSENT_MANAGER_SCRIPT,
+            [cmp.rule for cmp in registry.get_consent_managers()],
+        )
+        await browser.close()
+        return detected
+
+
+@pytest.mark.parametrize(
+    "banner,selector",
+    [
+        ("usercentrics", "[data-testid='uc-accept-all-button']"),
+        ("cmm", "cmm-cookie-banner .button--accept-all"),
+    ],
+)
+def test_consent_manager_in_shadow_dom(banner, selector):
+    detected = asyncio.run(detect(banner))
+    # the detection script finds the same button as Playwright's locators
+    assert detected["script"] == ("usercentrics", selector)
+    assert detected["locator"] == ("usercentrics", selector)
+    assert detected["wait"] is True
+
+
+def test_no_consent_manager_without_banner():
+    detected = asyncio.run(detect("none"))
+    assert detected["script"] == (None, None)
+    assert detected["wait"] is False
@@ -0,0 +1,88 @@
+import io
+import json
+import os
+import pytest
+from consentcrawl import crawl, export
+
+
+def result(domain, **kwargs):
+    return {
+        **{column: None for column in crawl.get_extract_schema()},
+        "id": domain,
+        "url": f"https://{domain}",
+        "domain_name": domain,
+        "extraction_datetime": "2024-05-01T12:00:00",
+        "cookies_all": [{"name": "_ga", "domain": f".{domain}", "expires_days": 730}],
+        "third_party_domains_all": ["google-analytics.com"],
+        "consent_manager": {"id": "onetrust", "name": "OneTrust", "actions": []},
+        "meta_tags": {"description": "Example"},
+        "json_ld": [{"@type": "Organization"}],
+        "timings": {"navigation": 1200, "total": 3400},
+        "status": "success",
+        **kwargs,
+    }
+
+
+def test_ndjson_writes_a_line_per_result():
+    output = io.StringIO()
+    exporter = export.NDJSONExporter(output)
+    exporter.write_result(result("example.com"))
+    exporter.write_result(result("example.org", status="error"))
+    exporter.close()
+    exporter.write_result(result("example.net"))
+
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [line["url"] for line in lines] == [
+        "https://example.com",
+        "https://example.org",
+    ]
+    assert lines[0]["consent_manager"]["id"] == "onetrust"
+    assert lines[1]["status"] == "error"
+
+
+def test_ndjson_stops_writing_when_the_output_is_closed():
+    class ClosedPipe(io.StringIO):
+        def write(self, text):
+            raise BrokenPipeError()
+
+    exporter = export.NDJSONExporter(ClosedPipe())
+    # doesn't fail the crawl
+    exporter.write_result(result("example.com"))
+    assert exporter.closed
+
+
+def test_parquet_needs_pyarrow(tmp_path):
+    try:
+        export.load_pyarrow()
+        pytest.skip("pyarrow is installed")
+    except Exception:
+        pass
+    with pytest.raises(Exception, match="pyarrow"):
+        export.ParquetExporter(directory=str(tmp_path))
+
+
+def test_parquet_has_typed_columns(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    exporter = export.ParquetExporter(directory=str(tmp_path), row_group_size=2)
+    for i in range(5):
+        exporter.write_result(result(f"site{i}.com"))
+    exporter.write_result(result("error.com", status="error", consent_manager=None))
+    exporter.close()
+
+    assert exporter.stats == {"rows": 6, "row_groups": 3, "errors": 0}
+    # only complete files are in the directory
+    assert os.listdir(tmp_path) == [os.path.basename(exporter.files[0])]
+
+    table = pyarrow.parquet.read_table(exporter.files[0])
+    assert table.num_rows == 6
+    rows = table.to_pylist()
+    assert rows[0]["cookies_all"] == [
+        {"name": "_ga", "domain": ".site0.com", "expires_days": 730}
+    ]
+    assert rows[0]["consent_manager"]["id"] == "onetrust"
+    assert dict(rows[0]["timings"]) == {"navigation": 1200, "total": 3400}
+    # columns without a type are JSON
+    assert json.loads(rows[0]["json_ld"]) == [{"@type": "Organization"}]
+    assert rows[-1]["consent_manager"] is None
@@ -0,0 +1,57 @@
+import time
+from consentcrawl import journal, storage
+
+
+def store(journal_, db_file, urls, status="success"):
+    """Take `urls` from the filter and store their results."""
+    writer = storage.ResultWriter(
+        db_file, flush_interval=0.05, on_flush=journal_.on_flush
+    )
+    writer.put([{"url": url, "status": status} for url in urls])
+    writer.close()
+
+
+def test_same_site_urls_are_all_crawled(tmp_path):
+    db_file = str(tmp_path / "results.db")
+    crawl_journal = journal.CrawlJournal(db_file)
+    urls = ["example.com/a", "example.com/b", "other.com"]
+    assert list(crawl_journal.filter(urls)) == urls
+    store(crawl_journal, db_file, urls)
+
+    # a later chunk of the same run also crawls sites that are done
+    assert list(crawl_journal.filter(["example.com/c"])) == ["example.com/c"]
+    crawl_journal.close()
+
+
+def test_resume_skips_sites_that_are_done(tmp_path):
+    db_file = str(tmp_path / "results.db")
+    crawl_journal = journal.CrawlJournal(db_file)
+    urls = ["a.com", "b.com/x", "b.com/y", "c.com"]
+    taken = crawl_journal.filter(urls)
+    assert [next(taken), next(taken)] == ["a.com", "b.com/x"]
+    store(crawl_journal, db_file, ["a.com"])
+    crawl_journal.close()
+
+    # a.com was stored before the crash, b.com and c.com weren't
+    time.sleep(0.01)
+    crawl_journal = journal.CrawlJournal(db_file, resume=True)
+    assert list(crawl_journal.filter(urls)) == ["b.com/x", "b.com/y", "c.com"]
+    assert crawl_journal.stats["skipped_done"] == 1
+    crawl_journal.close()
+
+
+def test_max_age_skips_fresh_results(tmp_path):
+    db_file = str(tmp_path / "results.db")
+    crawl_journal = journal.CrawlJournal(db_file)
+    list(crawl_journal.filter(["a.com", "b.com"]))
+    store(crawl_journal, db_file, ["a.com"])
+    store(crawl_journal, db_file, ["b.com"], status="error")
+    crawl_journal.finish()
+    assert crawl_journal.get_states() == {"done": 1, "error": 1}
+    crawl_journal.close()
+
+    # a new run only skips the site with a successful result
+    crawl_journal = journal.CrawlJournal(db_file, max_age=3600)
+    assert list(crawl_journal.filter(["a.com", "b.com"])) == ["b.com"]
+    assert crawl_journal.stats["skipped_fresh"] == 1
+    crawl_journal.close()
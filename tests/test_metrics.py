@@ -0,0 +1,129 @@
+import asyncio
+import time
+import urllib.request
+from consentcrawl import crawl, metrics
+
+
+def test_phase_timer():
+    timer = metrics.PhaseTimer()
+    time.sleep(0.02)
+    timer.mark("navigation")
+    timer.mark("screenshots")
+    time.sleep(0.02)
+    timer.mark("screenshots")
+    timings = timer.finish()
+
+    assert set(timings) == {"navigation", "screenshots", "total"}
+    assert timings["navigation"] >= 20 and timings["screenshots"] >= 20
+    assert timings["total"] >= timings["navigation"] + timings["screenshots"] - 1
+
+
+def test_get_error_class():
+    assert (
+        metrics.get_error_class(
+            "page.goto: net::ERR_NAME_NOT_RESOLVED at https://example.com"
+        )
+        == "net::ERR_NAME_NOT_RESOLVED"
+    )
+    assert metrics.get_error_class("Timeout 90000ms exceeded.") == "Timeout"
+    assert (
+        metrics.get_error_class("Target page, context or browser has been closed")
+        == "Target page"
+    )
+    assert metrics.get_error_class("Something else") == "other"
+    assert metrics.get_error_class(None) == "other"
+
+
+def test_record_results():
+    crawl_metrics = metrics.Metrics()
+    crawl_metrics.record_result(
+        {
+            "status": "success",
+            "consent_manager": {"id": "onetrust"},
+            "timings": {"navigation": 700, "total": 3000},
+        }
+    )
+    crawl_metrics.record_result({"status": "success", "consent_manager": None})
+    crawl_metrics.record_result(
+        {"status": "error", "status_msg": "net::ERR_NAME_NOT_RESOLVED"}
+    )
+    crawl_metrics.record_retry({"status": "error", "status_msg": "Timeout"})
+    crawl_metrics.record_write(3, 0.02)
+
+    summary = crawl_metrics.to_dict()
+    assert summary["crawls"] == {"success": 2, "error": 1}
+    assert summary["errors"] == {"net::ERR_NAME_NOT_RESOLVED": 1}
+    assert summary["retries"] == {"Timeout": 1}
+    assert summary["consent_managers"] == {"onetrust": 1, "none": 1}
+    assert summary["rows_written"] == 3
+    # p95 is the upper bound of its bucket
+    assert summary["durations_ms"]["navigation"] == {
+        "count": 1,
+        "mean": 700,
+        "p95": 1000,
+    }
+
+    histogram = crawl_metrics.histograms["phase:total"]
+    assert histogram.count == 1 and histogram.sum == 3
+    assert histogram.counts == [0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1]
+
+    crawl_metrics.reset()
+    assert crawl_metrics.to_dict()["crawls"] == {}
+
+
+def test_prometheus_text():
+    crawl_metrics = metrics.Metrics()
+    crawl_metrics.crawl_started()
+    crawl_metrics.record_result(
+        {
+            "status": "success",
+            "consent_manager": {"id": 'say "yes"'},
+            "timings": {"navigation": 700},
+        }
+    )
+    crawl_metrics.record_write(1, 0.02)
+    text = crawl_metrics.to_prometheus()
+    lines = text.splitlines()
+
+    assert "# TYPE consentcrawl_pages_in_flight gauge" in lines
+    assert "consentcrawl_pages_in_flight 1" in lines
+    assert 'consentcrawl_crawls_total{status="success"} 1' in lines
+    assert (
+        'consentcrawl_consent_managers_total{consent_manager="say \\"yes\\""} 1'
+        in lines
+    )
+    assert "consentcrawl_rows_written_total 1" in lines
+    assert 'consentcrawl_phase_seconds_bucket{phase="navigation",le="0.5"} 0' in lines
+    assert 'consentcrawl_phase_seconds_bucket{phase="navigation",le="1"} 1' in lines
+    assert 'consentcrawl_phase_seconds_bucket{phase="navigation",le="+Inf"} 1' in lines
+    assert 'consentcrawl_phase_seconds_count{phase="navigation"} 1' in lines
+    assert 'consentcrawl_db_write_seconds_bucket{le="0.05"} 1' in lines
+    assert "consentcrawl_db_write_seconds_count 1" in lines
+
+    server = crawl_metrics.serve(0, host="127.0.0.1")
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert "consentcrawl_pages_in_flight 1" in response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_crawl_records_metrics(browser):
+    crawl_metrics = metrics.get_metrics()
+    crawl_metrics.reset()
+
+    async def results_function(batch):
+        pass
+
+    urls = [f"https://site{i}.com" for i in range(4)]
+    browser.errors = {"site3.com": ["net::ERR_NAME_NOT_RESOLVED"]}
+    asyncio.run(crawl.crawl_batch(urls, results_function, batch_size=2))
+
+    assert crawl_metrics.in_flight == 0
+    assert crawl_metrics.counters["crawls"] == {"success": 3, "error": 1}
+    assert crawl_metrics.counters["errors"] == {"net::ERR_NAME_NOT_RESOLVED": 1}
+    assert crawl_metrics.histograms["phase:navigation"].count == 3
+    assert crawl_metrics.histograms["phase:total"].count == 4
@@ -0,0 +1,58 @@
+import asyncio
+import pytest
+import fake_playwright
+from consentcrawl import blocklists, crawl, network
+
+
+def test_classifier():
+    classifier = network.RequestClassifier(
+        "example.com",
+        blocklists.DomainIndex({"doubleclick.net": ("ads",)}),
+        keep_request_urls=True,
+    )
+    classifier.add("https://www.example.com/")
+    classifier.add("https://cdn.example.com/app.js")
+    classifier.add("https://stats.g.doubleclick.net/pixel")
+    classifier.consent_given()
+    classifier.add("https://fonts.gstatic.com/font.woff2")
+    classifier.add("data:image/png;base64,AAAA")
+
+    assert classifier.get_third_party_domains("no_consent") == [
+        "stats.g.doubleclick.net"
+    ]
+    assert classifier.get_tracking_domains() == ["doubleclick.net"]
+    assert sorted(classifier.get_third_party_domains()) == [
+        "fonts.gstatic.com",
+        "stats.g.doubleclick.net",
+    ]
+    assert classifier.stats()["requests"] == 5
+    assert len(classifier.request_urls) == 5
+
+
+@pytest.mark.parametrize("backend", network.CAPTURE_BACKENDS)
+def test_capture_backends(backend):
+    async def run():
+        browser = fake_playwright.Browser()
+        browser_context = await browser.new_context()
+        page = await browser_context.new_page()
+        monitor = crawl.NetworkMonitor()
+        capture = network.RequestCapture(
+            network.RequestClassifier("example.com"), backend=backend, monitor=monitor
+        )
+        await capture.start(browser_context, page)
+        await page.goto("https://example.com/")
+        await asyncio.wait_for(monitor.wait_for_idle(0), 1)
+        await capture.stop()
+        return capture, page, browser_context
+
+    capture, page, browser_context = asyncio.run(run())
+    assert capture.backend == backend
+    # including the request of the cross-origin iframe
+    assert sorted(capture.classifier.get_third_party_domains()) == [
+        "cmp.example.net",
+        "google-analytics.com",
+    ]
+    # listeners and sessions are removed, the context may be reused
+    assert browser_context.cdp_sessions == []
+    assert browser_context.handlers.get("request", []) == []
+    assert page.handlers.get("framenavigated", []) == []
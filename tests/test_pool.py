@@ -0,0 +1,99 @@
+import asyncio
+import fake_playwright
+from consentcrawl import crawl
+
+
+def test_contexts_are_reset_and_reused():
+    async def run():
+        browser = fake_playwright.Browser()
+        pool = await crawl.start_context_pool(browser, 2, reuse_contexts=3)
+        assert len(browser.contexts) == 2
+
+        browser_context, page = await pool.acquire()
+        await page.goto("https://example.com")
+        assert len(await browser_context.cookies()) == 1
+        await pool.release(browser_context)
+
+        # the same context comes back without the state of the previous crawl
+        seen = set()
+        for _ in range(2):
+            reused, page = await pool.acquire()
+            seen.add(reused)
+            assert await reused.cookies() == []
+            assert reused.pages == [page]
+            await pool.release(reused)
+        assert browser_context in seen
+        assert len(browser.contexts) == 2
+
+        stats = pool.get_stats()
+        assert stats["recycled"] == 3 and stats["discarded"] == 0
+        assert stats["contexts_created"] == 2
+        await pool.close()
+        assert browser.contexts == []
+
+    asyncio.run(run())
+
+
+def test_contexts_are_replaced_after_max_uses_or_errors():
+    async def run():
+        browser = fake_playwright.Browser()
+        pool = await crawl.start_context_pool(browser, 1, reuse_contexts=2)
+
+        first, _ = await pool.acquire()
+        await pool.release(first)
+        first, _ = await pool.acquire()
+        await pool.release(first)
+        # used twice
+        second, _ = await pool.acquire()
+        assert second is not first and first not in browser.contexts
+
+        # e.g. after a crawl error
+        await pool.release(second, discard=True)
+        third, _ = await pool.acquire()
+        assert third is not second and browser.contexts == [third]
+        assert pool.get_stats()["discarded"] == 2
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_context_that_cant_be_reset_is_replaced():
+    async def run():
+        browser = fake_playwright.Browser()
+        pool = await crawl.start_context_pool(browser, 1, reuse_contexts=10)
+
+        browser_context, page = await pool.acquire()
+        await page.goto("https://example.com")
+
+        async def clear_cookies():
+            pass
+
+        browser_context.clear_cookies = clear_cookies
+        await pool.release(browser_context)
+
+        replacement, _ = await pool.acquire()
+        assert replacement is not browser_context
+        assert await replacement.cookies() == []
+        stats = pool.get_stats()
+        assert stats["reset_failures"] == 1 and stats["discarded"] == 1
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_crawl_with_reused_contexts(browser):
+    results = []
+
+    async def results_function(batch):
+        results.extend(batch)
+
+    urls = [f"https://site{i}.com" for i in range(8)]
+    asyncio.run(
+        crawl.crawl_batch(urls, results_function, batch_size=2, reuse_contexts=3)
+    )
+
+    assert sorted(r["url"] for r in results) == sorted(urls)
+    assert all(r["status"] == "success" for r in results)
+    # the consent cookie of one site doesn't end up in the next crawl
+    assert all(len(r["cookies_no_consent"]) == 1 for r in results)
+    assert browser.contexts == []
@@ -0,0 +1,90 @@
+import asyncio
+import socket
+import time
+from consentcrawl import preflight
+
+
+def check(urls, **options):
+    checker = preflight.Preflight(concurrency=10, timeout=5, **options)
+    skipped = []
+
+    async def results_function(results):
+        skipped.extend(results)
+
+    async def run():
+        return [url async for url in checker.filter(urls, results_function)]
+
+    try:
+        passed = asyncio.run(run())
+    finally:
+        checker.close()
+    return passed, {r["url"]: r["status"] for r in skipped}, checker.stats
+
+
+def get_closed_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_preflight(http_server):
+    http_server.files["/"] = "<html>Hello</html>"
+    http_server.files["/parked"] = "<html>This domain is for sale!</html>"
+    http_server.redirects["/old"] = f"{http_server.url}/"
+    port = http_server.server_address[1]
+    refused = f"http://127.0.0.1:{get_closed_port()}/"
+
+    passed, skipped, stats = check(
+        [
+            f"{http_server.url}/old",
+            f"http://localhost:{port}/parked",
+            refused,
+            "http://does-not-exist.invalid/",
+        ]
+    )
+    # same-site redirects are resolved up front
+    assert passed == [f"{http_server.url}/"]
+    assert skipped == {
+        f"http://localhost:{port}/parked": "parked",
+        refused: "unreachable",
+        "http://does-not-exist.invalid/": "unreachable",
+    }
+    assert stats["canonicalised"] == 1
+
+
+def test_preflight_passes_on_unchecked_sites(http_server):
+    # a TLS handshake with a plain HTTP server fails, but the site is there
+    url = f"https://localhost:{http_server.server_address[1]}/"
+    passed, skipped, stats = check([url], check_content=False)
+    assert passed == [url]
+    assert skipped == {}
+    assert stats["unchecked"] == 1
+
+
+def test_preflight_passes_on_dns_timeouts(monkeypatch):
+    def slow_getaddrinfo(host, *args):
+        time.sleep(0.5)
+        raise socket.gaierror("too late")
+
+    monkeypatch.setattr(socket, "getaddrinfo", slow_getaddrinfo)
+    passed, skipped, stats = check(["http://slow-dns.example/"], dns_timeout=0.1)
+    assert passed == ["http://slow-dns.example/"]
+    assert skipped == {}
+    assert stats["unchecked"] == 1
+
+
+def test_parked_pattern():
+    for text in [
+        "<h1>This domain is for sale!</h1>",
+        "<p>This domain name may be for sale. Buy this domain</p>",
+        "<script>window.park = 'abc';</script>",
+    ]:
+        assert preflight.PARKED_PATTERN.search(text)
+
+    # legitimate pages that talk about domains for sale
+    for text in [
+        "<h1>Is a domain for sale worth it?</h1><p>Our guide to buying domains for sale and what the seller of a domain name for sale won't tell you.</p>",
+        "<p>Search premium domains for sale, or transfer your domain to us.</p>",
+        "<a href='/park'>Parking</a> <script>window.parkingSpots = 12;</script>",
+    ]:
+        assert not preflight.PARKED_PATTERN.search(text)
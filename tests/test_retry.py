@@ -0,0 +1,120 @@
+import asyncio
+import time
+from consentcrawl import crawl, retry
+
+
+def error(status_msg):
+    return {"url": "https://example.com", "status": "error", "status_msg": status_msg}
+
+
+def test_classify_error():
+    assert retry.classify_error("Timeout 90000ms exceeded.") == "transient"
+    assert (
+        retry.classify_error("page.goto: net::ERR_CONNECTION_RESET at https://a.com")
+        == "transient"
+    )
+    assert retry.classify_error("net::ERR_NAME_NOT_RESOLVED") == "permanent"
+    assert retry.classify_error("net::ERR_CERT_DATE_INVALID") == "permanent"
+    assert retry.classify_error(None) == "permanent"
+
+
+def test_only_transient_errors_are_retried():
+    queue = retry.RetryQueue(max_retries=2, base_delay=0, max_delay=0)
+    assert not queue.add("https://a.com", {"status": "success"})
+    assert not queue.add("https://b.com", error("net::ERR_NAME_NOT_RESOLVED"))
+    assert len(queue) == 0
+
+    assert queue.add("https://c.com", error("Timeout 90000ms exceeded."))
+    assert queue.pop_due() == "https://c.com"
+    assert queue.is_retry("https://c.com")
+    assert not queue.add("https://c.com", {"status": "success"})
+    assert queue.stats == {"retried": 1, "recovered": 1, "failed": 0}
+
+
+def test_retries_are_limited():
+    queue = retry.RetryQueue(max_retries=2, base_delay=0, max_delay=0)
+    result = error("net::ERR_CONNECTION_RESET")
+    assert queue.add("https://a.com", result)
+    assert queue.pop_due() == "https://a.com"
+    assert queue.add("https://a.com", result)
+    assert queue.pop_due() == "https://a.com"
+
+    result = error("net::ERR_CONNECTION_RESET")
+    assert not queue.add("https://a.com", result)
+    assert result["status_msg"] == "net::ERR_CONNECTION_RESET (after 3 attempts)"
+    assert queue.stats == {"retried": 2, "recovered": 0, "failed": 1}
+    assert len(queue) == 0 and not queue.is_retry("https://a.com")
+
+
+def test_retries_wait_for_the_backoff():
+    queue = retry.RetryQueue(max_retries=3, base_delay=0.2, max_delay=10)
+    queue.add("https://a.com", error("Timeout"))
+    assert queue.pop_due() is None
+
+    start_time = time.monotonic()
+    url = asyncio.run(queue.get(active=lambda: False))
+    assert url == "https://a.com"
+    # 0.2s with up to 50% jitter
+    assert 0.05 < time.monotonic() - start_time < 0.5
+
+    # nothing queued and no crawls running that could add URLs
+    assert asyncio.run(queue.get(active=lambda: False)) is None
+
+
+def test_adaptive_timeouts():
+    timeouts = retry.CrawlTimeouts(adaptive=True, navigation=90000, consent=15000)
+    assert timeouts.get() == {"goto_timeout": 90000, "consent_timeout": 15000}
+
+    for ms in range(3000, 5000, 100):
+        timeouts.observe(
+            {
+                "status": "success",
+                "timings": {"navigation": ms, "consent": 500},
+                "consent_manager": {"id": "onetrust"},
+            }
+        )
+    # errors and consent managers that weren't clicked aren't observed
+    timeouts.observe({"status": "error", "timings": {"navigation": 90000}})
+    timeouts.observe(
+        {
+            "status": "success",
+            "timings": {"navigation": 1000, "consent": 15000},
+            "consent_manager": {"id": "onetrust", "status": "error"},
+        }
+    )
+
+    # 3x the 95th percentile (of 21 navigations), at least the minimum
+    assert timeouts.get() == {"goto_timeout": 3 * 4800, "consent_timeout": 3000}
+    # retries get the maximum
+    assert timeouts.get(retry=True) == {"goto_timeout": 90000, "consent_timeout": 15000}
+    # without adaptive timeouts they're fixed
+    assert retry.CrawlTimeouts().get() == {
+        "goto_timeout": 90000,
+        "consent_timeout": 15000,
+    }
+
+
+def test_crawl_retries_transient_errors(browser, fast_retries):
+    browser.errors = {
+        "flaky.com": ["net::ERR_CONNECTION_RESET"],
+        "down.com": ["Timeout 90000ms exceeded."] * 3,
+        "unknown.com": ["net::ERR_NAME_NOT_RESOLVED"],
+    }
+    results = []
+
+    async def results_function(batch):
+        results.extend(batch)
+
+    urls = [f"https://{domain}" for domain in ["flaky.com", "down.com", "unknown.com"]]
+    urls += [f"https://site{i}.com" for i in range(5)]
+    asyncio.run(crawl.crawl_batch(urls, results_function, batch_size=3))
+
+    results = {r["url"]: r for r in results}
+    assert sorted(results) == sorted(urls)
+    assert results["https://flaky.com"]["status"] == "success"
+    assert results["https://down.com"]["status"] == "error"
+    assert "(after 3 attempts)" in results["https://down.com"]["status_msg"]
+    assert results["https://unknown.com"]["status"] == "error"
+    assert browser.calls["https://flaky.com"] == 2
+    assert browser.calls["https://down.com"] == 3
+    assert browser.calls["https://unknown.com"] == 1
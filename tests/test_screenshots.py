@@ -0,0 +1,82 @@
+import asyncio
+import io
+import os
+import pytest
+from consentcrawl import crawl, screenshots
+
+
+def test_screenshots_are_content_addressed(tmp_path):
+    store = screenshots.ScreenshotStore(directory=str(tmp_path))
+    first = store.store(b"before", "no_consent")
+    assert first["format"] == "png"
+    assert first["path"] == f"{first['sha256'][:2]}/{first['sha256']}.png"
+    with open(store.get_path(first), "rb") as f:
+        assert f.read() == b"before"
+
+    # the same screenshot of another crawl isn't written again
+    screenshots.ScreenshotStore(directory=str(tmp_path)).store(b"before", "no_consent")
+    assert len(os.listdir(tmp_path / first["sha256"][:2])) == 1
+
+
+def test_only_identical_screenshots_are_skipped(tmp_path):
+    store = screenshots.ScreenshotStore(directory=str(tmp_path))
+    before = store.store(b"before", "no_consent")
+
+    same = store.store(b"before", "consent", previous=before)
+    assert same["same_as"] == "no_consent" and same["sha256"] == before["sha256"]
+
+    # any difference (e.g. just the banner that's gone) is kept
+    after = store.store(b"before!", "consent", previous=before)
+    assert "same_as" not in after and after["sha256"] != before["sha256"]
+    assert store.stats["similar"] == 1 and store.stats["written"] == 2
+
+
+def test_max_distance_needs_pillow(tmp_path):
+    if screenshots.load_pillow() is not None:
+        pytest.skip("Pillow is installed")
+    with pytest.raises(Exception, match="Pillow"):
+        screenshots.ScreenshotStore(directory=str(tmp_path), max_distance=8)
+
+
+def test_nearly_identical_screenshots(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+
+    def png(banner=True):
+        img = Image.new("L", (640, 480), 255)
+        img.paste(0, (0, 0, 640, 40))
+        if banner:
+            img.paste(128, (80, 280, 560, 460))
+            img.paste(40, (360, 400, 520, 440))
+        return img
+
+    def encode(img):
+        output = io.BytesIO()
+        img.save(output, format="PNG")
+        return output.getvalue()
+
+    store = screenshots.ScreenshotStore(directory=str(tmp_path), max_distance=2)
+    before = store.store(encode(png()), "no_consent")
+    # a one pixel change is nearly identical, the banner that's gone is not
+    changed = png()
+    changed.putpixel((40, 200), 250)
+    assert store.store(encode(changed), "consent", previous=before)["same_as"]
+    assert "same_as" not in store.store(
+        encode(png(banner=False)), "consent", previous=before
+    )
+
+
+def test_crawl_stores_screenshot_references(browser, tmp_path):
+    store = screenshots.ScreenshotStore(directory=str(tmp_path))
+
+    async def run():
+        result = await crawl.crawl_url("https://example.com", browser, screenshot=store)
+        store.close()
+        return result
+
+    result = asyncio.run(run())
+    assert result["status"] == "success"
+    before, after = result["screenshot_files"]
+    assert before["phase"] == "no_consent" and "fingerprint" not in before
+    # the fake browser takes the same screenshot after consent
+    assert after["phase"] == "consent" and after["same_as"] == "no_consent"
+    assert os.path.isfile(store.get_path(before))
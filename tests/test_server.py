@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+from consentcrawl import metrics, server
+
+
+def run_service(test, **options):
+    async def run():
+        service = server.CrawlService(**options)
+        await service.start()
+        try:
+            return await test(service)
+        finally:
+            await service.close()
+
+    return asyncio.run(run())
+
+
+def test_requests_for_a_site_are_coalesced(browser):
+    browser.delay = 0.2
+
+    async def test(service):
+        return await asyncio.gather(
+            *[service.crawl("example.com") for _ in range(5)],
+            service.crawl("https://example.com/"),
+            service.crawl("example.org"),
+        )
+
+    results = run_service(test)
+    assert all(r["status"] == "success" for r in results)
+    assert len({id(r) for r in results[:6]}) == 1
+    assert sum(browser.calls.values()) == 2
+
+
+def test_results_are_cached(browser):
+    async def test(service):
+        first = await service.crawl("example.com")
+        second = await service.crawl("example.com")
+        return first, second, service.get_stats()
+
+    first, second, stats = run_service(test)
+    assert first is second
+    assert sum(browser.calls.values()) == 1
+    assert stats["cache_hits"] == 1
+
+    # errors aren't cached
+    browser.errors["example.net"] = ["net::ERR_CONNECTION_RESET"]
+
+    async def test(service):
+        return [(await service.crawl("example.net"))["status"] for _ in range(2)]
+
+    assert run_service(test) == ["error", "success"]
+
+
+def test_full_queue_is_rejected(browser):
+    browser.delay = 0.5
+
+    async def test(service):
+        # one URL is crawled, two wait in the queue
+        futures = [service.submit("site0.com")]
+        await asyncio.sleep(0.1)
+        futures += [service.submit(f"site{i}.com") for i in [1, 2]]
+        with pytest.raises(server.ServiceBusy):
+            service.submit("site3.com")
+        with pytest.raises(server.ServiceBusy):
+            service.submit_batch(["site4.com", "site5.com"])
+        # URLs that are already queued don't need room
+        job_id = service.submit_batch(["site1.com", "site2.com"])
+        await asyncio.gather(*futures)
+        return service.get_job(job_id), service.get_stats()
+
+    job, stats = run_service(test, max_in_flight=1, max_queue=2)
+    assert job["status"] == "done" and job["done"] == 2
+    assert stats["rejected"] == 2
+    assert sum(browser.calls.values()) == 3
+
+
+def test_failed_crawls_leave_no_pages_in_flight(browser, monkeypatch):
+    async def crawl_url(url, **kwargs):
+        raise Exception("Browser closed")
+
+    monkeypatch.setattr(server.crawl, "crawl_url", crawl_url)
+    crawl_metrics = metrics.get_metrics()
+    in_flight = crawl_metrics.in_flight
+
+    async def test(service):
+        with pytest.raises(Exception, match="Browser closed"):
+            await service.crawl("example.com")
+
+    run_service(test)
+    assert crawl_metrics.in_flight == in_flight
@@ -0,0 +1,67 @@
+import asyncio
+import os
+import fake_playwright
+from consentcrawl import crawl, metrics, sharding
+
+
+def run_fake_shard(*args):
+    """
+    Shard whose crawls take 50 ms; crawling crash.com kills it once (or every
+    time without a marker file).
+    """
+    marker = os.environ.get("CONSENTCRAWL_TEST_MARKER")
+
+    async def crawl_url(url, browser, **kwargs):
+        await asyncio.sleep(0.05)
+        if url == "crash.com" and not (marker and os.path.exists(marker)):
+            if marker:
+                open(marker, "w").close()
+            os._exit(1)
+        return {"url": url, "status": "success", "pid": os.getpid()}
+
+    crawl.crawl_url = crawl_url
+    fake_playwright.install(fake_playwright.Browser(), sharding)
+    sharding.run_shard(*args)
+
+
+def test_crashed_shard_is_restarted(tmp_path, monkeypatch):
+    monkeypatch.setenv("CONSENTCRAWL_TEST_MARKER", str(tmp_path / "crashed"))
+    monkeypatch.setattr(sharding, "run_shard", run_fake_shard)
+
+    results = []
+
+    async def results_function(batch):
+        results.extend(batch)
+
+    urls = ["crash.com"] + [f"site{i}.com" for i in range(99)]
+    asyncio.run(sharding.crawl_sharded(urls, results_function, shards=2, batch_size=2))
+
+    assert sorted(r["url"] for r in results) == sorted(urls)
+    assert all(r["status"] == "success" for r in results)
+    # the crash is noticed while the other shard keeps sending results, not
+    # only once everything else is done
+    assert [r["url"] for r in results].index("crash.com") < len(urls) - 10
+
+
+def test_url_that_keeps_crashing_shards_is_an_error(monkeypatch):
+    monkeypatch.delenv("CONSENTCRAWL_TEST_MARKER", raising=False)
+    monkeypatch.setattr(sharding, "run_shard", run_fake_shard)
+    crawl_metrics = metrics.get_metrics()
+    crawl_metrics.reset()
+
+    results = []
+
+    async def results_function(batch):
+        results.extend(batch)
+
+    # one crawl per shard at a time, so only crash.com is in flight when it
+    # crashes
+    urls = ["crash.com"] + [f"site{i}.com" for i in range(9)]
+    asyncio.run(sharding.crawl_sharded(urls, results_function, shards=2, batch_size=1))
+
+    statuses = {r["url"]: r["status"] for r in results}
+    assert statuses.pop("crash.com") == "error"
+    assert set(statuses.values()) == {"success"}
+    # the error counts like any other result, no crawls are left in flight
+    assert crawl_metrics.counters["crawls"] == {"success": 9, "error": 1}
+    assert crawl_metrics.in_flight == 0
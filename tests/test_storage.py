@@ -0,0 +1,132 @@
+import sqlite3
+import time
+import pytest
+from consentcrawl import journal, query, storage
+
+
+def result(domain, third_parties=(), cookies=(), consent_manager=None):
+    return {
+        "id": domain,
+        "url": f"https://{domain}",
+        "domain_name": domain,
+        "extraction_datetime": "2024-01-01T00:00:00",
+        "third_party_domains_all": list(third_parties),
+        "third_party_domains_no_consent": list(third_parties),
+        "tracking_domains_all": [],
+        "tracking_domains_no_consent": [],
+        "cookies_all": [{"name": c, "domain": f".{domain}"} for c in cookies],
+        "cookies_no_consent": [{"name": c, "domain": f".{domain}"} for c in cookies],
+        "consent_manager": consent_manager,
+        "status": "success",
+    }
+
+
+def test_crawl_ids_survive_vacuum(tmp_path):
+    db_file = str(tmp_path / "results.db")
+    writer = storage.ResultWriter(db_file, flush_interval=0.05, normalise=True)
+    writer.put(
+        [
+            result("a.com", third_parties=["cdn.net"], cookies=["_ga"]),
+            result("b.com"),
+            result("c.com", third_parties=["cdn.net"], consent_manager={"id": "cmp"}),
+        ]
+    )
+    writer.close()
+
+    conn = sqlite3.connect(db_file)
+    with conn:
+        conn.execute("DELETE FROM crawl_results WHERE domain_name = 'a.com'")
+        conn.execute(
+            "DELETE FROM crawl_results_domains WHERE crawl_id NOT IN (SELECT crawl_id FROM crawl_results)"
+        )
+        conn.execute(
+            "DELETE FROM crawl_results_cookies WHERE crawl_id NOT IN (SELECT crawl_id FROM crawl_results)"
+        )
+        conn.execute(
+            "DELETE FROM crawl_results_consent_managers WHERE crawl_id NOT IN (SELECT crawl_id FROM crawl_results)"
+        )
+    conn.execute("VACUUM")
+
+    assert [r["domain_name"] for r in query.sites_loading_domain(conn, "cdn.net")] == [
+        "c.com"
+    ]
+    assert query.sites_with_cookies_before_consent(conn) == []
+    assert query.sites_without_consent_manager(conn)[0]["domain_name"] == "b.com"
+    assert {
+        r["consent_manager_id"]: r["sites"] for r in query.consent_managers(conn)
+    } == {
+        "cmp": 1,
+        None: 1,
+    }
+    conn.close()
+
+
+def test_results_table_without_crawl_id_is_migrated(tmp_path):
+    db_file = str(tmp_path / "results.db")
+    conn = sqlite3.connect(db_file)
+    # the results table of older versions, using the rowid as crawl id
+    conn.execute("CREATE TABLE crawl_results (id TEXT, domain_name TEXT, status TEXT)")
+    conn.execute("CREATE INDEX crawl_results_status ON crawl_results (status)")
+    conn.executemany(
+        "INSERT INTO crawl_results VALUES (?, ?, 'success')",
+        [("a", "a.com"), ("b", "b.com"), ("c", "c.com")],
+    )
+    conn.execute("DELETE FROM crawl_results WHERE id = 'a'")
+    conn.commit()
+
+    storage.create_results_table(conn)
+    assert conn.execute(
+        "SELECT crawl_id, domain_name FROM crawl_results ORDER BY crawl_id"
+    ).fetchall() == [(2, "b.com"), (3, "c.com")]
+    assert (
+        conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE name = 'crawl_results_status'"
+        ).fetchone()[0]
+        == 1
+    )
+
+    # new crawls continue after the existing ids
+    with conn:
+        assert storage.insert_results(conn, "crawl_results", [result("d.com")]) == [4]
+    conn.close()
+
+
+def test_failed_flushes_are_retried(tmp_path):
+    db_file = str(tmp_path / "results.db")
+    failures = [Exception("database is locked")]
+
+    def on_flush(conn, rows):
+        if failures:
+            raise failures.pop()
+
+    writer = storage.ResultWriter(db_file, on_flush=on_flush, retry_delay=0.01)
+    writer.put([result("a.com"), result("b.com")])
+    writer.close()
+    assert writer.stats["errors"] == 1 and writer.stats["rows"] == 2
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT COUNT(*) FROM crawl_results").fetchone()[0] == 2
+    conn.close()
+
+
+def test_lost_results_fail_loudly(tmp_path):
+    db_file = str(tmp_path / "results.db")
+    crawl_journal = journal.CrawlJournal(db_file)
+    list(crawl_journal.filter(["a.com"]))
+
+    def on_flush(conn, rows):
+        crawl_journal.on_flush(conn, rows)
+        raise Exception("disk I/O error")
+
+    writer = storage.ResultWriter(
+        db_file, on_flush=on_flush, flush_interval=0.01, max_retries=1, retry_delay=0.01
+    )
+    writer.put([result("a.com")])
+    time.sleep(0.2)
+    with pytest.raises(Exception, match="Unable to store 1 results"):
+        writer.put([result("b.com")])
+    with pytest.raises(Exception, match="disk I/O error"):
+        writer.close()
+
+    # nothing of the batch is stored, so --resume crawls the URL again
+    assert crawl_journal.get_states() == {"pending": 1}
+    crawl_journal.close()
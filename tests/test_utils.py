@@ -0,0 +1,17 @@
+from consentcrawl import utils
+
+
+def test_bloom_filter_is_exact_for_small_inputs():
+    seen = utils.BloomFilter()
+    assert list(utils.dedupe(["a.com", "b.com", "a.com"], seen)) == ["a.com", "b.com"]
+    assert seen.bits is None
+    assert "a.com" in seen and "c.com" not in seen
+
+
+def test_bloom_filter_takes_over_from_the_set():
+    seen = utils.BloomFilter(capacity=1000, exact_limit=10)
+    urls = [f"site{i}.com" for i in range(100)]
+    assert list(utils.dedupe(urls + urls, seen)) == urls
+    assert seen.bits is not None and len(seen.items) == 0
+    assert all(url in seen for url in urls)
+    assert seen.count == 100
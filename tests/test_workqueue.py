@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import multiprocessing
+import sqlite3
+import pytest
+import fake_playwright
+from consentcrawl import crawl, retry, workqueue
+
+
+def test_lease_is_exclusive(tmp_path):
+    work_queue = workqueue.SQLiteWorkQueue(tmp_path / "queue.db")
+    assert work_queue.add(["a.com", "b.com", "b.com", "c.com"]) == 3
+
+    first = work_queue.lease("w1", 2)
+    second = work_queue.lease("w2", 2)
+    assert len(first) == 2 and len(second) == 1
+    assert not {i for i, _ in first} & {i for i, _ in second}
+
+    states = work_queue.get_states()
+    assert states["leased"] == 3 and states["pending"] == 0
+    assert work_queue.get_states(exclude_worker="w1")["leased"] == 1
+
+    # only the worker that holds the lease can complete it
+    crawl_id, url = second[0]
+    result = {"id": crawl_id, "url": url, "status": "success"}
+    assert work_queue.complete("w1", [result]) == []
+    assert work_queue.complete("w2", [result]) == [result]
+    assert work_queue.get_states()["done"] == 1
+    work_queue.close()
+
+
+def test_expired_leases_are_retaken(tmp_path):
+    work_queue = workqueue.SQLiteWorkQueue(
+        tmp_path / "queue.db", lease_time=-1, max_attempts=2
+    )
+    work_queue.add(["a.com"])
+    assert len(work_queue.lease("w1", 1)) == 1
+    assert len(work_queue.lease("w2", 1)) == 1
+    # given up on after max_attempts
+    assert work_queue.lease("w3", 1) == []
+    assert work_queue.get_states()["error"] == 1
+    work_queue.close()
+
+
+def run_worker(db_file, worker_id, errors):
+    """Worker process with a fake browser."""
+    logging.basicConfig(level=logging.INFO)
+    fake_playwright.install(fake_playwright.Browser(errors=errors), crawl)
+    retry.RetryQueue.__init__.__defaults__ = (2, 0.05, 0.1)
+    work_queue = workqueue.SQLiteWorkQueue(db_file, lease_time=5)
+    stats = asyncio.run(
+        workqueue.run_worker(
+            work_queue,
+            worker_id=worker_id,
+            batch_size=3,
+            poll_interval=0.1,
+            heartbeat_interval=0.5,
+        )
+    )
+    work_queue.close()
+    assert stats["lost"] == 0
+
+
+def test_workers_retry_transient_errors(tmp_path):
+    db_file = str(tmp_path / "queue.db")
+    work_queue = workqueue.SQLiteWorkQueue(db_file)
+    urls = [f"site{i}.com" for i in range(30)]
+    work_queue.add(urls)
+
+    # the first load of flaky.com fails in every worker, whichever leases it
+    # retries it while still holding its lease
+    work_queue.add(["flaky.com"])
+    errors = {"flaky.com": ["net::ERR_CONNECTION_RESET"]}
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [
+        ctx.Process(target=run_worker, args=(db_file, f"w{i}", errors))
+        for i in range(2)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=30)
+        if process.is_alive():
+            process.kill()
+    assert [process.exitcode for process in processes] == [0, 0]
+
+    assert work_queue.get_states() == {
+        "pending": 0,
+        "leased": 0,
+        "done": 31,
+        "error": 0,
+    }
+    conn = sqlite3.connect(db_file)
+    assert conn.execute(
+        "SELECT COUNT(*), COUNT(DISTINCT id) FROM crawl_results"
+    ).fetchone() == (31, 31)
+    assert conn.execute(
+        "SELECT status FROM crawl_results WHERE domain_name = 'flaky.com'"
+    ).fetchone() == ("success",)
+    conn.close()
+    work_queue.close()
+
+
+def test_work_queue_interface_is_abstract():
+    class PartialQueue(workqueue.WorkQueue):
+        def add(self, urls):
+            return 0
+
+    with pytest.raises(TypeError):
+        PartialQueue()